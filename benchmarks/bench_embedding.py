@@ -0,0 +1,65 @@
+"""
+Benchmark document embedding throughput: the original one-call-per-document pipeline loop
+versus TeapotAI's batched, length-bucketed embedding engine.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_embedding.py --num-docs 2000 --batch-size 32
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from transformers import pipeline
+
+from teapotai import TeapotAI, TeapotAISettings
+from teapotai.teapotai import DEFAULT_EMBEDDING_MODEL
+
+WORDS = "the a of and to in is tower paris rome capital city water boils built meters tall history".split()
+
+
+def make_documents(num_docs, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 300))) for _ in range(num_docs)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--embedding-model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--model", default=None, help="Seq2seq model path (defaults to TeapotLLM)")
+    parser.add_argument("--num-docs", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    embedding_model = pipeline("feature-extraction", model=args.embedding_model, truncation=True)
+    model_kwargs = {}
+    if args.model is not None:
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+        model_kwargs = {
+            "model": AutoModelForSeq2SeqLM.from_pretrained(args.model),
+            "tokenizer": AutoTokenizer.from_pretrained(args.model),
+        }
+    teapot_ai = TeapotAI(
+        embedding_model=embedding_model,
+        settings=TeapotAISettings(verbose=False, embedding_batch_size=args.batch_size),
+        **model_kwargs,
+    )
+    documents = make_documents(args.num_docs)
+
+    start = time.perf_counter()
+    before = np.array([embedding_model(doc)[0][0] for doc in documents])
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    after = teapot_ai._generate_document_embeddings(documents)
+    batched_seconds = time.perf_counter() - start
+
+    print(f"documents:        {len(documents)}")
+    print(f"per-doc loop:     {len(documents) / loop_seconds:10.1f} docs/sec")
+    print(f"batched (bs={args.batch_size:<3}): {len(documents) / batched_seconds:10.1f} docs/sec")
+    print(f"speedup:          {loop_seconds / batched_seconds:10.2f}x")
+    print(f"max abs diff:     {np.abs(before - after).max():10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark memory per chunk and recall of compressed embedding storage.
+
+Compares float32, float16 and int8 document embeddings (see CompressedEmbeddings) on
+synthetic clustered unit vectors, and a Python list of chunk texts against a ChunkStore.
+Recall@k is measured against exact float32 search; with --rerank, int8 candidates are also
+re-scored at full precision, as TeapotAI does with the `embedding_rerank` setting.
+
+No model is needed: embeddings are drawn around random centroids, so neighbours are close
+in score the way real sentence embeddings are.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_embedding_storage.py --num-chunks 200000 --dim 384
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from teapotai.index import normalize_embeddings, rerank, ChunkStore, CompressedEmbeddings, ExactSearch
+
+WORDS = "the a of and to in is tower paris rome capital city water boils built meters tall history".split()
+
+
+def make_embeddings(num_chunks: int, dim: int, num_clusters: int, spread: float, rng: np.random.Generator) -> np.ndarray:
+    centroids = normalize_embeddings(rng.standard_normal((num_clusters, dim), dtype=np.float32))
+    embeddings = np.empty((num_chunks, dim), dtype=np.float32)
+    for start in range(0, num_chunks, 65536):
+        end = min(start + 65536, num_chunks)
+        labels = rng.integers(num_clusters, size=end - start)
+        noise = rng.standard_normal((end - start, dim), dtype=np.float32) * spread / np.sqrt(dim)
+        embeddings[start:end] = normalize_embeddings(centroids[labels] + noise)
+    return embeddings
+
+
+def list_nbytes(chunks) -> int:
+    # The list's pointer array plus every str object
+    return sys.getsizeof(chunks) + sum(sys.getsizeof(chunk) for chunk in chunks)
+
+
+def recall(results, reference, k: int) -> float:
+    hits = sum(len(set(indices.tolist()) & set(expected.tolist())) for (indices, _), (expected, _) in zip(results, reference))
+    return hits / (k * len(reference))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--num-chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--num-clusters", type=int, default=1000)
+    parser.add_argument("--spread", type=float, default=0.5, help="Noise around each cluster centroid")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--rerank", type=int, nargs="*", default=[10, 30], help="Candidates re-scored at full precision")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = make_embeddings(args.num_chunks, args.dim, args.num_clusters, args.spread, rng)
+    queries = embeddings[rng.choice(args.num_chunks, args.num_queries, replace=False)]
+    queries = normalize_embeddings(queries + rng.standard_normal(queries.shape, dtype=np.float32) * args.spread / np.sqrt(args.dim))
+
+    print(f"{args.num_chunks} chunks, dim {args.dim}, recall@{args.k} against exact float32 search")
+    start = time.perf_counter()
+    reference = ExactSearch(embeddings).search_batch(queries, args.k)
+    float32_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"{'float32':16} {embeddings.nbytes / args.num_chunks:8.1f} bytes/chunk  recall 1.000  {float32_ms:7.2f} ms/query")
+
+    for storage in ("float16", "int8"):
+        compressed = CompressedEmbeddings.encode(embeddings, storage)
+        search = ExactSearch(compressed)
+        start = time.perf_counter()
+        results = search.search_batch(queries, args.k)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"{storage:16} {compressed.nbytes / args.num_chunks:8.1f} bytes/chunk  recall {recall(results, reference, args.k):.3f}  {elapsed_ms:7.2f} ms/query")
+        if storage != "int8":
+            continue
+        for num_candidates in args.rerank:
+            # The original rows stand in for re-embedding the candidate chunks
+            candidates = search.search_batch(queries, max(args.k, num_candidates))
+            reranked = [rerank(query, indices, embeddings[indices], args.k) for query, (indices, _) in zip(queries, candidates)]
+            print(f"{f'int8 rerank {num_candidates}':16} {compressed.nbytes / args.num_chunks:8.1f} bytes/chunk  recall {recall(reranked, reference, args.k):.3f}")
+
+    text_rng = random.Random(0)
+    chunks = [" ".join(text_rng.choice(WORDS) for _ in range(text_rng.randint(20, 120))) for _ in range(args.num_chunks)]
+    store = ChunkStore(chunks)
+    print(f"{'chunk text list':16} {list_nbytes(chunks) / args.num_chunks:8.1f} bytes/chunk")
+    print(f"{'ChunkStore':16} {store.nbytes / args.num_chunks:8.1f} bytes/chunk")
+
+
+if __name__ == "__main__":
+    main()
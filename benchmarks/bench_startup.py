@@ -0,0 +1,71 @@
+"""
+Benchmark `import teapotai` and TeapotAI startup time in fresh interpreters.
+
+Each measurement runs in a new process so module caches do not hide import costs. The
+script exits with status 1 if importing teapotai pulls in a heavy dependency, or if a
+measurement exceeds its --max-* budget, so it can guard against regressions in CI.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_startup.py --repeat 5 --max-import-ms 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ["torch", "transformers", "sklearn", "joblib", "langsmith", "pkg_resources"]
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import teapotai
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+STARTUP_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+from teapotai import TeapotAI, TeapotAISettings
+teapot_ai = TeapotAI(settings=TeapotAISettings(verbose=False))
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(snippet, repeat):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", snippet], check=True, capture_output=True, text=True, env=os.environ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return statistics.median(run["seconds"] for run in runs) * 1000, runs[-1]["loaded"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-startup-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    failures = []
+    for name, snippet, budget in [
+        ("import teapotai", IMPORT_SNIPPET, args.max_import_ms),
+        ("TeapotAI() without documents", STARTUP_SNIPPET, args.max_startup_ms),
+    ]:
+        milliseconds, loaded = measure(snippet, args.repeat)
+        print(f"{name + ':':32} {milliseconds:8.1f} ms (median of {args.repeat})  heavy modules loaded: {loaded or 'none'}")
+        if loaded:
+            failures.append(f"{name} imported {', '.join(loaded)}")
+        if budget is not None and milliseconds > budget:
+            failures.append(f"{name} took {milliseconds:.1f} ms, budget {budget:.1f} ms")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
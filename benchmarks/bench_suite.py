@@ -0,0 +1,197 @@
+"""
+Benchmark TeapotAI hot paths offline, with tiny randomly initialized models.
+
+The T5 generator and BERT embedding model from the test suite are built locally, so no
+network access or model download is needed. The absolute numbers say little about the real
+models, but they track the overhead of TeapotAI's own code paths between commits.
+
+Measured: chunking, document embedding, retrieval over 1k/100k/1M chunks (random unit
+embeddings, so the index needs no embedding pass), generate, query, extract and chat. Each
+benchmark reports latency percentiles, throughput and the process's peak RSS so far.
+
+Results are written as JSON. With --baseline, each benchmark's median latency is compared to
+a previous run's, and the script exits with status 1 if any is slower by more than
+--tolerance. Baselines are machine specific: benchmarks/baseline.json was recorded on a
+development machine, so record a new one with --output on the machine that checks it.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_suite.py --output results.json
+    PYTHONPATH=src python benchmarks/bench_suite.py --baseline benchmarks/baseline.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+import torch
+from pydantic import BaseModel
+
+from teapotai import TeapotAI, TeapotAISettings
+from teapotai.index import ExactSearch, normalize_embeddings
+from tests.tiny_models import WORDS, build_generator, build_embedding_pipeline
+
+RETRIEVAL_SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+
+class Landmark(BaseModel):
+    name: str
+    city: str
+    # The tiny generator rarely produces numbers
+    height: Optional[float]
+
+
+def make_text(rng: random.Random, num_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def run(fn, repeat: int, warmup: int = 1, items: int = 1) -> dict:
+    """
+    Time `fn` `repeat` times after `warmup` untimed calls.
+
+    Args:
+        fn (Callable): The code to time.
+        repeat (int): Number of timed calls.
+        warmup (int): Number of untimed calls.
+        items (int): Number of items each call processes, for throughput.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, items per second and peak RSS in megabytes.
+    """
+    for _ in range(warmup):
+        fn()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    milliseconds = np.array(seconds) * 1000
+    return {
+        "repeat": repeat,
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "mean_ms": float(milliseconds.mean()),
+        "items_per_second": items / statistics.mean(seconds),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def build_teapot_ai(documents, max_length: int) -> TeapotAI:
+    model, tokenizer = build_generator()
+    return TeapotAI(
+        model=model,
+        tokenizer=tokenizer,
+        embedding_model=build_embedding_pipeline(),
+        documents=documents,
+        settings=TeapotAISettings(verbose=False, generation_max_length=max_length, allow_tool_use=False, langsmith_tracing=False),
+    )
+
+
+def benchmarks(args) -> dict:
+    rng = random.Random(0)
+    documents = [make_text(rng, rng.randint(5, 40)) for _ in range(50)]
+    teapot_ai = build_teapot_ai(documents, args.max_length)
+    long_document = "\n\n".join(make_text(rng, rng.randint(20, 200)) for _ in range(50))
+    texts = [make_text(rng, rng.randint(5, 60)) for _ in range(args.num_texts)]
+    query, context = "where is the eiffel tower", make_text(rng, 40)
+    conversation = [
+        {"role": "system", "content": "you are an assistant"},
+        {"role": "user", "content": "what is the capital of italy"},
+        {"role": "assistant", "content": "rome"},
+        {"role": "user", "content": "where is the eiffel tower"},
+    ]
+
+    results = {}
+    results["chunk_document"] = run(lambda: teapot_ai._chunk_document(long_document), args.repeat * 5)
+    results["embedding"] = run(lambda: teapot_ai._generate_document_embeddings(texts), args.repeat, items=len(texts))
+    results["generate"] = run(lambda: teapot_ai.generate(f"{context}\n{query}"), args.repeat)
+    results["query"] = run(lambda: teapot_ai.query(query, context=context), args.repeat)
+    results["extract"] = run(lambda: teapot_ai.extract(Landmark, query=query, context=context), args.repeat)
+    results["chat"] = run(lambda: teapot_ai.chat(conversation), args.repeat)
+
+    # Retrieval runs last: the largest index dominates peak memory
+    dim = teapot_ai.embedding_model.model.config.hidden_size
+    numpy_rng = np.random.default_rng(0)
+    for name in args.retrieval_sizes:
+        num_chunks = RETRIEVAL_SIZES[name]
+        chunks = [f"chunk {i}" for i in range(num_chunks)]
+        embeddings = normalize_embeddings(numpy_rng.standard_normal((num_chunks, dim), dtype=np.float32))
+        search = ExactSearch(embeddings)
+        results[f"retrieval_{name}"] = run(lambda: teapot_ai._retrieval(query, chunks, embeddings, search), args.repeat * 5)
+        del chunks, embeddings, search
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns:
+        list: A message for each benchmark whose median latency exceeds the baseline's by
+            more than `tolerance` (a fraction).
+    """
+    failures = []
+    for name, result in results.items():
+        reference = baseline.get("benchmarks", {}).get(name)
+        if reference is None:
+            continue
+        limit = reference["p50_ms"] * (1 + tolerance)
+        if result["p50_ms"] > limit:
+            failures.append(f"{name}: p50 {result['p50_ms']:.2f} ms, baseline {reference['p50_ms']:.2f} ms (limit {limit:.2f} ms)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--num-texts", type=int, default=256, help="Texts embedded per embedding call")
+    parser.add_argument("--max-length", type=int, default=32, help="generation_max_length for the tiny generator")
+    parser.add_argument("--retrieval-sizes", nargs="*", default=list(RETRIEVAL_SIZES), choices=list(RETRIEVAL_SIZES))
+    parser.add_argument("--threads", type=int, default=1, help="torch threads; fixed by default for stable timings")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed median slowdown, as a fraction")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    results = benchmarks(args)
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "numpy": np.__version__,
+            "threads": args.threads,
+        },
+        "benchmarks": results,
+    }
+
+    for name, result in results.items():
+        print(f"{name + ':':20} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+              f"{result['items_per_second']:10.1f} items/s  peak RSS {result['peak_rss_mb']:8.1f} MB")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
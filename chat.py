@@ -15,6 +15,12 @@ def handle_chat(user_input, teapot_ai):
     ])
     return response
 
+# One engine per document set, kept across Streamlit reruns. Engines for different
+# documents share the model weights through the TeapotAI model registry.
+@st.cache_resource(max_entries=8)
+def load_teapot_ai(documents):
+    return TeapotAI(documents=list(documents))
+
 # Streamlit app
 def main():
     st.set_page_config(page_title="TeapotAI Chat", page_icon=":robot_face:", layout="wide")
@@ -44,11 +50,11 @@ def main():
         st.sidebar.error(f"Error parsing documents: {e}")
         documents = []  # Fallback to empty documents in case of error
 
-    # Initialize TeapotAI with the user-defined documents
+    # Reuse the TeapotAI engine for the user-defined documents across reruns
     if documents:
-        teapot_ai = TeapotAI(documents=documents)
+        teapot_ai = load_teapot_ai(tuple(documents))
     else:
-        teapot_ai = TeapotAI(documents=["The Eiffel Tower is located in Paris, France. It was built in 1889 and stands 330 meters tall."])
+        teapot_ai = load_teapot_ai(("The Eiffel Tower is located in Paris, France. It was built in 1889 and stands 330 meters tall.",))
 
     # Initialize chat history if not already present
     if "messages" not in st.session_state:
@@ -20,7 +20,7 @@ setuptools.setup(
     package_dir={'': 'src'},
     packages=setuptools.find_packages(where='src'),
     package_data={
-        'teapotai': ['teapot_refusal_classifier.joblib'],  # Make sure this points to your joblib file
+        'teapotai': ['teapot_refusal_classifier.npz'],  # Refusal classifier weights, see teapotai/refusal.py
     },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -41,13 +41,14 @@ setuptools.setup(
         'tqdm',             # for progress bars
         'transformers',     # for huggingface transformer models
         'numpy',            # for numerical operations
-        'scikit-learn',     # for sklearn (cosine_similarity)
         'pydantic',         # for data validation (BaseModel)
         'regex',            # to handle regex (re is often a wrapper for regex module in modern Python)
-        'langsmith'
     ],
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],  # add test dependencies here
+        'serve': ['fastapi', 'uvicorn'],  # for the optional HTTP server in teapotai.app
+        'export': ['scikit-learn'],  # to re-export the refusal classifier with teapotai.refusal
+        'tracing': ['langsmith'],  # optional langsmith tracing of generate/query/chat/extract
     },
 )
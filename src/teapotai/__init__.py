@@ -1,3 +1,16 @@
 __version__ = "2.0.8"
 
 from .teapotai import *
+from .serve import *
+from .pool import *
+from .session import *
+from .ingest import *
+from .registry import *
+
+
+def __getattr__(name):
+    # TeapotStream depends on torch and transformers, so it is only imported on request
+    if name == "TeapotStream":
+        from .streaming import TeapotStream
+        return TeapotStream
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
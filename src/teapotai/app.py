@@ -0,0 +1,85 @@
+"""
+Thin HTTP front end for AsyncTeapotAI.
+
+Requires FastAPI (`pip install teapotai[serve]`). Run with any ASGI server, e.g.:
+
+    from teapotai import TeapotAI
+    from teapotai.app import create_app
+    app = create_app(TeapotAI(documents=[...]))
+
+    uvicorn my_module:app
+"""
+from contextlib import asynccontextmanager
+from typing import List, Union
+
+try:
+    from fastapi import FastAPI, HTTPException
+    from fastapi.responses import PlainTextResponse
+except ImportError as e:
+    raise ImportError("Teapot- The HTTP server requires FastAPI, install it with `pip install teapotai[serve]`") from e
+from pydantic import BaseModel
+
+from .teapotai import TeapotAI, DEFAULT_SYSTEM_PROMPT
+from .serve import AsyncTeapotAI, QueueFullError
+
+
+class QueryRequest(BaseModel):
+    query: str
+    context: str = ""
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT
+
+
+class ChatRequest(BaseModel):
+    messages: List[dict]
+
+
+class TeapotResponse(BaseModel):
+    response: str
+
+
+def create_app(teapot_ai: Union[TeapotAI, AsyncTeapotAI]) -> FastAPI:
+    """
+    Create an ASGI app exposing `/query`, `/chat`, `/metrics` and `/metrics/prometheus`
+    (per-stage timings, recorded when the TeapotAI `metrics` setting is on).
+
+    Args:
+        teapot_ai (Union[TeapotAI, AsyncTeapotAI]): The engine to serve. A plain TeapotAI is
+            wrapped in an AsyncTeapotAI with default batching settings.
+
+    Returns:
+        FastAPI: The application. Requests are rejected with HTTP 503 when the queue is full
+            and the AsyncTeapotAI was created with `reject_when_full`.
+    """
+    server = teapot_ai if isinstance(teapot_ai, AsyncTeapotAI) else AsyncTeapotAI(teapot_ai)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await server.close()
+
+    app = FastAPI(title="Teapot AI", lifespan=lifespan)
+
+    async def _respond(awaitable) -> TeapotResponse:
+        try:
+            return TeapotResponse(response=await awaitable)
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    @app.post("/query", response_model=TeapotResponse)
+    async def query(request: QueryRequest):
+        return await _respond(server.query(request.query, context=request.context, system_prompt=request.system_prompt))
+
+    @app.post("/chat", response_model=TeapotResponse)
+    async def chat(request: ChatRequest):
+        return await _respond(server.chat(request.messages))
+
+    @app.get("/metrics")
+    async def metrics():
+        return server.metrics()
+
+    @app.get("/metrics/prometheus", response_class=PlainTextResponse)
+    async def prometheus_metrics():
+        return server.teapot_ai.metrics.to_prometheus()
+
+    app.state.teapot = server
+    return app
@@ -0,0 +1,220 @@
+"""
+CPU inference backends for the TeapotLLM seq2seq model and the embedding model.
+
+The "int8" backend applies dynamic int8 quantization to every Linear layer: weights are
+stored as int8 and activations are quantized on the fly, which cuts memory and usually
+latency on CPUs. Independently, encoders can run as traced, frozen TorchScript graphs.
+
+This module imports torch at import time, so TeapotAI only imports it when a backend
+other than plain fp32 eager execution is used.
+"""
+import copy
+import hashlib
+import json
+import os
+import time
+import warnings
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+from .cache import local_checkpoint_revision
+
+INFERENCE_BACKENDS = ("fp32", "int8")
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "teapotai")
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Apply dynamic int8 quantization to the Linear layers of a model.
+
+    Args:
+        model (torch.nn.Module): The fp32 model. It is not modified.
+
+    Returns:
+        torch.nn.Module: A quantized copy of the model, in eval mode.
+    """
+    with warnings.catch_warnings():
+        # Eager-mode quantization is deprecated in favour of torchao but remains supported
+        warnings.simplefilter("ignore")
+        # Quantize a copy in place, so the caller's model keeps its training mode
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).eval(), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _model_fingerprint(model_name: str, config) -> str:
+    # Local checkpoints have no revision, so use the modification time of their files
+    revision = getattr(config, "_commit_hash", None) or local_checkpoint_revision(model_name)
+    payload = json.dumps([model_name, str(revision), torch.__version__], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _plain_state_dict(state_dict: dict) -> dict:
+    # Quantized tensors pickle their qscheme as a bare global, which breaks with some lazily
+    # aliased modules in sys.modules; store them as integer tensors plus quantization parameters
+    plain = OrderedDict()
+    # Module versions decide how quantized layers read their state
+    plain._metadata = getattr(state_dict, "_metadata", None)
+    for key, value in state_dict.items():
+        if isinstance(value, tuple) and len(value) == 2 and isinstance(value[0], torch.Tensor) and value[0].is_quantized:
+            weight, bias = value
+            if weight.qscheme() == torch.per_tensor_affine:
+                quantization = {"scale": torch.tensor(weight.q_scale()), "zero_point": torch.tensor(weight.q_zero_point())}
+            else:
+                quantization = {
+                    "scales": weight.q_per_channel_scales(),
+                    "zero_points": weight.q_per_channel_zero_points(),
+                    "axis": torch.tensor(weight.q_per_channel_axis()),
+                }
+            value = {"packed_weight": weight.int_repr(), "bias": bias, **quantization}
+        plain[key] = value
+    return plain
+
+
+def _quantized_state_dict(plain: dict) -> dict:
+    state_dict = OrderedDict()
+    state_dict._metadata = getattr(plain, "_metadata", None)
+    for key, value in plain.items():
+        if isinstance(value, dict) and "packed_weight" in value:
+            if "scale" in value:
+                weight = torch._make_per_tensor_quantized_tensor(value["packed_weight"], float(value["scale"]), int(value["zero_point"]))
+            else:
+                weight = torch._make_per_channel_quantized_tensor(value["packed_weight"], value["scales"], value["zero_points"], int(value["axis"]))
+            value = (weight, value["bias"])
+        state_dict[key] = value
+    return state_dict
+
+
+def load_quantized(model_class, model_name: str, revision: Optional[str] = None, cache_dir: Optional[str] = None) -> torch.nn.Module:
+    """
+    Load an int8 model, quantizing it once and caching the quantized weights on disk.
+
+    On a cache hit the model is built from its config without initializing or loading fp32
+    weights, quantized (which only sets up the module structure) and filled from the cache.
+
+    Args:
+        model_class: A transformers auto class, e.g. AutoModelForSeq2SeqLM.
+        model_name (str): The Hugging Face model id or local path.
+        revision (str): Optional model revision.
+        cache_dir (str): Directory for quantized weights. Defaults to ~/.cache/teapotai.
+
+    Returns:
+        torch.nn.Module: The quantized model, in eval mode.
+    """
+    from transformers import AutoConfig
+    try:
+        from transformers.initialization import no_init_weights
+    except ImportError:
+        from transformers.modeling_utils import no_init_weights
+
+    config = AutoConfig.from_pretrained(model_name, revision=revision)
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    path = os.path.join(cache_dir, f"{model_class.__name__}-{_model_fingerprint(model_name, config)}-int8.pt")
+
+    if os.path.exists(path):
+        with no_init_weights():
+            model = model_class.from_config(config)
+        model = quantize_int8(model)
+        model.load_state_dict(_quantized_state_dict(torch.load(path)))
+        return model.eval()
+
+    model = quantize_int8(model_class.from_pretrained(model_name, revision=revision))
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(_plain_state_dict(model.state_dict()), temporary_path)
+    os.replace(temporary_path, path)
+    return model
+
+
+class _EncoderForTracing(torch.nn.Module):
+    # Exposes an encoder as a positional (input_ids, attention_mask) -> hidden states graph
+    def __init__(self, encoder: torch.nn.Module):
+        super().__init__()
+        self.encoder = encoder
+
+    def forward(self, input_ids, attention_mask):
+        return self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+
+def trace_encoder(encoder: torch.nn.Module, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+    """
+    Trace an encoder into a frozen TorchScript graph.
+
+    The graph accepts any batch size and sequence length, not only those of the example.
+
+    Args:
+        encoder (torch.nn.Module): The encoder, e.g. `model.get_encoder()` or a BERT model.
+        input_ids (torch.Tensor): Example input ids.
+        attention_mask (torch.Tensor): Example attention mask.
+
+    Returns:
+        torch.jit.ScriptModule: A module mapping (input_ids, attention_mask) to the last hidden states.
+    """
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.simplefilter("ignore")
+        traced = torch.jit.trace(_EncoderForTracing(encoder).eval(), (input_ids, attention_mask), check_trace=False)
+        return torch.jit.freeze(traced)
+
+
+def model_size_bytes(model: torch.nn.Module) -> int:
+    """
+    Returns:
+        int: The size of the model's weights and buffers, counting packed int8 weights.
+    """
+    size = 0
+    for value in _plain_state_dict(model.state_dict()).values():
+        for tensor in (value.values() if isinstance(value, dict) else [value]):
+            if isinstance(tensor, torch.Tensor):
+                size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def compare_backends(reference, candidate, samples: List[str]) -> dict:
+    """
+    Compare the outputs and latency of two TeapotAI instances on sample prompts, typically an
+    fp32 reference and a quantized or traced candidate built from the same models.
+
+    The generation cache is bypassed, so every sample is decoded by both instances.
+
+    Args:
+        reference (TeapotAI): The reference instance.
+        candidate (TeapotAI): The instance to evaluate.
+        samples (List[str]): Prompts to generate for and embed.
+
+    Returns:
+        dict: The fraction of identical generations, the mean token-level similarity of the
+            generations, the mean and minimum cosine similarity of the embeddings, the average
+            per-sample latency of each instance and the size of each generator in megabytes.
+    """
+    def timed(fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, (time.perf_counter() - start) / max(1, len(samples))
+
+    reference_texts, reference_latency = timed(reference._decode_batch, samples)
+    candidate_texts, candidate_latency = timed(candidate._decode_batch, samples)
+    token_similarity = [
+        SequenceMatcher(None, expected.split(), actual.split()).ratio()
+        for expected, actual in zip(reference_texts, candidate_texts)
+    ]
+    report = {
+        "num_samples": len(samples),
+        "generation_exact_match": float(np.mean([a == b for a, b in zip(reference_texts, candidate_texts)])),
+        "generation_token_similarity": float(np.mean(token_similarity)),
+        "reference_seconds_per_sample": reference_latency,
+        "candidate_seconds_per_sample": candidate_latency,
+        "reference_model_mb": model_size_bytes(reference.model) / 2**20,
+        "candidate_model_mb": model_size_bytes(candidate.model) / 2**20,
+    }
+
+    if reference.settings.use_rag and candidate.settings.use_rag:
+        from .index import normalize_embeddings
+        reference_embeddings = normalize_embeddings(reference._embed(samples))
+        candidate_embeddings = normalize_embeddings(candidate._embed(samples))
+        cosine = np.sum(reference_embeddings * candidate_embeddings, axis=1)
+        report["embedding_cosine_mean"] = float(cosine.mean())
+        report["embedding_cosine_min"] = float(cosine.min())
+
+    return report
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+def local_checkpoint_revision(path: str) -> Optional[str]:
+    """
+    Identify the contents of a local checkpoint directory, which has no hub revision.
+
+    Args:
+        path (str): The checkpoint directory.
+
+    Returns:
+        str: The latest modification time of its files, or None if `path` is not a directory.
+    """
+    if not path or not os.path.isdir(path):
+        return None
+    return str(max((os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)), default=0.0))
+
+
+class LRUCache:
+    """
+    A thread-safe, bounded least-recently-used cache.
+
+    Attributes:
+        max_size (int): The maximum number of entries. A size of 0 disables the cache.
+        hits (int): Number of lookups that found an entry.
+        misses (int): Number of lookups that did not find an entry.
+        evictions (int): Number of entries dropped to respect `max_size`.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Look up an entry and mark it as most recently used.
+
+        Args:
+            key (Hashable): The cache key.
+            default (Any): Returned if the key is not cached.
+
+        Returns:
+            Any: The cached value, or `default`.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Insert or replace an entry, evicting the least recently used entries if full.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The value to cache.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries. Counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The number of entries and the hit, miss and eviction counters.
+        """
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class SQLiteCache:
+    """
+    A persistent string cache in a SQLite file, safe to share between threads and processes.
+
+    A SQLite connection must not be used across `fork()`, so a forked process (such as a
+    TeapotPool worker) opens its own connection on first use. Entries are evicted least recently used first once `max_entries` is exceeded.
+
+    Attributes:
+        path (str): The SQLite database file.
+        max_entries (int): The maximum number of entries, or None for no limit.
+        evictions (int): Number of entries this instance dropped to respect `max_entries`.
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._inherited = []
+        self._connect()
+        with self._lock:
+            # WAL lets readers in other processes proceed while one process writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._pid = os.getpid()
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            # Closing the parent's connection here could release its locks, so it is only kept alive
+            self._inherited.append(self._connection)
+            self._connect()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up an entry and mark it as most recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str: The cached value, or None.
+        """
+        self._check_process()
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """
+        Insert or replace an entry, evicting the least recently used entries if full.
+
+        Args:
+            key (str): The cache key.
+            value (str): The value to cache.
+        """
+        self._check_process()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, value, time.time()))
+                if self.max_entries is not None:
+                    excess = self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+                    if excess > 0:
+                        self._connection.execute(
+                            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)", (excess,)
+                        )
+                        self.evictions += excess
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        """
+        Remove all entries, for every process sharing the file.
+        """
+        self._check_process()
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+
+    def close(self):
+        self._check_process()
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self) -> int:
+        self._check_process()
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class GenerationCache:
+    """
+    Two-tier cache of generated text: an in-memory LRU, optionally backed by a SQLite file
+    that persists across restarts and is shared by processes using the same path.
+
+    Keys are built with `key` from the prompt, the generation parameters and the model
+    identity, so changing any of them never returns a stale result.
+
+    Attributes:
+        memory (LRUCache): The in-memory tier.
+        disk (SQLiteCache): The persistent tier, or None.
+        hits (int): Number of lookups answered by either tier.
+        misses (int): Number of lookups answered by neither tier.
+    """
+
+    def __init__(self, max_size: int, path: Optional[str] = None, max_disk_entries: Optional[int] = None):
+        self.memory = LRUCache(max_size)
+        self.disk = SQLiteCache(path, max_disk_entries) if path is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def key(prompt: str, parameters: dict, model: dict) -> str:
+        """
+        Build a cache key.
+
+        Args:
+            prompt (str): The model prompt.
+            parameters (dict): The generation parameters.
+            model (dict): Identifies the model weights, e.g. its name and revision.
+
+        Returns:
+            str: A SHA-256 hex digest of the inputs.
+        """
+        payload = json.dumps([prompt, parameters, model], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, persist: bool = True) -> Optional[str]:
+        """
+        Look up a generation in memory, then on disk. Disk hits are promoted to memory.
+
+        Args:
+            key (str): The cache key.
+            persist (bool): Whether to look on disk. Off for models that cannot be identified
+                across processes.
+
+        Returns:
+            str: The cached generation, or None.
+        """
+        value = self.memory.get(key)
+        if value is None and persist and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.put(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: str, persist: bool = True):
+        """
+        Store a generation in both tiers.
+
+        Args:
+            key (str): The cache key.
+            value (str): The generated text.
+            persist (bool): Whether to also store it on disk.
+        """
+        self.memory.put(key, value)
+        if persist and self.disk is not None:
+            self.disk.put(key, value)
+
+    def clear(self):
+        """
+        Invalidate every cached generation in memory and on disk. Counters are kept.
+        """
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Overall hit and miss counters, hits served from disk, evictions from both
+                tiers and the number of entries in each tier.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.memory.evictions + (self.disk.evictions if self.disk is not None else 0),
+            "memory_size": len(self.memory),
+            "disk_size": len(self.disk) if self.disk is not None else 0,
+        }
@@ -0,0 +1,85 @@
+"""
+Splitting documents into chunks that fit the model's context window.
+
+The functions only need a tokenizer, so they can run in worker processes that do not load
+any model (see `teapotai.ingest`).
+"""
+from typing import List
+
+import numpy as np
+
+__all__ = ["chunk_document"]
+
+
+def chunk_document(context: str, tokenizer, context_chunking: bool = True, chunk_overlap: int = 0) -> List[str]:
+    """
+    Chunk a document into segments that fit the tokenizer's maximum length.
+
+    Contexts longer than the model's maximum length are split into paragraphs, and
+    paragraphs that are still too long are cut into token windows that overlap by
+    `chunk_overlap` tokens. With a fast tokenizer the context is tokenized once and windows
+    are cut from the original text using the token offsets, without decoding.
+
+    Args:
+        context (str): The document context to chunk.
+        tokenizer: The generator's tokenizer.
+        context_chunking (bool): Whether to chunk at all. If False the context is one chunk.
+        chunk_overlap (int): Number of tokens shared by consecutive windows of a paragraph.
+
+    Returns:
+        List[str]: A list of chunked document strings.
+    """
+    if not context_chunking:
+        return [context]
+    if not getattr(tokenizer, "is_fast", False):
+        return _chunk_document_by_decoding(context, tokenizer, chunk_overlap)
+
+    max_length = tokenizer.model_max_length
+    encoding = tokenizer(context, return_offsets_mapping=True)
+    if len(encoding["input_ids"]) <= max_length:
+        return [context]
+
+    # Special tokens have empty spans; each tokenized chunk gets them added again
+    spans = np.array([span for span in encoding["offset_mapping"] if span[1] > span[0]], dtype=np.int64).reshape(-1, 2)
+    num_special_tokens = len(encoding["input_ids"]) - len(spans)
+    window = max(1, max_length - num_special_tokens)
+    stride = max(1, window - chunk_overlap)
+
+    documents = []
+    paragraph_start = 0
+    for paragraph in context.split("\n\n"):
+        paragraph_end = paragraph_start + len(paragraph)
+        first, last = np.searchsorted(spans[:, 0], [paragraph_start, paragraph_end])
+        if last - first <= window:
+            documents.append(paragraph)
+        else:
+            for i in range(first, last, stride):
+                end = min(i + window, last)
+                documents.append(context[spans[i, 0]:spans[end - 1, 1]])
+                if end == last:
+                    break
+        paragraph_start = paragraph_end + 2
+    return documents
+
+
+def _chunk_document_by_decoding(context: str, tokenizer, chunk_overlap: int) -> List[str]:
+    # Fallback for tokenizers without offset mappings
+    tokenized_context = tokenizer(context).get("input_ids")
+    if len(tokenized_context) > tokenizer.model_max_length:
+        paragraphs = context.split("\n\n")
+        documents = []
+        for paragraph in paragraphs:
+            tokens = tokenizer(paragraph).get("input_ids")
+            if len(tokens) > tokenizer.model_max_length:
+                stride = max(1, tokenizer.model_max_length - chunk_overlap)
+                for i in range(0, len(tokens), stride):
+                    chunk_tokens = tokens[i:i + tokenizer.model_max_length]
+                    chunk_text = tokenizer.decode(chunk_tokens, skip_special_tokens=True)
+                    documents.append(chunk_text)
+                    if i + tokenizer.model_max_length >= len(tokens):
+                        break
+            else:
+                documents.append(paragraph)
+        return documents
+    else:
+        return [context]
@@ -0,0 +1,790 @@
+import copy
+import hashlib
+import json
+import operator
+import os
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+INDEX_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+TOKEN_COUNTS_FILE = "token_counts.npy"
+EMBEDDING_STORAGE = ("float32", "float16", "int8")
+
+
+def hash_text(text: str) -> str:
+    """
+    Compute the content hash used to identify documents and chunks in an index.
+
+    Args:
+        text (str): The text to hash.
+
+    Returns:
+        str: The hex encoded SHA-256 digest of the UTF-8 encoded text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _replace_file(path: str, write) -> None:
+    # Write to a temporary file and atomically move it into place, so processes that
+    # already memory-mapped the previous file keep a valid view of it.
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_index(path: str, chunks: List[str], embeddings, manifest: dict, token_counts: Optional[np.ndarray] = None) -> None:
+    """
+    Save an embedding index to a directory.
+
+    The index consists of the chunk texts, the embedding matrix as a `.npy` file that can
+    be memory-mapped, and a JSON manifest describing how the index was built. The manifest
+    is written last so a complete manifest always refers to complete data files. Compressed
+    embeddings are saved in their compressed form, with the int8 row scales in a second file.
+
+    Args:
+        path (str): The directory to write the index to. Created if it does not exist.
+        chunks (List[str]): The chunk texts, one per embedding row.
+        embeddings (np.ndarray | CompressedEmbeddings): The (num_chunks, dim) embedding matrix.
+        manifest (dict): Build metadata (embedding model, revision, chunking settings, hashes).
+        token_counts (np.ndarray): Optional token length of each chunk, -1 where unknown.
+    """
+    if len(chunks) != len(embeddings):
+        raise ValueError(f"Teapot- Index has {len(chunks)} chunks but {len(embeddings)} embeddings")
+
+    os.makedirs(path, exist_ok=True)
+    if isinstance(embeddings, CompressedEmbeddings):
+        dtype, codes, scales = embeddings.storage, np.ascontiguousarray(embeddings.codes), embeddings.scales
+    else:
+        dtype, codes, scales = "float32", np.ascontiguousarray(embeddings, dtype=np.float32), None
+    manifest = {
+        **manifest,
+        "format_version": INDEX_FORMAT_VERSION,
+        "num_chunks": len(chunks),
+        "dim": int(codes.shape[1]) if codes.ndim == 2 else 0,
+        "dtype": dtype,
+    }
+
+    _replace_file(os.path.join(path, EMBEDDINGS_FILE), lambda f: np.save(f, codes))
+    if scales is not None:
+        _replace_file(os.path.join(path, SCALES_FILE), lambda f: np.save(f, np.ascontiguousarray(scales)))
+    if token_counts is not None:
+        _replace_file(os.path.join(path, TOKEN_COUNTS_FILE), lambda f: np.save(f, np.asarray(token_counts, dtype=np.int32)))
+    _replace_file(os.path.join(path, CHUNKS_FILE), lambda f: f.write(json.dumps(list(chunks)).encode("utf-8")))
+    _replace_file(os.path.join(path, MANIFEST_FILE), lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+
+
+def load_index(path: str, mmap: bool = True) -> Tuple[List[str], np.ndarray, dict]:
+    """
+    Load an embedding index saved with `save_index`.
+
+    Args:
+        path (str): The index directory.
+        mmap (bool): Whether to memory-map the embedding matrix read-only instead of reading
+            it into memory. Memory-mapped indexes share one page-cached copy across processes.
+
+    Returns:
+        Tuple[List[str], np.ndarray, dict]: The chunk texts, the embedding matrix (a
+            CompressedEmbeddings if the index was saved compressed) and the manifest.
+    """
+    with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Teapot- Unsupported index format version: {manifest.get('format_version')}")
+
+    with open(os.path.join(path, CHUNKS_FILE), "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    mmap_mode = "r" if mmap else None
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+    dtype = manifest.get("dtype", "float32")
+    if dtype == "int8":
+        embeddings = CompressedEmbeddings(embeddings, np.load(os.path.join(path, SCALES_FILE), mmap_mode=mmap_mode))
+    elif dtype == "float16":
+        embeddings = CompressedEmbeddings(embeddings)
+    elif dtype != "float32":
+        raise ValueError(f"Teapot- Unsupported index dtype: {dtype}")
+
+    if len(chunks) != manifest["num_chunks"] or embeddings.shape[0] != manifest["num_chunks"]:
+        raise ValueError(f"Teapot- Index at {path} is incomplete or was modified while loading")
+
+    return chunks, embeddings, manifest
+
+
+def load_token_counts(path: str, num_chunks: int) -> Optional[np.ndarray]:
+    """
+    Load the chunk token lengths saved with an index.
+
+    Args:
+        path (str): The index directory.
+        num_chunks (int): The number of chunks in the index.
+
+    Returns:
+        np.ndarray: The int32 token length of each chunk (-1 where unknown), or None if the
+            index was saved without them.
+    """
+    token_counts_path = os.path.join(path, TOKEN_COUNTS_FILE)
+    if not os.path.exists(token_counts_path):
+        return None
+    token_counts = np.load(token_counts_path)
+    return token_counts if len(token_counts) == num_chunks else None
+
+
+def index_exists(path: str) -> bool:
+    """
+    Check whether a directory contains a saved index.
+
+    Args:
+        path (str): The index directory.
+
+    Returns:
+        bool: True if the directory has an index manifest.
+    """
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize embedding rows so cosine similarity reduces to a dot product.
+
+    Args:
+        embeddings (np.ndarray): A (n, dim) array of embeddings.
+
+    Returns:
+        np.ndarray: A float32 array of unit-length rows. All-zero rows are left as zeros.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def top_k(scores: np.ndarray, k: int, threshold: Optional[float] = None) -> np.ndarray:
+    """
+    Select the indices of the `k` highest scores at or above `threshold`, best first.
+
+    Uses `argpartition` so only the `k` selected scores are sorted.
+
+    Args:
+        scores (np.ndarray): A 1-d array of scores.
+        k (int): The maximum number of indices to return.
+        threshold (float): Optional minimum score.
+
+    Returns:
+        np.ndarray: Indices into `scores`, ordered by descending score.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(len(scores))
+    if threshold is not None:
+        indices = indices[scores[indices] >= threshold]
+    return indices[np.argsort(-scores[indices], kind="stable")]
+
+
+class CompressedEmbeddings:
+    """
+    An embedding matrix stored as float16, or as int8 with one float32 scale per row.
+
+    Int8 rows are scalar-quantized symmetrically: each row is divided by its largest absolute
+    value over 127 and rounded. Scores are computed in blocks directly from the codes, so the
+    full-precision matrix is never materialized; only one block is converted at a time.
+
+    Indexing with an int returns the dequantized float32 row. Indexing with a slice, an index
+    array or a mask returns a CompressedEmbeddings, and `np.asarray` dequantizes the whole
+    matrix.
+
+    Attributes:
+        codes (np.ndarray): The (n, dim) float16 or int8 codes.
+        scales (np.ndarray): The (n,) float32 row scales of int8 codes, or None for float16.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None, block_size: int = 65536):
+        if codes.dtype == np.int8:
+            if scales is None or len(scales) != len(codes):
+                raise ValueError("Teapot- int8 embeddings need one scale per row")
+        elif codes.dtype != np.float16:
+            raise ValueError(f"Teapot- Unsupported compressed embedding dtype: {codes.dtype}")
+        self.codes = codes
+        self.scales = scales
+        self.block_size = block_size
+
+    @classmethod
+    def encode(cls, embeddings: np.ndarray, storage: str) -> "CompressedEmbeddings":
+        """
+        Compress an embedding matrix.
+
+        Args:
+            embeddings (np.ndarray): A (n, dim) float array.
+            storage (str): 'float16' or 'int8'.
+
+        Returns:
+            CompressedEmbeddings: The compressed matrix.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if storage == "float16":
+            return cls(embeddings.astype(np.float16))
+        if storage == "int8":
+            return cls(*_quantize_int8(embeddings))
+        raise ValueError(f"Teapot- Unsupported embedding storage: {storage}")
+
+    @classmethod
+    def empty(cls, num_rows: int, dim: int, storage: str) -> "CompressedEmbeddings":
+        if storage == "float16":
+            return cls(np.empty((num_rows, dim), dtype=np.float16))
+        if storage == "int8":
+            return cls(np.empty((num_rows, dim), dtype=np.int8), np.empty(num_rows, dtype=np.float32))
+        raise ValueError(f"Teapot- Unsupported embedding storage: {storage}")
+
+    @property
+    def storage(self) -> str:
+        return "int8" if self.scales is not None else "float16"
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.codes.shape
+
+    @property
+    def ndim(self) -> int:
+        return self.codes.ndim
+
+    @property
+    def flags(self):
+        # Codes and scales are allocated or memory-mapped together, so they share flags
+        return self.codes.flags
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _decode(self, codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+        decoded = codes.astype(np.float32)
+        if scales is not None:
+            decoded *= scales[..., None]
+        return decoded
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._decode(self.codes[key], self.scales[key] if self.scales is not None else None)
+        return CompressedEmbeddings(self.codes[key], self.scales[key] if self.scales is not None else None, self.block_size)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, CompressedEmbeddings) and value.storage == self.storage:
+            self.codes[key] = value.codes
+            if self.scales is not None:
+                self.scales[key] = value.scales
+            return
+        value = np.asarray(value, dtype=np.float32)
+        if self.scales is None:
+            self.codes[key] = value.astype(np.float16)
+        else:
+            codes, scales = _quantize_int8(value.reshape(-1, value.shape[-1]))
+            self.codes[key] = codes.reshape(value.shape)
+            self.scales[key] = scales.reshape(value.shape[:-1])
+
+    def __array__(self, dtype=None, copy=None):
+        decoded = self._decode(self.codes, self.scales)
+        return decoded if dtype is None else decoded.astype(dtype, copy=False)
+
+    def score(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Compute dot products between the stored rows and one or more queries.
+
+        Args:
+            queries (np.ndarray): A (dim,) query or a (num_queries, dim) matrix of queries.
+
+        Returns:
+            np.ndarray: Float32 scores of shape (n,) for one query, (num_queries, n) otherwise.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.empty(queries.shape[:-1] + (len(self.codes),), dtype=np.float32)
+        for start in range(0, len(self.codes), self.block_size):
+            end = min(start + self.block_size, len(self.codes))
+            block = self.codes[start:end].astype(np.float32) @ queries.T
+            if self.scales is not None:
+                block *= self.scales[start:end, None] if block.ndim == 2 else self.scales[start:end]
+            scores[..., start:end] = block.T
+        return scores
+
+
+def _quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    scales = np.abs(embeddings).max(axis=-1) / 127 if embeddings.size else np.zeros(len(embeddings), dtype=np.float32)
+    scales = scales.astype(np.float32)
+    codes = np.rint(embeddings / np.maximum(scales, np.finfo(np.float32).tiny)[:, None])
+    return np.clip(codes, -127, 127).astype(np.int8), scales
+
+
+def encode_embeddings(embeddings, storage: str = "float32") -> Union[np.ndarray, CompressedEmbeddings]:
+    """
+    Convert an embedding matrix to a storage format.
+
+    Args:
+        embeddings (np.ndarray | CompressedEmbeddings): The embedding matrix.
+        storage (str): 'float32', 'float16' or 'int8'.
+
+    Returns:
+        np.ndarray | CompressedEmbeddings: The matrix, unchanged if it is already stored as requested.
+    """
+    if storage not in EMBEDDING_STORAGE:
+        raise ValueError(f"Teapot- Unsupported embedding storage: {storage}")
+    if isinstance(embeddings, CompressedEmbeddings):
+        return embeddings if embeddings.storage == storage else encode_embeddings(np.asarray(embeddings), storage)
+    if storage == "float32":
+        return embeddings if embeddings.dtype == np.float32 else np.asarray(embeddings, dtype=np.float32)
+    return CompressedEmbeddings.encode(embeddings, storage)
+
+
+def score_embeddings(embeddings, queries: np.ndarray) -> np.ndarray:
+    """
+    Score embedding rows against one or more queries, in whichever format they are stored.
+
+    Args:
+        embeddings (np.ndarray | CompressedEmbeddings): The (n, dim) embedding matrix.
+        queries (np.ndarray): A (dim,) query or a (num_queries, dim) matrix of queries.
+
+    Returns:
+        np.ndarray: Scores of shape (n,) for one query, (num_queries, n) otherwise.
+    """
+    if isinstance(embeddings, CompressedEmbeddings):
+        return embeddings.score(queries)
+    return embeddings @ queries if queries.ndim == 1 else queries @ embeddings.T
+
+
+def rerank(query: np.ndarray, candidates: np.ndarray, embeddings: np.ndarray, k: int,
+           threshold: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Re-score search candidates against full-precision embeddings and keep the best `k`.
+
+    Args:
+        query (np.ndarray): The normalized query.
+        candidates (np.ndarray): Row indices returned by a search over compressed embeddings.
+        embeddings (np.ndarray): The normalized full-precision embeddings of the candidates.
+        k (int): The number of results to keep.
+        threshold (float): Optional minimum score.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The kept row indices and their scores, best first.
+    """
+    scores = embeddings @ query
+    order = top_k(scores, k, threshold)
+    return candidates[order], scores[order]
+
+
+class ChunkStore:
+    """
+    Chunk texts stored in one contiguous UTF-8 buffer with an array of offsets.
+
+    Millions of Python `str` objects cost far more than their text; a store holds two
+    allocations regardless of the number of chunks. Texts are decoded on access. Both buffers
+    grow geometrically, and existing rows are never moved or modified, so readers of earlier
+    rows are unaffected by appends.
+    """
+
+    def __init__(self, chunks: Iterable[str] = ()):
+        self._data = bytearray()
+        self._offsets = np.zeros(16, dtype=np.int64)
+        self._size = 0
+        self.extend(chunks)
+
+    def extend(self, chunks: Iterable[str]):
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        if not encoded:
+            return
+        required = self._size + len(encoded) + 1
+        if required > len(self._offsets):
+            offsets = np.zeros(max(required, 2 * len(self._offsets)), dtype=np.int64)
+            offsets[:self._size + 1] = self._offsets[:self._size + 1]
+            self._offsets = offsets
+        self._data += b"".join(encoded)
+        ends = self._offsets[self._size] + np.cumsum([len(chunk) for chunk in encoded])
+        self._offsets[self._size + 1:self._size + 1 + len(encoded)] = ends
+        self._size += len(encoded)
+
+    def append(self, chunk: str):
+        self.extend([chunk])
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(self._size))]
+        i = operator.index(key)
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("ChunkStore index out of range")
+        return self._data[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._size):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) + self._offsets.nbytes
+
+
+class VectorSearch:
+    """
+    Base class for nearest-neighbour search over an L2-normalized embedding matrix.
+
+    Subclasses implement `search`, returning the row indices and cosine similarities of
+    the best matches for a normalized query vector, skipping rows whose entry in the
+    optional `alive` mask is False. `extend` returns a search over a matrix that has had
+    rows appended, without rebuilding what is already indexed where possible.
+    """
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    def search(self, query: np.ndarray, k: int, threshold: Optional[float] = None,
+               alive: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def search_batch(self, queries: np.ndarray, k: int, threshold: Optional[float] = None,
+                     alive: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [self.search(query, k, threshold, alive) for query in queries]
+
+    def extend(self, embeddings: np.ndarray) -> "VectorSearch":
+        return type(self)(embeddings)
+
+
+class ExactSearch(VectorSearch):
+    """
+    Brute-force search: one matrix-vector product followed by a top-k partition.
+    """
+
+    def search(self, query: np.ndarray, k: int, threshold: Optional[float] = None,
+               alive: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        scores = score_embeddings(self.embeddings, query)
+        if alive is not None:
+            scores[~alive] = -np.inf
+        indices = top_k(scores, k, threshold)
+        if alive is not None:
+            indices = indices[alive[indices]]
+        return indices, scores[indices]
+
+    def search_batch(self, queries: np.ndarray, k: int, threshold: Optional[float] = None,
+                     alive: Optional[np.ndarray] = None, block_size: int = 256) -> List[Tuple[np.ndarray, np.ndarray]]:
+        # Score blocks of queries with one matrix product each, bounding the score matrix size
+        results = []
+        for start in range(0, len(queries), block_size):
+            scores = score_embeddings(self.embeddings, queries[start:start + block_size])
+            if alive is not None:
+                scores[:, ~alive] = -np.inf
+            for row in scores:
+                indices = top_k(row, k, threshold)
+                if alive is not None:
+                    indices = indices[alive[indices]]
+                results.append((indices, row[indices]))
+        return results
+
+
+class IVFSearch(VectorSearch):
+    """
+    Inverted-file approximate search.
+
+    The embeddings are partitioned with spherical k-means into `num_lists` clusters. A query
+    is scored against the centroids first and only the rows of the `num_probes` closest
+    clusters are scored exactly. Raising `num_probes` trades latency for recall; probing
+    every list is equivalent to exact search.
+
+    Rows appended through `extend` are scanned exactly until they exceed
+    `rebuild_fraction` of the partitioned rows, at which point the partitions are retrained.
+
+    Attributes:
+        num_lists (int): The number of k-means partitions. Defaults to sqrt(n).
+        num_probes (int): The number of partitions scanned per query.
+    """
+
+    def __init__(self, embeddings: np.ndarray, num_lists: Optional[int] = None, num_probes: int = 8,
+                 iterations: int = 10, sample_size: int = 256, seed: int = 0, block_size: int = 65536,
+                 rebuild_fraction: float = 0.1):
+        super().__init__(embeddings)
+        n = len(embeddings)
+        self.num_indexed = n
+        self.rebuild_fraction = rebuild_fraction
+        self._params = dict(num_lists=num_lists, iterations=iterations, sample_size=sample_size, seed=seed, block_size=block_size)
+        self.num_lists = max(1, min(n, num_lists or int(np.sqrt(n))))
+        self.num_probes = num_probes
+        self.block_size = block_size
+        rng = np.random.default_rng(seed)
+
+        # Train centroids on a sample of at most `sample_size` rows per list
+        if n > self.num_lists * sample_size:
+            sample = np.asarray(embeddings[np.sort(rng.choice(n, self.num_lists * sample_size, replace=False))], dtype=np.float32)
+        else:
+            sample = np.asarray(embeddings, dtype=np.float32)
+        self.centroids = sample[rng.choice(len(sample), self.num_lists, replace=False)].copy() if n else sample[:0]
+        for _ in range(iterations if n else 0):
+            labels = np.argmax(sample @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=self.num_lists) == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            self.centroids = normalize_embeddings(sums)
+
+        assignments = self._assign(embeddings)
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.num_lists))])
+
+    def _assign(self, embeddings: np.ndarray) -> np.ndarray:
+        assignments = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), self.block_size):
+            block = np.asarray(embeddings[start:start + self.block_size], dtype=np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def extend(self, embeddings: np.ndarray) -> "IVFSearch":
+        if len(embeddings) - self.num_indexed > self.rebuild_fraction * max(self.num_indexed, 1000):
+            return IVFSearch(embeddings, num_probes=self.num_probes, rebuild_fraction=self.rebuild_fraction, **self._params)
+        extended = copy.copy(self)
+        extended.embeddings = embeddings
+        return extended
+
+    def search(self, query: np.ndarray, k: int, threshold: Optional[float] = None,
+               alive: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.embeddings) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        candidates = [np.arange(self.num_indexed, len(self.embeddings))]
+        if self.num_indexed:
+            probes = top_k(self.centroids @ query, self.num_probes)
+            candidates += [self.order[self.offsets[i]:self.offsets[i + 1]] for i in probes]
+        candidates = np.concatenate(candidates)
+        if alive is not None:
+            candidates = candidates[alive[candidates]]
+        scores = score_embeddings(self.embeddings[candidates], query)
+        indices = top_k(scores, k, threshold)
+        return candidates[indices], scores[indices]
+
+
+class IndexSnapshot(NamedTuple):
+    """
+    An immutable, consistent view of a DocumentIndex.
+
+    Readers take the current snapshot once and use it for the whole request, so an update
+    running in another thread is either entirely visible or not visible at all.
+
+    Attributes:
+        chunks (ChunkStore): Chunk texts by row. Only the first `len(embeddings)` rows belong to
+            this snapshot; later rows may be appended by writers.
+        embeddings (np.ndarray | CompressedEmbeddings): The normalized embedding rows of this snapshot.
+        alive (np.ndarray): Boolean mask of non-removed rows, or None if no row is removed.
+        search (VectorSearch): The search backend over `embeddings`.
+        num_live (int): The number of non-removed rows.
+        token_counts (np.ndarray): The token length of each row's chunk, -1 where unknown.
+    """
+    chunks: ChunkStore
+    embeddings: Union[np.ndarray, CompressedEmbeddings]
+    alive: Optional[np.ndarray]
+    search: VectorSearch
+    num_live: int
+    token_counts: np.ndarray
+
+
+class DocumentIndex:
+    """
+    A mutable store of document chunks and their normalized embeddings.
+
+    Embeddings live in a buffer that grows by doubling, so appending documents does not copy
+    the existing matrix. Removed documents are tombstoned in an alive mask and their rows are
+    reclaimed by compaction once the removed fraction exceeds `compaction_threshold`. Every
+    change is published as a new `IndexSnapshot`; writers are serialized by a lock.
+
+    Chunk texts are kept in a ChunkStore, and embeddings are stored as float32, float16 or
+    int8 (see CompressedEmbeddings) according to `storage`. The token length of each chunk is
+    kept alongside, so prompts can be packed without tokenizing retrieved chunks again.
+
+    Attributes:
+        records (Dict[str, dict]): Document records by id, each with the document's content
+            `hash` and the buffer rows of its `chunks`.
+        snapshot (IndexSnapshot): The current view for readers.
+        storage (str): The embedding storage format: 'float32', 'float16' or 'int8'.
+    """
+
+    def __init__(self, chunks: List[str], embeddings: np.ndarray, records: List[dict], chunk_hashes: List[str],
+                 search_factory: Callable[[np.ndarray], VectorSearch] = ExactSearch, compaction_threshold: float = 0.25,
+                 storage: str = "float32", token_counts: Optional[np.ndarray] = None):
+        self._lock = threading.Lock()
+        self.search_factory = search_factory
+        self.compaction_threshold = compaction_threshold
+        self.storage = storage
+        token_counts = np.array(token_counts, dtype=np.int32) if token_counts is not None else np.full(len(chunks), -1, dtype=np.int32)
+        self._set_rows(ChunkStore(chunks), encode_embeddings(embeddings, storage), list(chunk_hashes), np.ones(len(chunks), dtype=bool), token_counts)
+        self.records = {record.get("id", record["hash"]): {"id": record.get("id", record["hash"]), "hash": record["hash"], "chunks": list(record["chunks"])} for record in records}
+        self._publish(self.search_factory(self._buffer[:self._size]))
+
+    def _set_rows(self, chunks: ChunkStore, buffer: Union[np.ndarray, CompressedEmbeddings], chunk_hashes: List[str], alive: np.ndarray,
+                  token_counts: np.ndarray):
+        self._chunks = chunks
+        self._buffer = buffer
+        self._chunk_hashes = chunk_hashes
+        self._alive = alive
+        self._token_counts = token_counts
+        self._size = len(chunks)
+        self._num_dead = 0
+        self._chunk_rows = {chunk_hash: row for row, chunk_hash in enumerate(chunk_hashes)}
+
+    def _publish(self, search: VectorSearch):
+        alive = self._alive[:self._size] if self._num_dead else None
+        self.snapshot = IndexSnapshot(self._chunks, self._buffer[:self._size], alive, search, self._size - self._num_dead, self._token_counts[:self._size])
+
+    @property
+    def dim(self) -> int:
+        return self._buffer.shape[1]
+
+    @property
+    def documents(self) -> List[str]:
+        """The texts of all non-removed chunks, in row order."""
+        snapshot = self.snapshot
+        if snapshot.alive is None:
+            return snapshot.chunks[:len(snapshot.embeddings)]
+        return [snapshot.chunks[row] for row in np.flatnonzero(snapshot.alive)]
+
+    @property
+    def embeddings(self) -> Union[np.ndarray, CompressedEmbeddings]:
+        """The embeddings of all non-removed chunks, aligned with `documents`, in the storage format."""
+        snapshot = self.snapshot
+        return snapshot.embeddings if snapshot.alive is None else snapshot.embeddings[snapshot.alive]
+
+    def embedding_for_chunk(self, chunk_hash: str) -> Optional[np.ndarray]:
+        """
+        Look up the stored embedding of a chunk by content hash.
+
+        Args:
+            chunk_hash (str): The chunk's content hash.
+
+        Returns:
+            np.ndarray: A copy of the embedding, or None if no live chunk has this hash.
+        """
+        with self._lock:
+            row = self._chunk_rows.get(chunk_hash)
+            return None if row is None else np.array(self._buffer[row])
+
+    def _reserve(self, num_rows: int):
+        # Grow geometrically so appends are amortized O(rows appended). A read-only buffer
+        # (e.g. a memory-mapped index) is copied into memory on the first append.
+        required = self._size + num_rows
+        if required <= len(self._buffer) and self._buffer.flags.writeable:
+            return
+        capacity = max(required, 2 * len(self._buffer), 16)
+        if self.storage == "float32":
+            buffer = np.empty((capacity, self.dim), dtype=np.float32)
+        else:
+            buffer = CompressedEmbeddings.empty(capacity, self.dim, self.storage)
+        buffer[:self._size] = self._buffer[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        token_counts = np.full(capacity, -1, dtype=np.int32)
+        token_counts[:self._size] = self._token_counts[:self._size]
+        self._buffer, self._alive, self._token_counts = buffer, alive, token_counts
+
+    def _tombstone(self, document_ids: List[str]) -> int:
+        rows = [row for document_id in document_ids if document_id in self.records for row in self.records.pop(document_id)["chunks"]]
+        if not rows:
+            return 0
+        # Copy-on-write, so published snapshots keep their own mask
+        self._alive = self._alive.copy()
+        self._alive[rows] = False
+        self._num_dead += len(rows)
+        for row in rows:
+            if self._chunk_rows.get(self._chunk_hashes[row]) == row:
+                del self._chunk_rows[self._chunk_hashes[row]]
+        return len(rows)
+
+    def add(self, documents: List[tuple]):
+        """
+        Add documents, replacing any existing documents with the same id.
+
+        Args:
+            documents: Tuples of (id, content hash, chunk texts, chunk hashes, normalized chunk
+                embeddings) and optionally the chunk token lengths.
+        """
+        with self._lock:
+            replaced = self._tombstone([document_id for document_id, *_ in documents])
+            self._reserve(sum(len(document[2]) for document in documents))
+            for document_id, document_hash, chunks, chunk_hashes, embeddings, *token_counts in documents:
+                rows = list(range(self._size, self._size + len(chunks)))
+                self._buffer[self._size:self._size + len(chunks)] = embeddings
+                self._alive[self._size:self._size + len(chunks)] = True
+                self._token_counts[self._size:self._size + len(chunks)] = token_counts[0] if token_counts else -1
+                self._chunks.extend(chunks)
+                self._chunk_hashes.extend(chunk_hashes)
+                for row, chunk_hash in zip(rows, chunk_hashes):
+                    self._chunk_rows[chunk_hash] = row
+                self.records[document_id] = {"id": document_id, "hash": document_hash, "chunks": rows}
+                self._size += len(chunks)
+            if replaced and self._needs_compaction():
+                self._compact()
+            else:
+                self._publish(self.snapshot.search.extend(self._buffer[:self._size]))
+
+    def remove(self, document_ids: List[str]) -> int:
+        """
+        Remove documents by id. Unknown ids are ignored.
+
+        Args:
+            document_ids (List[str]): The ids of the documents to remove.
+
+        Returns:
+            int: The number of chunks removed.
+        """
+        with self._lock:
+            removed = self._tombstone(document_ids)
+            if removed:
+                if self._needs_compaction():
+                    self._compact()
+                else:
+                    self._publish(self.snapshot.search)
+            return removed
+
+    def _needs_compaction(self) -> bool:
+        return self._num_dead > self.compaction_threshold * self._size
+
+    def compact(self):
+        """
+        Drop removed rows from the buffer and rebuild the search backend.
+        """
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        new_rows = np.full(self._size, -1, dtype=np.int64)
+        new_rows[keep] = np.arange(len(keep))
+        self._set_rows(
+            ChunkStore(self._chunks[row] for row in keep),
+            self._buffer[keep],
+            [self._chunk_hashes[row] for row in keep],
+            np.ones(len(keep), dtype=bool),
+            self._token_counts[keep],
+        )
+        for record in self.records.values():
+            record["chunks"] = new_rows[record["chunks"]].tolist()
+        self._publish(self.search_factory(self._buffer[:self._size]))
+
+    def export(self) -> Tuple[List[str], Union[np.ndarray, CompressedEmbeddings], List[dict], List[str], np.ndarray]:
+        """
+        Compact the index and return its contents for saving.
+
+        Returns:
+            Tuple[List[str], np.ndarray | CompressedEmbeddings, List[dict], List[str], np.ndarray]: The
+                chunk texts, embeddings in the storage format, document records, chunk hashes and
+                chunk token lengths.
+        """
+        with self._lock:
+            if self._num_dead:
+                self._compact()
+            records = [dict(record) for record in self.records.values()]
+            return self._chunks[:self._size], self._buffer[:self._size], records, self._chunk_hashes[:self._size], self._token_counts[:self._size]
@@ -0,0 +1,292 @@
+"""
+Streaming ingestion of large corpora into a TeapotAI document index.
+
+Documents are read lazily from texts, files, directories or glob patterns, chunked in worker
+processes and embedded in batches on a separate thread. A bounded queue sits between the two
+stages, so chunking and embedding overlap and memory use does not grow with the corpus. Each
+batch is added to the index as soon as it is embedded, and with an index path the index is
+saved every `ingest_checkpoint_interval` documents.
+
+Ingestion is resumable: documents are identified by their file path (or given id, or content
+hash), and a document whose id and content are already in the index is skipped without being
+chunked or embedded. Reloading a checkpointed index and ingesting the same source again
+therefore only processes what the checkpoint is missing.
+"""
+import glob
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .chunking import chunk_document
+from .index import hash_text
+
+__all__ = ["IngestStats", "iter_documents"]
+
+# Documents per chunking task, to amortize inter-process communication
+CHUNK_GROUP_SIZE = 16
+
+_STOP = object()
+_worker_chunker = None
+
+
+class IngestStats:
+    """
+    Progress of an ingestion run. Updated from both pipeline stages, so it is thread-safe.
+
+    Attributes:
+        documents (int): Documents read from the source.
+        skipped (int): Documents skipped because they are already indexed.
+        indexed (int): Documents added to the index.
+        chunks (int): Chunks added to the index.
+        embedded (int): Chunks embedded; chunks already in the index reuse their embedding.
+        checkpoints (int): Number of times the index was saved.
+        seconds (float): Time since ingestion started.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self.documents = 0
+        self.skipped = 0
+        self.indexed = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.checkpoints = 0
+
+    def update(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / max(self.seconds, 1e-9)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "documents": self.documents,
+                "skipped": self.skipped,
+                "indexed": self.indexed,
+                "chunks": self.chunks,
+                "embedded": self.embedded,
+                "checkpoints": self.checkpoints,
+                "seconds": self.seconds,
+                "chunks_per_second": self.chunks_per_second,
+            }
+
+    def __repr__(self) -> str:
+        return f"IngestStats({', '.join(f'{name}={value}' for name, value in self.to_dict().items())})"
+
+
+def _is_glob(path: str) -> bool:
+    return any(character in path for character in "*?[")
+
+
+def _read_file(path: str) -> Tuple[str, str]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return path, f.read()
+
+
+def _iter_path(path: str, pattern: str) -> Iterator[Tuple[str, str]]:
+    if os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, pattern), recursive=True)
+    elif os.path.isfile(path):
+        paths = [path]
+    elif _is_glob(path):
+        paths = glob.glob(path, recursive=True)
+    else:
+        raise ValueError(f"Teapot- No such file, directory or glob pattern: {path}")
+    for file_path in sorted(paths):
+        if os.path.isfile(file_path):
+            yield _read_file(file_path)
+
+
+def iter_documents(source: Union[str, os.PathLike, Iterable], pattern: str = "**/*") -> Iterator[Tuple[Optional[str], str]]:
+    """
+    Lazily read the documents of an ingestion source.
+
+    A path source is a file, a directory (whose files matching `pattern` are read, recursively
+    by default) or a glob pattern. An iterable source yields document texts, paths of files to
+    read, or (id, text) tuples. Files are identified by their path and read as UTF-8.
+
+    Args:
+        source: A path, a glob pattern, or an iterable of texts, paths or (id, text) tuples.
+        pattern (str): The glob pattern matched inside directories.
+
+    Returns:
+        Iterator[Tuple[Optional[str], str]]: (id, text) pairs. The id is None for plain texts.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        yield from _iter_path(os.fspath(source), pattern)
+        return
+    for item in source:
+        if isinstance(item, str):
+            yield None, item
+        elif isinstance(item, os.PathLike):
+            yield from _iter_path(os.fspath(item), pattern)
+        elif isinstance(item, tuple) and len(item) == 2:
+            yield item[0], item[1]
+        else:
+            raise ValueError(f"Teapot- Unsupported document source item: {item!r}")
+
+
+def _init_chunk_worker(tokenizer, context_chunking: bool, chunk_overlap: int):
+    global _worker_chunker
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    _worker_chunker = (tokenizer, context_chunking, chunk_overlap)
+
+
+def _chunk_group(texts: List[str]) -> List[List[str]]:
+    tokenizer, context_chunking, chunk_overlap = _worker_chunker
+    return [chunk_document(text, tokenizer, context_chunking, chunk_overlap) for text in texts]
+
+
+def _groups(items: Iterator, size: int) -> Iterator[list]:
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def _chunk_stream(teapot_ai, documents: Iterator[Tuple[Optional[str], str]], stats: IngestStats,
+                  executor: Optional[Executor], max_in_flight: int) -> Iterator[List[Tuple[str, str, List[str]]]]:
+    # Yields groups of chunked documents in source order, with at most `max_in_flight`
+    # groups submitted to the workers at a time
+    def hashed():
+        for document_id, text in documents:
+            document_hash = hash_text(text)
+            document_id = document_id if document_id is not None else document_hash
+            stats.update(documents=1)
+            if teapot_ai._is_indexed(document_id, document_hash):
+                stats.update(skipped=1)
+                continue
+            yield document_id, document_hash, text
+
+    pending = deque()
+    for group in _groups(hashed(), CHUNK_GROUP_SIZE):
+        texts = [text for _, _, text in group]
+        if executor is None:
+            yield [(document_id, document_hash, teapot_ai._chunk_document(text)) for document_id, document_hash, text in group]
+            continue
+        pending.append((group, executor.submit(_chunk_group, texts)))
+        if len(pending) >= max_in_flight:
+            yield _resolve(*pending.popleft())
+    while pending:
+        yield _resolve(*pending.popleft())
+
+
+def _resolve(group, future) -> List[Tuple[str, str, List[str]]]:
+    return [(document_id, document_hash, chunks) for (document_id, document_hash, _), chunks in zip(group, future.result())]
+
+
+def _embed_stage(teapot_ai, chunked: queue.Queue, stats: IngestStats, errors: list, batch_size: int,
+                 checkpoint_interval: int, index_path: Optional[str], callback: Optional[Callable[[IngestStats], None]]):
+    # Runs on its own thread. After an error it keeps draining the queue so the producer
+    # never blocks on a full queue.
+    batch, num_chunks, since_checkpoint = [], 0, 0
+
+    def flush():
+        nonlocal batch, num_chunks, since_checkpoint
+        embedded = teapot_ai._add_chunked(batch, show_progress=False)
+        stats.update(indexed=len(batch), chunks=num_chunks, embedded=embedded)
+        since_checkpoint += len(batch)
+        batch, num_chunks = [], 0
+        if index_path is not None and since_checkpoint >= checkpoint_interval:
+            teapot_ai.save_index(index_path)
+            stats.update(checkpoints=1)
+            since_checkpoint = 0
+            if teapot_ai.settings.verbose:
+                print(f"Ingested {stats.indexed} documents, {stats.chunks} chunks ({stats.chunks_per_second:.1f} chunks/s)")
+        if callback is not None:
+            callback(stats)
+
+    while True:
+        group = chunked.get()
+        if group is _STOP:
+            break
+        if errors:
+            continue
+        try:
+            batch.extend(group)
+            num_chunks += sum(len(chunks) for _, _, chunks in group)
+            if num_chunks >= batch_size:
+                flush()
+        except BaseException as e:
+            errors.append(e)
+    if batch and not errors:
+        try:
+            flush()
+        except BaseException as e:
+            errors.append(e)
+
+
+def ingest(teapot_ai, source, pattern: str = "**/*", index_path: Optional[str] = None,
+           callback: Optional[Callable[[IngestStats], None]] = None) -> IngestStats:
+    """
+    Run the ingestion pipeline for `TeapotAI.ingest`.
+
+    Args:
+        teapot_ai (TeapotAI): The instance whose index receives the documents.
+        source: A path, a glob pattern, or an iterable of texts, paths or (id, text) tuples.
+        pattern (str): The glob pattern matched inside directories.
+        index_path (str): Optional directory the index is checkpointed to and saved in.
+        callback (Callable): Optional function called with the stats after each embedded batch.
+
+    Returns:
+        IngestStats: The final counts and timing.
+    """
+    settings = teapot_ai.settings
+    stats = IngestStats()
+    num_workers = settings.ingest_num_workers if settings.ingest_num_workers is not None else (os.cpu_count() or 1)
+
+    executor = None
+    if num_workers > 0:
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        executor = ProcessPoolExecutor(
+            num_workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_chunk_worker,
+            initargs=(teapot_ai.tokenizer, settings.context_chunking, settings.chunk_overlap),
+        )
+
+    chunked = queue.Queue(maxsize=max(1, settings.ingest_queue_size))
+    errors = []
+    consumer = threading.Thread(
+        target=_embed_stage,
+        args=(teapot_ai, chunked, stats, errors, settings.ingest_batch_size, settings.ingest_checkpoint_interval, index_path, callback),
+        name="teapotai-ingest",
+        daemon=True,
+    )
+    consumer.start()
+    try:
+        for group in _chunk_stream(teapot_ai, iter_documents(source, pattern), stats, executor, max_in_flight=2 * max(num_workers, 1)):
+            if errors:
+                break
+            chunked.put(group)
+    finally:
+        chunked.put(_STOP)
+        consumer.join()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    if errors:
+        raise errors[0]
+
+    if index_path is not None:
+        teapot_ai.save_index(index_path)
+        teapot_ai.load_index(index_path)
+        stats.update(checkpoints=1)
+    return stats
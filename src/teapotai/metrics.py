@@ -0,0 +1,174 @@
+"""
+Per-stage timing and token counters for TeapotAI.
+
+Each pipeline stage (chunking, tokenization, query embedding, similarity scoring, reranking,
+context packing, encoder, decoder, decoding, refusal detection and tool execution) is timed
+with `TeapotMetrics.stage`.
+When metrics are disabled, `stage` returns a shared no-op context manager, so instrumented
+code only pays for one method call.
+"""
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, List, Optional
+
+STAGES = (
+    "chunking",
+    "tokenization",
+    "query_embedding",
+    "similarity",
+    "rerank",
+    "context_packing",
+    "encoder",
+    "decoder",
+    "decoding",
+    "refusal_detection",
+    "tool_execution",
+)
+
+_DISABLED = nullcontext()
+
+
+class _StageTimer:
+    __slots__ = ("metrics", "name", "started_at")
+
+    def __init__(self, metrics: "TeapotMetrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.started_at)
+
+
+class TeapotMetrics:
+    """
+    Thread-safe stage timings and token counters.
+
+    Callbacks are called after every recorded event with a dict holding the `stage`, its
+    duration in `seconds` and, for the decoder stage, the `tokens_in` and `tokens_out` of the
+    call. Context packing events also report the call's `prompt_tokens`, `context_tokens` and
+    number of `dropped` segments. Callbacks run on the calling thread, so they should be quick.
+
+    Attributes:
+        enabled (bool): Whether events are recorded. Can be toggled at any time.
+        callbacks (List[Callable]): Functions called with each recorded event.
+    """
+
+    def __init__(self, enabled: bool = False, callbacks: Optional[List[Callable[[dict], None]]] = None):
+        self.enabled = enabled
+        self.callbacks = list(callbacks or [])
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear every counter.
+        """
+        with self._lock:
+            self._stages = {}
+            self.tokens_in = 0
+            self.tokens_out = 0
+
+    def stage(self, name: str):
+        """
+        Time a block of code as one event of a stage.
+
+        Args:
+            name (str): The stage name, usually one of STAGES.
+
+        Returns:
+            A context manager that records the block's duration when metrics are enabled.
+        """
+        if not self.enabled:
+            return _DISABLED
+        return _StageTimer(self, name)
+
+    def record(self, name: str, seconds: float, tokens_in: int = 0, tokens_out: int = 0, **details):
+        """
+        Record one event of a stage and notify the callbacks.
+
+        Args:
+            name (str): The stage name.
+            seconds (float): The event's duration.
+            tokens_in (int): Prompt tokens processed by the event.
+            tokens_out (int): Tokens generated by the event.
+            **details: Other values passed on to the callbacks.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+            stage["count"] += 1
+            stage["seconds"] += seconds
+            stage["max_seconds"] = max(stage["max_seconds"], seconds)
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+        if self.callbacks:
+            event = {"stage": name, "seconds": seconds}
+            if tokens_in or tokens_out:
+                event.update(tokens_in=tokens_in, tokens_out=tokens_out)
+            event.update(details)
+            for callback in self.callbacks:
+                callback(event)
+
+    def add_callback(self, callback: Callable[[dict], None]):
+        """
+        Args:
+            callback (Callable): Called with each recorded event.
+        """
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[dict], None]):
+        """
+        Args:
+            callback (Callable): A callback previously added.
+        """
+        self.callbacks.remove(callback)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: For each stage that ran, its event count and total, mean and maximum
+                duration in seconds; and the total tokens in and out.
+        """
+        with self._lock:
+            stages = {
+                name: {**stage, "mean_seconds": stage["seconds"] / stage["count"]}
+                for name, stage in self._stages.items()
+            }
+            return {"stages": stages, "tokens_in": self.tokens_in, "tokens_out": self.tokens_out}
+
+    def to_prometheus(self, prefix: str = "teapotai") -> str:
+        """
+        Export the counters in the Prometheus text exposition format.
+
+        Args:
+            prefix (str): Prefix of the metric names.
+
+        Returns:
+            str: The exposition text.
+        """
+        stats = self.stats()
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Time spent in each pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]}' for name, stage in stats["stages"].items()]
+        lines += [
+            f"# HELP {prefix}_stage_calls_total Number of times each pipeline stage ran.",
+            f"# TYPE {prefix}_stage_calls_total counter",
+        ]
+        lines += [f'{prefix}_stage_calls_total{{stage="{name}"}} {stage["count"]}' for name, stage in stats["stages"].items()]
+        for name, description in (("tokens_in", "Prompt tokens processed."), ("tokens_out", "Tokens generated.")):
+            lines += [
+                f"# HELP {prefix}_{name}_total {description}",
+                f"# TYPE {prefix}_{name}_total counter",
+                f"{prefix}_{name}_total {stats[name]}",
+            ]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,72 @@
+"""
+Fitting retrieved chunks and caller context into the prompt's token budget.
+
+The system prompt and query are always kept. The remaining budget is filled greedily, most
+relevant segment first, using token lengths computed once per chunk (at indexing time for
+document chunks), so packing never tokenizes the prompt itself.
+"""
+from typing import List, NamedTuple
+
+__all__ = ["RetrievedChunk", "ContextPack", "pack_segments"]
+
+
+class RetrievedChunk(NamedTuple):
+    """
+    A chunk returned by retrieval.
+
+    Attributes:
+        text (str): The chunk text.
+        score (float): Cosine similarity to the query. Caller-provided context, which is not
+            ranked, has an infinite score so it is packed first.
+        num_tokens (int): The chunk's token length, without special tokens.
+    """
+    text: str
+    score: float
+    num_tokens: int
+
+
+class ContextPack(NamedTuple):
+    """
+    The prompt built for one query and what it left out.
+
+    Attributes:
+        prompt (str): The prompt sent to the model.
+        included (List[str]): The context segments in the prompt.
+        dropped (List[str]): The context segments left out to stay within the budget.
+        prompt_tokens (int): The prompt's token length, special tokens included.
+        context_tokens (int): Tokens used by the included segments.
+        budget (int): The maximum prompt length (`max_context_length`).
+    """
+    prompt: str
+    included: List[str]
+    dropped: List[str]
+    prompt_tokens: int
+    context_tokens: int
+    budget: int
+
+
+def pack_segments(segments: List[RetrievedChunk], budget: int, separator_tokens: int = 0) -> List[bool]:
+    """
+    Choose the segments to keep within a token budget.
+
+    Segments are considered by descending score (ties keep their order) and kept if they fit
+    in what is left of the budget, so a segment too long to fit does not stop shorter, less
+    relevant ones from being kept.
+
+    Args:
+        segments (List[RetrievedChunk]): The candidate segments.
+        budget (int): Tokens available for the segments.
+        separator_tokens (int): Tokens added by the separator before each segment.
+
+    Returns:
+        List[bool]: Whether each segment is kept, in the order of `segments`.
+    """
+    keep = [False] * len(segments)
+    remaining = budget
+    order = sorted(range(len(segments)), key=lambda i: -segments[i].score)
+    for i in order:
+        cost = segments[i].num_tokens + separator_tokens
+        if cost <= remaining:
+            keep[i] = True
+            remaining -= cost
+    return keep
@@ -0,0 +1,346 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from typing import Callable, List, Optional, Union
+
+from pydantic import BaseModel
+
+from .teapotai import TeapotAI, DEFAULT_SYSTEM_PROMPT
+
+__all__ = ["TeapotPool", "WorkerCrashedError"]
+
+
+class WorkerCrashedError(RuntimeError):
+    """
+    Raised for a TeapotPool request whose worker process died (or was killed after exceeding
+    `task_timeout`) before answering.
+    """
+
+
+def _worker_main(teapot_ai: Optional[TeapotAI], factory: Optional[Callable[[], TeapotAI]], num_threads: int, connection):
+    # Runs in the worker process. With fork, `teapot_ai` is the parent's instance and its
+    # weights are shared copy-on-write; otherwise each worker builds its own from `factory`.
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    import torch
+    torch.set_num_threads(num_threads)
+    if teapot_ai is None:
+        teapot_ai = factory()
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        task_id, method, args, kwargs = task
+        started_at = time.perf_counter()
+        try:
+            result, error = getattr(teapot_ai, method)(*args, **kwargs), None
+        except Exception as e:
+            result, error = None, e
+        busy_seconds = time.perf_counter() - started_at
+        try:
+            connection.send((task_id, result, error, busy_seconds))
+        except Exception as e:
+            # The result or exception could not be pickled
+            connection.send((task_id, None, RuntimeError(f"Teapot- Unable to return the result: {e!r}"), busy_seconds))
+
+
+class _Worker:
+    __slots__ = ("index", "process", "connection", "send_lock", "in_flight", "started_at", "busy_seconds", "completed", "failed", "restarts")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.send_lock = threading.Lock()
+        self.in_flight = {}
+        self.started_at = None
+        self.busy_seconds = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = -1
+
+
+class TeapotPool:
+    """
+    Runs TeapotAI in several worker processes and spreads `query`, `chat` and `extract` calls
+    across them, so throughput scales with CPU cores instead of being capped by the GIL and
+    torch's intra-op scaling.
+
+    With the default `fork` start method the models are loaded once in the parent (see
+    `TeapotAI.warm_up`) and workers share the weights copy-on-write, so memory does not grow
+    with the number of workers. With `spawn`/`forkserver`, pass a picklable factory that
+    builds the TeapotAI instance; each worker then loads its own copy.
+
+    Each request goes to the worker with the fewest requests in flight. A worker that dies is
+    restarted (up to `max_restarts` times per worker), and its in-flight requests fail with
+    WorkerCrashedError.
+
+    Attributes:
+        num_workers (int): Number of worker processes.
+        threads_per_worker (int): torch intra-op threads per worker.
+        max_restarts (int): Number of times each worker may be restarted after a crash.
+        task_timeout (float): Seconds after which a worker stuck on a request is killed and
+            restarted, or None to wait indefinitely.
+    """
+
+    def __init__(self, teapot_ai: Union[TeapotAI, Callable[[], TeapotAI]], num_workers: Optional[int] = None,
+                 threads_per_worker: Optional[int] = None, start_method: Optional[str] = None,
+                 max_restarts: int = 3, task_timeout: Optional[float] = None):
+        """
+        Start the worker processes.
+
+        Args:
+            teapot_ai (Union[TeapotAI, Callable]): The instance to serve, or a factory that builds it.
+            num_workers (int): Number of worker processes. Defaults to one per 4 CPU cores.
+            threads_per_worker (int): torch threads per worker. Defaults to dividing the CPU
+                cores evenly between workers.
+            start_method (str): The multiprocessing start method. Defaults to 'fork' where available.
+            max_restarts (int): Number of times each worker may be restarted after a crash.
+            task_timeout (float): Seconds after which a stuck worker is killed and restarted.
+        """
+        cpu_count = os.cpu_count() or 1
+        self.num_workers = num_workers or max(1, cpu_count // 4)
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count // self.num_workers)
+        self.max_restarts = max_restarts
+        self.task_timeout = task_timeout
+
+        if start_method is None:
+            start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(start_method)
+        if isinstance(teapot_ai, TeapotAI):
+            if start_method != "fork":
+                raise ValueError("Teapot- A TeapotAI instance can only be shared with forked workers, pass a factory instead")
+            # Load every model before forking so all workers share one copy of the weights
+            teapot_ai.warm_up()
+            self._teapot_ai, self._factory = teapot_ai, None
+        else:
+            self._teapot_ai, self._factory = None, teapot_ai
+
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+        self._workers = [_Worker(index) for index in range(self.num_workers)]
+        for worker in self._workers:
+            self._start(worker)
+
+        self._collector = threading.Thread(target=self._collect, name="teapot-pool", daemon=True)
+        self._collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start(self, worker: _Worker):
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self._teapot_ai, self._factory, self.threads_per_worker, child_connection),
+            name=f"teapot-worker-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        worker.process, worker.connection = process, parent_connection
+        worker.started_at = time.perf_counter()
+        worker.restarts += 1
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        """
+        Call a TeapotAI method in a worker process.
+
+        Args:
+            method (str): The name of the TeapotAI method, e.g. 'query'.
+            *args: Positional arguments for the method. They must be picklable.
+            **kwargs: Keyword arguments for the method.
+
+        Returns:
+            Future: Resolves to the method's return value or exception.
+        """
+        if method.startswith("_"):
+            raise ValueError(f"Teapot- Unsupported method: {method}")
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Teapot- The pool is closed")
+            alive = [worker for worker in self._workers if worker.process is not None]
+            if not alive:
+                raise WorkerCrashedError("Teapot- No workers are running")
+            worker = min(alive, key=lambda worker: len(worker.in_flight))
+            connection = worker.connection
+            if connection is None:
+                raise WorkerCrashedError(f"Teapot- Worker {worker.index} is unavailable")
+            task_id = next(self._task_ids)
+            worker.in_flight[task_id] = (future, time.perf_counter())
+        try:
+            with worker.send_lock:
+                with self._lock:
+                    # A restart since the worker was picked has already failed the future, and
+                    # the task must not reach the replacement worker
+                    pending = task_id in worker.in_flight
+                if pending:
+                    connection.send((task_id, method, args, kwargs))
+        except (OSError, ValueError) as e:
+            # The worker died before the request could be sent; the collector restarts it
+            with self._lock:
+                pending = worker.in_flight.pop(task_id, None) is not None
+            if pending:
+                future.set_exception(WorkerCrashedError(f"Teapot- Worker {worker.index} is unavailable: {e}"))
+        return future
+
+    def query(self, query: str, context: str = "", system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> str:
+        """
+        Answer a query in a worker process. See `TeapotAI.query`.
+        """
+        return self.submit("query", query, context=context, system_prompt=system_prompt).result()
+
+    def chat(self, conversation_history: List[dict]) -> str:
+        """
+        Respond to a conversation in a worker process. See `TeapotAI.chat`.
+        """
+        return self.submit("chat", conversation_history).result()
+
+    def extract(self, class_annotation: BaseModel, query: str = "", context: str = "") -> BaseModel:
+        """
+        Extract a Pydantic class in a worker process. See `TeapotAI.extract`. The class must
+        be importable by the workers (defined at module level).
+        """
+        return self.submit("extract", class_annotation, query=query, context=context).result()
+
+    def _collect(self):
+        # Resolves futures as results arrive, and restarts workers that exit or hang
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                # The process and connection seen here, so a worker restarted meanwhile is not restarted again
+                workers = [(worker, worker.process, worker.connection) for worker in self._workers if worker.process is not None]
+            try:
+                ready = wait([connection for _, _, connection in workers] + [process.sentinel for _, process, _ in workers], timeout=0.1)
+            except (OSError, ValueError):
+                # A connection was closed by a restart from another thread
+                continue
+            for worker, process, connection in workers:
+                if connection in ready:
+                    try:
+                        while connection.poll():
+                            self._resolve(worker, *connection.recv())
+                    except (EOFError, OSError):
+                        self._restart(worker, "exited", process)
+                        continue
+                if process.sentinel in ready:
+                    self._restart(worker, f"exited with code {process.exitcode}", process)
+                elif self.task_timeout is not None and worker.in_flight:
+                    oldest = min(started_at for _, started_at in worker.in_flight.values())
+                    if time.perf_counter() - oldest > self.task_timeout:
+                        process.kill()
+                        process.join()
+                        self._restart(worker, f"exceeded the task timeout of {self.task_timeout}s", process)
+
+    def _resolve(self, worker: _Worker, task_id: int, result, error: Optional[Exception], busy_seconds: float):
+        with self._lock:
+            future, _ = worker.in_flight.pop(task_id, (None, None))
+            worker.busy_seconds += busy_seconds
+            if error is None:
+                worker.completed += 1
+            else:
+                worker.failed += 1
+        if future is None:
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _restart(self, worker: _Worker, reason: str, process=None):
+        with self._lock:
+            if worker.process is None or self._closed or (process is not None and worker.process is not process):
+                return
+            in_flight, worker.in_flight = worker.in_flight, {}
+            worker.connection.close()
+            worker.process.join(timeout=1)
+            worker.process = worker.connection = None
+            restart = worker.restarts < self.max_restarts
+            if restart:
+                self._start(worker)
+        for future, _ in in_flight.values():
+            future.set_exception(WorkerCrashedError(f"Teapot- Worker {worker.index} {reason}"))
+
+    def stats(self) -> List[dict]:
+        """
+        Report per-worker activity.
+
+        Returns:
+            List[dict]: For each worker: its pid (None if it could not be restarted), whether it
+                is alive, requests in flight, completed and failed requests, restarts, and
+                utilization (fraction of time spent handling requests since it started). On
+                Linux, also its resident and proportional set sizes in megabytes; the
+                proportional size splits shared pages between processes, so summing it over
+                workers shows the real memory cost of the pool.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            report = []
+            for worker in self._workers:
+                alive = worker.process is not None and worker.process.is_alive()
+                entry = {
+                    "worker": worker.index,
+                    "pid": worker.process.pid if worker.process is not None else None,
+                    "alive": alive,
+                    "in_flight": len(worker.in_flight),
+                    "completed": worker.completed,
+                    "failed": worker.failed,
+                    "restarts": worker.restarts,
+                    "utilization": worker.busy_seconds / max(now - worker.started_at, 1e-9),
+                }
+                if alive:
+                    entry.update(_memory_mb(worker.process.pid))
+                report.append(entry)
+            return report
+
+    def close(self):
+        """
+        Stop the workers. Requests still in flight fail with WorkerCrashedError.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = [worker for worker in self._workers if worker.process is not None]
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.connection.send(None)
+            except (OSError, ValueError):
+                pass
+        self._collector.join()
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.connection.close()
+            for future, _ in worker.in_flight.values():
+                future.set_exception(WorkerCrashedError("Teapot- The pool was closed"))
+            worker.in_flight = {}
+
+
+def _memory_mb(pid: int) -> dict:
+    # Linux only; other platforms report no memory figures
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    return {
+        "rss_mb": int(fields["Rss"].split()[0]) / 1024,
+        "pss_mb": int(fields["Pss"].split()[0]) / 1024,
+    }
@@ -0,0 +1,121 @@
+"""
+A NumPy implementation of the refusal classifier.
+
+The classifier was trained as a scikit-learn MLPClassifier over mean-pooled sentence
+embeddings. Its weights are exported to a small .npz file so inference is a couple of matrix
+products, without importing scikit-learn or unpickling an estimator.
+
+To re-export after retraining:
+
+    python -m teapotai.refusal teapot_refusal_classifier.joblib teapot_refusal_classifier.npz
+"""
+import sys
+from typing import List
+
+import numpy as np
+
+_ACTIVATIONS = {
+    "identity": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "tanh": np.tanh,
+    "logistic": lambda x: 1 / (1 + np.exp(-x)),
+}
+
+
+class RefusalClassifier:
+    """
+    A multi-layer perceptron binary classifier with the same `predict_proba` interface as
+    scikit-learn's MLPClassifier.
+
+    Attributes:
+        coefs (List[np.ndarray]): The weight matrix of each layer.
+        intercepts (List[np.ndarray]): The bias vector of each layer.
+        activation (str): The hidden layer activation: 'identity', 'relu', 'tanh' or 'logistic'.
+    """
+
+    def __init__(self, coefs: List[np.ndarray], intercepts: List[np.ndarray], activation: str = "relu"):
+        if activation not in _ACTIVATIONS:
+            raise ValueError(f"Teapot- Unsupported activation: {activation}")
+        self.coefs = [np.asarray(coef, dtype=np.float32) for coef in coefs]
+        self.intercepts = [np.asarray(intercept, dtype=np.float32) for intercept in intercepts]
+        self.activation = activation
+
+    @classmethod
+    def from_sklearn(cls, classifier) -> "RefusalClassifier":
+        """
+        Convert a fitted binary scikit-learn MLPClassifier.
+
+        Args:
+            classifier (MLPClassifier): The fitted classifier.
+
+        Returns:
+            RefusalClassifier: The equivalent NumPy classifier.
+        """
+        if classifier.out_activation_ != "logistic":
+            raise ValueError("Teapot- Only binary classifiers can be converted")
+        return cls(classifier.coefs_, classifier.intercepts_, classifier.activation)
+
+    @classmethod
+    def load(cls, file) -> "RefusalClassifier":
+        """
+        Load a classifier saved with `save`.
+
+        Args:
+            file: A path or binary file object.
+
+        Returns:
+            RefusalClassifier: The loaded classifier.
+        """
+        with np.load(file) as data:
+            num_layers = int(data["num_layers"])
+            return cls(
+                [data[f"coef_{i}"] for i in range(num_layers)],
+                [data[f"intercept_{i}"] for i in range(num_layers)],
+                str(data["activation"]),
+            )
+
+    def save(self, file):
+        """
+        Save the classifier as an .npz archive.
+
+        Args:
+            file: A path or binary file object.
+        """
+        arrays = {"num_layers": np.array(len(self.coefs)), "activation": np.array(self.activation)}
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            arrays[f"coef_{i}"] = coef
+            arrays[f"intercept_{i}"] = intercept
+        np.savez(file, **arrays)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Args:
+            X: Embeddings of shape (n, embedding dim).
+
+        Returns:
+            np.ndarray: Class probabilities of shape (n, 2); column 1 is the refusal probability.
+        """
+        hidden = np.asarray(X, dtype=np.float32)
+        activation = _ACTIVATIONS[self.activation]
+        for coef, intercept in zip(self.coefs[:-1], self.intercepts[:-1]):
+            hidden = activation(hidden @ coef + intercept)
+        logits = (hidden @ self.coefs[-1] + self.intercepts[-1])[:, 0]
+        # Sigmoid, without overflow for large negative logits
+        probability = np.exp(-np.logaddexp(0, -logits))
+        return np.stack([1 - probability, probability], axis=1)
+
+
+def export_refusal_classifier(joblib_path: str, npz_path: str):
+    """
+    Export a pickled scikit-learn MLPClassifier to the NumPy format read by RefusalClassifier.
+
+    Args:
+        joblib_path (str): The joblib file of the fitted classifier.
+        npz_path (str): The .npz file to write.
+    """
+    import joblib
+    RefusalClassifier.from_sklearn(joblib.load(joblib_path)).save(npz_path)
+
+
+if __name__ == "__main__":
+    export_refusal_classifier(sys.argv[1], sys.argv[2])
@@ -0,0 +1,80 @@
+"""
+A process-wide registry of loaded models, shared by every TeapotAI instance.
+
+Loading the generator, tokenizer, embedding pipeline and refusal classifier dominates the
+cost of creating a TeapotAI instance. With the `shared_models` setting (on by default) the
+default models are taken from this registry instead, keyed by kind, model name, revision and
+inference backend, so instances that differ only in documents, tools or settings (one per
+tenant, or one per Streamlit rerun) share one copy of the weights and only hold their own
+index. Models passed to TeapotAI explicitly are never registered.
+
+The shared handles are used for inference only and are never modified in place, so they can
+be used by several instances and threads at once.
+"""
+import threading
+from typing import Callable, Hashable, List
+
+__all__ = ["ModelRegistry", "model_registry"]
+
+
+class ModelRegistry:
+    """
+    Thread-safe cache of loaded models.
+
+    Each handle is loaded once, on first request, even when several threads request it at the
+    same time. Different handles load concurrently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._loading = {}
+
+    def get(self, key: Hashable, loader: Callable):
+        """
+        Return the handle registered under `key`, loading it with `loader` if needed.
+
+        Args:
+            key (Hashable): Identifies the model, e.g. ("generator", name, revision, backend).
+            loader (Callable): Called without arguments to load the model. If it raises, nothing
+                is registered and the next request tries again.
+
+        Returns:
+            The shared handle.
+        """
+        with self._lock:
+            if key in self._handles:
+                return self._handles[key]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._handles:
+                    return self._handles[key]
+            handle = loader()
+            with self._lock:
+                self._handles[key] = handle
+                self._loading.pop(key, None)
+            return handle
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._handles)
+
+    def clear(self):
+        """
+        Drop every handle. Instances already holding a model keep it; new instances load again.
+        """
+        with self._lock:
+            self._handles.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._handles
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._handles)
+
+
+# The registry used by TeapotAI
+model_registry = ModelRegistry()
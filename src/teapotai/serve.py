@@ -0,0 +1,256 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, List, Optional, TYPE_CHECKING
+
+import numpy as np
+from pydantic import BaseModel
+
+from .teapotai import TeapotAI, DEFAULT_SYSTEM_PROMPT
+
+if TYPE_CHECKING:
+    from .streaming import TeapotStream
+
+__all__ = ["AsyncTeapotAI", "QueueFullError"]
+
+
+class QueueFullError(RuntimeError):
+    """
+    Raised when a request is submitted to a full AsyncTeapotAI queue and `reject_when_full` is set.
+    """
+
+
+class _Request:
+    __slots__ = ("key", "args", "future", "submitted_at")
+
+    def __init__(self, key: tuple, args: tuple, future: asyncio.Future):
+        self.key = key
+        self.args = args
+        self.future = future
+        self.submitted_at = time.perf_counter()
+
+
+class AsyncTeapotAI:
+    """
+    Asyncio front end for a shared TeapotAI instance with dynamic micro-batching.
+
+    Requests are queued and a scheduler groups them into micro-batches: it dispatches a batch
+    as soon as `max_batch_size` requests are waiting, or `max_wait_ms` after the first request
+    of the batch arrived. Batches run one at a time on a dedicated inference thread through
+    `TeapotAI.query_batch` / `extract_batch`, so concurrent callers share forward passes
+    instead of competing for torch threads. Requests that arrive while a batch is running
+    are collected into the next one.
+
+    Attributes:
+        teapot_ai (TeapotAI): The wrapped TeapotAI instance.
+        max_batch_size (int): Maximum number of requests per micro-batch.
+        max_wait_ms (float): Maximum time to hold a request while waiting for a batch to fill.
+        max_queue_size (int): Maximum number of queued requests before backpressure applies.
+        reject_when_full (bool): Raise QueueFullError when the queue is full instead of
+            waiting for space.
+    """
+
+    def __init__(self, teapot_ai: TeapotAI, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 max_queue_size: int = 1024, reject_when_full: bool = False, metrics_window: int = 1024):
+        self.teapot_ai = teapot_ai
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.reject_when_full = reject_when_full
+
+        self._loop = None
+        self._queue = None
+        self._scheduler = None
+        self._executor = None
+
+        self._latencies = deque(maxlen=metrics_window)
+        self._queue_waits = deque(maxlen=metrics_window)
+        self._batch_sizes = deque(maxlen=metrics_window)
+        self._times_to_first_token = deque(maxlen=metrics_window)
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._in_flight = 0
+
+    async def __aenter__(self):
+        self._ensure_started()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _ensure_started(self):
+        if self._scheduler is None:
+            self._loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="teapot-inference")
+            self._scheduler = self._loop.create_task(self._schedule())
+
+    async def close(self):
+        """
+        Stop the scheduler and inference thread. Queued requests are cancelled.
+        """
+        if self._scheduler is None:
+            return
+        self._scheduler.cancel()
+        try:
+            await self._scheduler
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            self._queue.get_nowait().future.cancel()
+        self._executor.shutdown(wait=True)
+        self._scheduler = None
+
+    async def _submit(self, key: tuple, args: tuple):
+        self._ensure_started()
+        request = _Request(key, args, self._loop.create_future())
+        if self.reject_when_full:
+            try:
+                self._queue.put_nowait(request)
+            except asyncio.QueueFull:
+                self._rejected += 1
+                raise QueueFullError("Teapot- Request queue is full")
+        else:
+            await self._queue.put(request)
+        return await request.future
+
+    async def query(self, query: str, context: str = "", system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> str:
+        """
+        Answer a query, batched with other concurrent requests. See `TeapotAI.query`.
+        """
+        return await self._submit(("query", system_prompt), (query, context))
+
+    async def chat(self, conversation_history: List[dict]) -> str:
+        """
+        Respond to a conversation, batched with other concurrent requests. See `TeapotAI.chat`.
+        """
+        query, context = self.teapot_ai._chat_query(conversation_history)
+        return await self._submit(("query", DEFAULT_SYSTEM_PROMPT), (query, context))
+
+    async def extract(self, class_annotation: BaseModel, query: str = "", context: str = "") -> BaseModel:
+        """
+        Extract a Pydantic class, batched with other concurrent requests for the same class.
+        See `TeapotAI.extract`.
+        """
+        return await self._submit(("extract", class_annotation), (query, context))
+
+    async def query_stream(self, query: str, context: str = "", system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> AsyncIterator[str]:
+        """
+        Stream the answer to a query as text increments. See `TeapotAI.query_stream`.
+        Generation runs on the inference thread and stops if the iteration is abandoned.
+        """
+        async for text in self._stream(lambda: self.teapot_ai.query_stream(query, context, system_prompt, executor=self._executor)):
+            yield text
+
+    async def chat_stream(self, conversation_history: List[dict]) -> AsyncIterator[str]:
+        """
+        Stream the response to a conversation as text increments. See `TeapotAI.chat_stream`.
+        """
+        async for text in self._stream(lambda: self.teapot_ai.chat_stream(conversation_history, executor=self._executor)):
+            yield text
+
+    async def _stream(self, make_stream: Callable[[], "TeapotStream"]) -> AsyncIterator[str]:
+        self._ensure_started()
+        # Retrieval runs on the inference thread, which then queues the generation itself
+        stream = await self._loop.run_in_executor(self._executor, make_stream)
+        try:
+            while True:
+                text = await asyncio.to_thread(next, stream, None)
+                if text is None:
+                    break
+                yield text
+        finally:
+            stream.cancel()
+            if stream.time_to_first_token is not None:
+                self._times_to_first_token.append(stream.time_to_first_token)
+
+    async def _schedule(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [request for request in batch if not request.future.cancelled()]
+            if not batch:
+                continue
+            dispatched_at = time.perf_counter()
+            self._queue_waits.extend(dispatched_at - request.submitted_at for request in batch)
+            self._batch_sizes.append(len(batch))
+            self._in_flight = len(batch)
+            try:
+                await self._loop.run_in_executor(self._executor, self._run_batch, batch)
+            finally:
+                self._in_flight = 0
+
+    def _run_batch(self, batch: List[_Request]):
+        # Runs on the inference thread. Requests are grouped by kind and shared parameter so
+        # each group is a single batched TeapotAI call.
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.key, []).append(request)
+
+        for (kind, parameter), requests in groups.items():
+            queries = [request.args[0] for request in requests]
+            contexts = [request.args[1] for request in requests]
+            try:
+                if kind == "query":
+                    results = self.teapot_ai.query_batch(queries, contexts, system_prompt=parameter)
+                else:
+                    results = self.teapot_ai.extract_batch(parameter, queries, contexts)
+            except Exception as e:
+                for request in requests:
+                    self._loop.call_soon_threadsafe(self._resolve, request, None, e)
+            else:
+                for request, result in zip(requests, results):
+                    self._loop.call_soon_threadsafe(self._resolve, request, result, None)
+
+    def _resolve(self, request: _Request, result, exception: Optional[Exception]):
+        if request.future.done():
+            return
+        self._latencies.append(time.perf_counter() - request.submitted_at)
+        if exception is not None:
+            self._failed += 1
+            request.future.set_exception(exception)
+        else:
+            self._completed += 1
+            request.future.set_result(result)
+
+    def metrics(self) -> dict:
+        """
+        Report queue and latency metrics over the most recent requests.
+
+        Returns:
+            dict: Queue depth, request counters, mean batch size and latency percentiles
+                (end-to-end, time spent queued and streaming time to first token) in milliseconds.
+        """
+        def percentiles(values, name):
+            values = np.array(values) * 1000 if values else np.zeros(1)
+            return {
+                f"{name}_p50_ms": float(np.percentile(values, 50)),
+                f"{name}_p95_ms": float(np.percentile(values, 95)),
+                f"{name}_max_ms": float(values.max()),
+            }
+
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self._in_flight,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "mean_batch_size": float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+            **percentiles(self._latencies, "latency"),
+            **percentiles(self._queue_waits, "queue_wait"),
+            **percentiles(self._times_to_first_token, "time_to_first_token"),
+        }
@@ -0,0 +1,213 @@
+import base64
+from typing import List, Optional
+
+import numpy as np
+
+from .index import normalize_embeddings
+from .teapotai import TeapotAI, DEFAULT_SYSTEM_PROMPT
+
+__all__ = ["ChatSession"]
+
+
+class ChatSession:
+    """
+    A conversation with TeapotAI whose per-turn cost does not grow with its length.
+
+    `TeapotAI.chat` turns the whole history into the context of every turn, so long
+    conversations are re-chunked and re-embedded each time. A session instead embeds and
+    tokenizes each message once, when it is added. Each turn's context is the most recent
+    messages plus the earlier messages most similar to the new one, packed under
+    `max_history_tokens`.
+
+    Sessions serialize to a JSON-compatible dict, embeddings included, so a stateless server
+    can store them between requests and resume without re-embedding.
+
+    Attributes:
+        teapot_ai (TeapotAI): The engine answering the conversation.
+        messages (List[dict]): The conversation so far, as {'role', 'content'} dicts.
+        system_prompt (str): The system prompt used for every turn.
+        max_history_tokens (int): Token budget for the past messages included in a turn.
+        recent_messages (int): Number of most recent messages always considered first.
+        num_retrieved (int): Maximum number of older messages retrieved by similarity.
+    """
+
+    def __init__(self, teapot_ai: TeapotAI, system_prompt: str = DEFAULT_SYSTEM_PROMPT, max_history_tokens: int = 256,
+                 recent_messages: int = 4, num_retrieved: Optional[int] = None, messages: Optional[List[dict]] = None):
+        """
+        Start a session.
+
+        Args:
+            teapot_ai (TeapotAI): The engine answering the conversation.
+            system_prompt (str): The system prompt used for every turn.
+            max_history_tokens (int): Token budget for the past messages included in a turn.
+            recent_messages (int): Number of most recent messages always considered first.
+            num_retrieved (int): Maximum number of older messages retrieved by similarity.
+                Defaults to the engine's `rag_num_results`.
+            messages (List[dict]): Optional earlier messages to start from.
+        """
+        self.teapot_ai = teapot_ai
+        self.system_prompt = system_prompt
+        self.max_history_tokens = max_history_tokens
+        self.recent_messages = recent_messages
+        self.num_retrieved = num_retrieved if num_retrieved is not None else teapot_ai.settings.rag_num_results
+        self.messages: List[dict] = []
+        self._token_counts: List[int] = []
+        self._embeddings: Optional[np.ndarray] = None
+        if messages:
+            self.add_messages(messages)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    @staticmethod
+    def _format(message: dict) -> str:
+        return f"{message.get('role', '')}: {message.get('content', '')}\n"
+
+    def _append(self, messages: List[dict], token_counts: List[int], embeddings: np.ndarray):
+        # Embeddings live in a buffer that doubles when full, so appends are amortized O(1)
+        start = len(self.messages)
+        end = start + len(messages)
+        if self._embeddings is None or end > len(self._embeddings):
+            capacity = max(16, end, 2 * (len(self._embeddings) if self._embeddings is not None else 0))
+            grown = np.empty((capacity, embeddings.shape[1]), dtype=np.float32)
+            if self._embeddings is not None:
+                grown[:start] = self._embeddings[:start]
+            self._embeddings = grown
+        self._embeddings[start:end] = embeddings
+        self.messages.extend(messages)
+        self._token_counts.extend(token_counts)
+
+    def add_messages(self, messages: List[dict]):
+        """
+        Add messages to the session, tokenizing and embedding them in one batch.
+
+        Args:
+            messages (List[dict]): Messages with 'role' and 'content'.
+        """
+        if len(messages) == 0:
+            return
+        messages = [{"role": message.get("role", ""), "content": message.get("content", "")} for message in messages]
+        token_counts = [
+            len(ids) for ids in self.teapot_ai.tokenizer([self._format(message) for message in messages], add_special_tokens=False)["input_ids"]
+        ]
+        embeddings = normalize_embeddings(self.teapot_ai._embed([message["content"] for message in messages]))
+        self._append(messages, token_counts, embeddings)
+
+    def add_message(self, role: str, content: str):
+        """
+        Add one message to the session.
+
+        Args:
+            role (str): The author, e.g. 'user' or 'assistant'.
+            content (str): The message text.
+        """
+        self.add_messages([{"role": role, "content": content}])
+
+    def history(self, query_index: Optional[int] = None) -> str:
+        """
+        Select and format the past messages for a turn.
+
+        The most recent `recent_messages` messages are taken newest first while they fit the
+        token budget; the remaining budget goes to the older messages most similar to the
+        query message. The selection is returned in conversation order.
+
+        Args:
+            query_index (int): Index of the message being answered. Defaults to the last message.
+
+        Returns:
+            str: The selected messages, one 'role: content' line each.
+        """
+        if query_index is None:
+            query_index = len(self.messages) - 1
+        budget = self.max_history_tokens
+        selected = []
+
+        window_start = max(0, query_index - self.recent_messages)
+        for i in range(query_index - 1, window_start - 1, -1):
+            if self._token_counts[i] > budget:
+                break
+            selected.append(i)
+            budget -= self._token_counts[i]
+
+        if window_start > 0 and self.num_retrieved > 0 and budget > 0:
+            scores = self._embeddings[:window_start] @ self._embeddings[query_index]
+            candidates = np.argsort(-scores, kind="stable")[:self.num_retrieved]
+            for i in candidates:
+                if scores[i] < self.teapot_ai.settings.rag_similarity_threshold:
+                    break
+                if self._token_counts[i] <= budget:
+                    selected.append(int(i))
+                    budget -= self._token_counts[i]
+
+        return "".join(self._format(self.messages[i]) for i in sorted(selected))
+
+    def chat(self, message: str) -> str:
+        """
+        Answer a user message and add both the message and the answer to the session.
+
+        Args:
+            message (str): The user's message.
+
+        Returns:
+            str: The generated response.
+        """
+        self.add_message("user", message)
+        response = self.teapot_ai.query(query=f"user: {message}", context=self.history(), system_prompt=self.system_prompt)
+        self.add_message("assistant", response)
+        return response
+
+    def to_dict(self) -> dict:
+        """
+        Serialize the session, including its message embeddings and token counts.
+
+        Returns:
+            dict: A JSON-compatible representation, restored by `from_dict`.
+        """
+        num_messages = len(self.messages)
+        embeddings = self._embeddings[:num_messages] if self._embeddings is not None else np.empty((0, 0), dtype=np.float32)
+        return {
+            "messages": self.messages,
+            "token_counts": self._token_counts,
+            "embeddings": base64.b64encode(np.ascontiguousarray(embeddings, dtype="<f4").tobytes()).decode("ascii"),
+            "embedding_dim": int(embeddings.shape[1]),
+            "embedding_model": self._embedding_model_name(),
+            "system_prompt": self.system_prompt,
+            "max_history_tokens": self.max_history_tokens,
+            "recent_messages": self.recent_messages,
+            "num_retrieved": self.num_retrieved,
+        }
+
+    @classmethod
+    def from_dict(cls, teapot_ai: TeapotAI, data: dict) -> "ChatSession":
+        """
+        Restore a session serialized with `to_dict`.
+
+        Stored embeddings are reused if they were produced by the same embedding model;
+        otherwise the messages are embedded again.
+
+        Args:
+            teapot_ai (TeapotAI): The engine to continue the conversation with.
+            data (dict): The serialized session.
+
+        Returns:
+            ChatSession: The restored session.
+        """
+        session = cls(
+            teapot_ai,
+            system_prompt=data["system_prompt"],
+            max_history_tokens=data["max_history_tokens"],
+            recent_messages=data["recent_messages"],
+            num_retrieved=data["num_retrieved"],
+        )
+        messages = data["messages"]
+        if data.get("embedding_model") != session._embedding_model_name() or len(data["token_counts"]) != len(messages):
+            session.add_messages(messages)
+            return session
+        if messages:
+            embeddings = np.frombuffer(base64.b64decode(data["embeddings"]), dtype="<f4").reshape(len(messages), data["embedding_dim"])
+            session._append(list(messages), list(data["token_counts"]), embeddings)
+        return session
+
+    def _embedding_model_name(self) -> Optional[str]:
+        config = self.teapot_ai.embedding_model.model.config
+        return getattr(config, "_name_or_path", None) or None
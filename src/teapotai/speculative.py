@@ -0,0 +1,253 @@
+"""
+Speculative decoding for encoder-decoder models.
+
+A drafter cheaply proposes the next few tokens, and the main model checks all of them in a
+single decoder forward pass, keeping the longest prefix that matches its own greedy choices
+plus one token of its own. The output is identical to greedy decoding; the speed-up depends
+on how many proposed tokens are accepted.
+
+Two drafters are provided: prompt lookup, which copies the continuation of an n-gram found in
+the prompt (a good fit for extractive answers from retrieved context), and a small draft model
+that shares the main model's tokenizer.
+"""
+import threading
+from typing import List, Optional
+
+import torch
+
+
+class SpeculativeStats:
+    """
+    Thread-safe acceptance statistics for speculative decoding.
+
+    Attributes:
+        generations (int): Number of speculative generations.
+        steps (int): Number of main model decoder passes.
+        proposed (int): Number of draft tokens proposed.
+        accepted (int): Number of draft tokens accepted.
+        generated (int): Number of tokens generated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.generations = 0
+            self.steps = 0
+            self.proposed = 0
+            self.accepted = 0
+            self.generated = 0
+
+    def _record(self, steps: int, proposed: int, accepted: int, generated: int):
+        with self._lock:
+            self.generations += 1
+            self.steps += steps
+            self.proposed += proposed
+            self.accepted += accepted
+            self.generated += generated
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The counters, the acceptance rate (accepted / proposed draft tokens) and the
+                mean number of tokens generated per main model pass (1.0 without speculation).
+        """
+        with self._lock:
+            return {
+                "generations": self.generations,
+                "steps": self.steps,
+                "proposed": self.proposed,
+                "accepted": self.accepted,
+                "generated": self.generated,
+                "acceptance_rate": self.accepted / self.proposed if self.proposed else 0.0,
+                "tokens_per_step": self.generated / self.steps if self.steps else 0.0,
+            }
+
+
+class PromptLookupDrafter:
+    """
+    Proposes tokens by finding the most recent generated n-gram in the prompt and copying
+    what follows it. Longer n-grams are tried first, down to single tokens.
+    """
+
+    def __init__(self, prompt_ids: List[int], ngram_size: int = 3):
+        self.prompt_ids = prompt_ids
+        self.ngram_size = ngram_size
+
+    def propose(self, sequence: List[int], num_tokens: int) -> List[int]:
+        for n in range(min(self.ngram_size, len(sequence)), 0, -1):
+            ngram = sequence[-n:]
+            for start in range(len(self.prompt_ids) - n):
+                if self.prompt_ids[start:start + n] == ngram:
+                    return self.prompt_ids[start + n:start + n + num_tokens]
+        return []
+
+
+class DraftModelDrafter:
+    """
+    Proposes tokens by greedy decoding with a smaller encoder-decoder model that uses the same
+    tokenizer. The draft model keeps its own decoder cache, rolled back to the accepted prefix.
+    """
+
+    def __init__(self, draft_model, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+        self.model = draft_model
+        self.attention_mask = attention_mask
+        with torch.no_grad():
+            self.encoder_outputs = draft_model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)
+        self.suppress_tokens = list(getattr(draft_model.generation_config, "suppress_tokens", None) or [])
+        self.cache = None
+        self.cached_tokens: List[int] = []
+
+    def _forward(self, tokens: List[int]) -> torch.Tensor:
+        outputs = self.model(
+            encoder_outputs=self.encoder_outputs,
+            attention_mask=self.attention_mask,
+            decoder_input_ids=torch.tensor([tokens], device=self.attention_mask.device),
+            past_key_values=self.cache,
+            use_cache=True,
+        )
+        self.cache = outputs.past_key_values
+        self.cached_tokens.extend(tokens)
+        logits = outputs.logits[0, -1]
+        if self.suppress_tokens:
+            logits[self.suppress_tokens] = float("-inf")
+        return logits
+
+    def propose(self, sequence: List[int], num_tokens: int) -> List[int]:
+        # Keep the cached prefix that still agrees with the sequence
+        common = 0
+        limit = min(len(self.cached_tokens), len(sequence) - 1)
+        while common < limit and self.cached_tokens[common] == sequence[common]:
+            common += 1
+        if self.cache is not None and common < len(self.cached_tokens):
+            _crop(self.cache, len(self.cached_tokens) - common)
+            del self.cached_tokens[common:]
+
+        draft = []
+        with torch.no_grad():
+            logits = self._forward(sequence[common:])
+            for _ in range(num_tokens):
+                token = int(logits.argmax())
+                draft.append(token)
+                if len(draft) == num_tokens:
+                    break
+                logits = self._forward([token])
+        return draft
+
+
+def _crop(cache, num_tokens: int):
+    # Negative values remove tokens from the end of the self-attention cache
+    cache.crop(-num_tokens)
+
+
+def supports_speculative_decoding(model, generation_kwargs: Optional[dict] = None) -> bool:
+    """
+    Whether `speculative_generate` reproduces `model.generate` for this model's generation
+    config: greedy decoding of an encoder-decoder model, with no logits processors other than
+    suppressed tokens.
+
+    Args:
+        model: The main model.
+        generation_kwargs (dict): Arguments passed to `model.generate`, which override the
+            model's generation config.
+
+    Returns:
+        bool: True if speculative decoding can be used.
+    """
+    config = model.generation_config
+    resolved = {
+        "num_beams": getattr(config, "num_beams", 1),
+        "do_sample": getattr(config, "do_sample", False),
+        "repetition_penalty": getattr(config, "repetition_penalty", 1.0),
+        **(generation_kwargs or {}),
+    }
+    return (
+        model.config.is_encoder_decoder
+        and resolved["num_beams"] in (None, 1)
+        and not resolved["do_sample"]
+        and resolved["repetition_penalty"] in (None, 1.0)
+        and not getattr(config, "no_repeat_ngram_size", 0)
+        and not getattr(config, "bad_words_ids", None)
+        and not getattr(config, "forced_bos_token_id", None)
+        and not getattr(config, "forced_eos_token_id", None)
+        and not getattr(config, "begin_suppress_tokens", None)
+        and not getattr(config, "min_length", 0)
+        and not getattr(config, "min_new_tokens", None)
+    )
+
+
+def speculative_generate(model, encoder_outputs, attention_mask: torch.Tensor, drafter, max_length: int,
+                         num_draft_tokens: int, stats: Optional[SpeculativeStats] = None, streamer=None,
+                         stopping_criteria=None) -> torch.Tensor:
+    """
+    Greedy decoding of a single sequence with draft tokens verified in one pass per step.
+
+    Args:
+        model: The main encoder-decoder model.
+        encoder_outputs: The main model's encoder outputs for the prompt.
+        attention_mask (torch.Tensor): The prompt's attention mask, of shape (1, prompt length).
+        drafter: A PromptLookupDrafter or DraftModelDrafter.
+        max_length (int): Maximum output length, counting the decoder start token.
+        num_draft_tokens (int): Maximum number of draft tokens per step.
+        stats (SpeculativeStats): Optional statistics to update.
+        streamer: Optional transformers streamer, fed like `model.generate` does.
+        stopping_criteria: Optional StoppingCriteriaList checked after every step.
+
+    Returns:
+        torch.Tensor: The output token ids, of shape (1, length), starting with the decoder start token.
+    """
+    config = model.generation_config
+    eos_token_ids = config.eos_token_id if isinstance(config.eos_token_id, list) else [config.eos_token_id]
+    suppress_tokens = list(getattr(config, "suppress_tokens", None) or [])
+    device = attention_mask.device
+
+    sequence = [config.decoder_start_token_id]
+    if streamer is not None:
+        streamer.put(torch.tensor(sequence))
+    cache, steps, proposed, accepted = None, 0, 0, 0
+    with torch.no_grad():
+        while len(sequence) < max_length:
+            draft = drafter.propose(sequence, min(num_draft_tokens, max_length - len(sequence) - 1))
+            outputs = model(
+                encoder_outputs=encoder_outputs,
+                attention_mask=attention_mask,
+                decoder_input_ids=torch.tensor([sequence[-1:] + draft], device=device),
+                past_key_values=cache,
+                use_cache=True,
+            )
+            logits = outputs.logits[0]
+            if suppress_tokens:
+                logits[:, suppress_tokens] = float("-inf")
+            predictions = logits.argmax(-1).tolist()
+
+            num_accepted = 0
+            while num_accepted < len(draft) and draft[num_accepted] == predictions[num_accepted]:
+                num_accepted += 1
+            new_tokens = draft[:num_accepted] + [predictions[num_accepted]]
+            for i, token in enumerate(new_tokens):
+                if token in eos_token_ids:
+                    new_tokens = new_tokens[:i + 1]
+                    break
+
+            # The cache now holds every fed token; drop the rejected drafts
+            cache = outputs.past_key_values
+            if len(draft) > num_accepted:
+                _crop(cache, len(draft) - num_accepted)
+            steps += 1
+            proposed += len(draft)
+            accepted += min(num_accepted, len(new_tokens))
+            sequence.extend(new_tokens)
+            if streamer is not None:
+                streamer.put(torch.tensor(new_tokens))
+            if new_tokens[-1] in eos_token_ids:
+                break
+            if stopping_criteria is not None and bool(stopping_criteria(torch.tensor([sequence]), None).any()):
+                break
+
+    if streamer is not None:
+        streamer.end()
+    if stats is not None:
+        stats._record(steps, proposed, accepted, len(sequence) - 1)
+    return torch.tensor([sequence], device=device)
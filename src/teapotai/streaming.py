@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Callable, List, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+_END = object()
+
+
+class _TokenQueueStreamer(BaseStreamer):
+    # Receives token ids from model.generate on the generation thread
+    def __init__(self, token_queue: queue.Queue):
+        self.token_queue = token_queue
+
+    def put(self, value):
+        self.token_queue.put(value.reshape(-1).tolist())
+
+    def end(self):
+        self.token_queue.put(_END)
+
+
+class _CancelledCriteria(StoppingCriteria):
+    # Stops generation at the next decoding step once the event is set
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class TeapotStream:
+    """
+    An iterator over the text produced by a generation running in the background.
+
+    Each item is the text added since the previous item. Tokens are detokenized incrementally:
+    only a short window of recent tokens is decoded per step rather than the whole output, and
+    text is held back while the window ends in an incomplete character. Closing the stream, or
+    calling `cancel`, stops generation at the next decoding step.
+
+    Attributes:
+        text (str): The text yielded so far.
+        num_tokens (int): The number of tokens generated so far.
+        time_to_first_token (float): Seconds from the request until the first generated token,
+            or None if none has been generated yet.
+        elapsed (float): Seconds from the request until generation finished, or None while running.
+        cancelled (bool): Whether the stream was cancelled.
+    """
+
+    def __init__(self, tokenizer, generate_fn: Callable, executor: Optional[Executor] = None, started_at: Optional[float] = None):
+        self.tokenizer = tokenizer
+        self.text = ""
+        self.num_tokens = 0
+        self.time_to_first_token = None
+        self.elapsed = None
+
+        self._started_at = started_at if started_at is not None else time.perf_counter()
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._token_ids: List[int] = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._prompt_received = False
+        self._finished = False
+
+        def run():
+            try:
+                generate_fn(
+                    streamer=_TokenQueueStreamer(self._queue),
+                    stopping_criteria=StoppingCriteriaList([_CancelledCriteria(self._cancelled)]),
+                )
+            except BaseException as e:
+                self._queue.put(e)
+                self._queue.put(_END)
+
+        if executor is not None:
+            executor.submit(run)
+        else:
+            threading.Thread(target=run, name="teapot-stream", daemon=True).start()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Stop generation at the next decoding step.
+        """
+        self._cancelled.set()
+
+    def close(self):
+        self.cancel()
+
+    def __del__(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        while not self._finished:
+            item = self._queue.get()
+            if item is _END:
+                self._finished = True
+                self.elapsed = time.perf_counter() - self._started_at
+                text = self._decode(final=True)
+            elif isinstance(item, BaseException):
+                self._finished = True
+                raise item
+            elif not self._prompt_received:
+                # model.generate first reports the decoder start tokens
+                self._prompt_received = True
+                self._prefix_offset = self._read_offset = len(item)
+                self._token_ids.extend(item)
+                continue
+            else:
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - self._started_at
+                self.num_tokens += len(item)
+                self._token_ids.extend(item)
+                text = self._decode()
+            if text:
+                self.text += text
+                return text
+        raise StopIteration
+
+    def _decode(self, final: bool = False) -> str:
+        # Decode the window from `prefix_offset` and emit what extends past the already
+        # emitted part of that window (ending at `read_offset`).
+        prefix_text = self.tokenizer.decode(self._token_ids[self._prefix_offset:self._read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(self._token_ids[self._prefix_offset:], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text) and (final or not new_text.endswith("\ufffd")):
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(self._token_ids)
+            return new_text[len(prefix_text):]
+        return ""
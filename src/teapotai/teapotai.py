@@ -1,26 +1,35 @@
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM, logging
-import joblib
-import torch
+# torch, transformers and langsmith are imported on first use (see the
+# loaders below), so `import teapotai` stays fast for short-lived processes.
 import numpy as np
-from sklearn.neural_network import MLPClassifier
-from sklearn.metrics.pairwise import cosine_similarity
 from pydantic import BaseModel, Field, ValidationError
 from pydantic.functional_validators import BeforeValidator
 from pydantic_core.core_schema import no_info_plain_validator_function
 from pydantic import field_validator
+import functools
+import math
 import inspect
-from typing import List, Optional, Callable, get_origin, get_args, Type
-from tqdm import tqdm
+from typing import List, Optional, Callable, Tuple, Union, get_origin, get_args, Type, TYPE_CHECKING
 import re
 import os
-from langsmith import traceable
-import joblib
-import pkg_resources
-
-logging.set_verbosity_error()
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from .cache import LRUCache, GenerationCache, local_checkpoint_revision
+from .chunking import chunk_document
+from .ingest import IngestStats, ingest as _ingest
+from .packing import RetrievedChunk, ContextPack, pack_segments
+from .metrics import TeapotMetrics
+from .registry import model_registry
+from .index import hash_text, save_index as _save_index, load_index as _load_index, load_token_counts, index_exists, normalize_embeddings, rerank, CompressedEmbeddings, EMBEDDING_STORAGE, ExactSearch, IVFSearch, VectorSearch, DocumentIndex
+
+if TYPE_CHECKING:
+    from .streaming import TeapotStream
 
 DEFAULT_MODEL = "teapotai/teapotllm"
 DEFAULT_MODEL_REVISION = "699ab39cbf586674806354e92fbd6179f9a95f4a"
+DEFAULT_EMBEDDING_MODEL = "teapotai/teapotembedding"
+REFUSAL_CLASSIFIER_FILE = "teapot_refusal_classifier.npz"
 DEFAULT_SYSTEM_PROMPT = """You are Teapot, an open-source AI assistant optimized for low-end devices, providing short, accurate responses without hallucinating while excelling at information extraction and text summarization."""
 
 
@@ -32,11 +41,69 @@ class TeapotAISettings(BaseModel):
         use_rag (bool): Whether to use RAG (Retrieve and Generate).
         rag_num_results (int): Number of top documents to retrieve based on similarity.
         rag_similarity_threshold (float): Similarity threshold for document relevance.
-        max_context_length (int): Maximum length of context to consider.
+        max_context_length (int): Token budget of a query's prompt. The system prompt and query are always kept;
+            retrieved documents and context that do not fit are dropped, least relevant first.
         context_chunking (bool): Whether to chunk context for processing.
         max_tool_calls (int): Maximum number of tool calls allowed.
+        tool_routing (str): How a tool is picked after a refusal: 'embedding' (similarity between the query and
+            the tool descriptions) or 'llm' (the model names the tool).
+        tool_routing_margin (float): With 'embedding' routing, the model picks the tool instead when the two
+            most similar tools score within this margin of each other.
+        tool_routing_min_score (float): With 'embedding' routing, the model picks the tool instead (and may pick
+            none) when no tool description reaches this cosine similarity to the query.
+        tool_timeout (float): Seconds to wait for a tool function before answering with an error, or None to
+            wait indefinitely. A tool's own `timeout` takes precedence.
+        tool_max_workers (int): Number of threads running tool functions.
         verbose (bool): Whether to print verbose updates.
         log_level (str): Log level setting (e.g., 'info', 'debug').
+        metrics (bool): Record per-stage timings and token counts in `TeapotAI.metrics`.
+        langsmith_tracing (bool): Trace generate, query, chat and extract calls with langsmith, if it is installed.
+            Disable to never import langsmith.
+        embedding_batch_size (int): Number of texts embedded per forward pass of the embedding model.
+        rag_index (str): Document search backend, either 'exact' or 'ivf' (approximate, for large corpora).
+        rag_ivf_num_lists (int): Number of k-means partitions for the 'ivf' backend. Defaults to sqrt(num chunks).
+        rag_ivf_num_probes (int): Partitions scanned per query by the 'ivf' backend. Higher is slower but more accurate.
+        index_compaction_threshold (float): Fraction of removed chunks at which the document index is compacted.
+        embedding_storage (str): How document embeddings are stored and scored: 'float32', 'float16' (half the
+            memory) or 'int8' (a quarter, with one scale per chunk). Compressed scores are approximate.
+        embedding_rerank (int): With compressed storage, the number of candidates retrieved from the compressed
+            embeddings and re-scored at full precision. The candidates are re-embedded, since full-precision
+            document embeddings are not kept. 0 disables reranking.
+        ingest_num_workers (int): Worker processes chunking documents in `ingest`. Defaults to the number of CPUs;
+            0 chunks in the calling process.
+        ingest_queue_size (int): Groups of chunked documents buffered between chunking and embedding in `ingest`.
+        ingest_batch_size (int): Chunks embedded and added to the index together by `ingest`.
+        ingest_checkpoint_interval (int): Documents ingested between saves of the index, when `ingest` has an index path.
+        generation_batch_size (int): Number of prompts decoded together by the batch generation methods.
+        chunk_overlap (int): Number of tokens shared by consecutive windows when a paragraph is split.
+        context_cache_size (int): Number of chunked (and embedded) query contexts kept in an LRU cache. 0 disables it.
+        embedding_cache_size (int): Number of query and answer embeddings kept in an LRU cache, so text embedded
+            for retrieval or refusal detection is not embedded again. 0 disables it.
+        generation_cache_size (int): Number of generated outputs kept in an in-memory LRU cache. 0 disables it.
+        generation_cache_path (str): Optional SQLite file for a persistent generation cache shared by processes.
+        generation_cache_disk_max_entries (int): Maximum number of entries in the persistent generation cache.
+        generation_max_length (int): Maximum length of generated outputs, in tokens.
+        generation_num_beams (int): Number of beams for beam search. 1 decodes greedily.
+        generation_do_sample (bool): Sample outputs instead of decoding deterministically. Sampled outputs are not cached.
+        generation_temperature (float): Sampling temperature, used with `generation_do_sample`.
+        generation_top_p (float): Nucleus sampling probability mass, used with `generation_do_sample`.
+        generation_repetition_penalty (float): Penalty for repeating tokens. 1.0 disables it.
+        speculative_decoding (str): 'off', 'prompt_lookup' (draft tokens copied from the prompt, which suits
+            answers extracted from the context) or 'draft_model' (draft tokens from the `draft_model` passed to
+            TeapotAI). Applies to greedy decoding of single prompts; outputs are unchanged.
+        speculative_num_tokens (int): Maximum number of draft tokens verified per decoding step.
+        speculative_ngram_size (int): Longest n-gram matched against the prompt by 'prompt_lookup'.
+        inference_backend (str): Backend for the generator and embedding model, either 'fp32' or 'int8' (dynamic
+            int8 quantization of Linear layers, for CPUs). Quantized default models are cached on disk.
+        inference_trace (bool): Run the generator's encoder and the embedding model as traced TorchScript graphs.
+        inference_cache_dir (str): Directory for cached quantized weights. Defaults to ~/.cache/teapotai.
+        background_warm_up (bool): Load the models in a background thread as soon as TeapotAI is created,
+            instead of on first use.
+        shared_models (bool): Take the default models from the process-wide `model_registry`, so every
+            instance with the same model, revision and inference backend shares one copy of the weights.
+            When off, each instance loads its own.
+        extract_encoder_reuse (bool): Encode the query and context shared by all extraction fields once and reuse it
+            for every field. Faster for large schemas, but outputs can differ slightly from encoding each full prompt.
     """
     use_rag: bool = True
     rag_num_results: int = 3
@@ -45,19 +112,200 @@ class TeapotAISettings(BaseModel):
     context_chunking: bool = True
     allow_tool_use:bool = True
     max_tool_calls:int = 1
+    tool_routing: str = "embedding"
+    tool_routing_margin: float = 0.05
+    tool_routing_min_score: float = 0.4
+    tool_timeout: Optional[float] = None
+    tool_max_workers: int = 4
     verbose: bool = True
     log_level: str = "info"
+    metrics: bool = False
+    langsmith_tracing: bool = True
+    embedding_batch_size: int = 32
+    rag_index: str = "exact"
+    rag_ivf_num_lists: Optional[int] = None
+    rag_ivf_num_probes: int = 8
+    index_compaction_threshold: float = 0.25
+    embedding_storage: str = "float32"
+    embedding_rerank: int = 0
+    ingest_num_workers: Optional[int] = None
+    ingest_queue_size: int = 16
+    ingest_batch_size: int = 256
+    ingest_checkpoint_interval: int = 10000
+    generation_batch_size: int = 8
+    chunk_overlap: int = 0
+    context_cache_size: int = 128
+    embedding_cache_size: int = 256
+    generation_cache_size: int = 0
+    generation_cache_path: Optional[str] = None
+    generation_cache_disk_max_entries: Optional[int] = None
+    extract_encoder_reuse: bool = False
+    background_warm_up: bool = False
+    shared_models: bool = True
+    generation_max_length: int = 512
+    generation_num_beams: int = 1
+    generation_do_sample: bool = False
+    generation_temperature: float = 1.0
+    generation_top_p: float = 1.0
+    generation_repetition_penalty: float = 1.0
+    speculative_decoding: str = "off"
+    speculative_num_tokens: int = 8
+    speculative_ngram_size: int = 3
+    inference_backend: str = "fp32"
+    inference_trace: bool = False
+    inference_cache_dir: Optional[str] = None
 
 class TeapotTool(BaseModel):
     name: str = Field(..., description="The name of the tool.")
     description: str = Field(..., description="A description of what the tool does.")
     schema: Type[BaseModel] = Field(..., description="A Pydantic model defining the tool's input schema.")
-    fn: Callable = Field(..., description="The function that implements the tool logic.")
+    fn: Callable = Field(..., description="The function that implements the tool logic. It may be async.")
     directly_return_result: bool = False
+    timeout: Optional[float] = Field(None, description="Seconds to wait for the function. Defaults to the tool_timeout setting.")
 
     class Config:
         arbitrary_types_allowed = True
 
+def _quiet_transformers():
+    from transformers import logging
+    logging.set_verbosity_error()
+
+
+def _load_model():
+    from transformers import AutoModelForSeq2SeqLM
+    _quiet_transformers()
+    return AutoModelForSeq2SeqLM.from_pretrained(DEFAULT_MODEL, revision=DEFAULT_MODEL_REVISION)
+
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    _quiet_transformers()
+    return AutoTokenizer.from_pretrained(DEFAULT_MODEL, revision=DEFAULT_MODEL_REVISION)
+
+
+def _load_embedding_model():
+    from transformers import pipeline
+    _quiet_transformers()
+    return pipeline("feature-extraction", model=DEFAULT_EMBEDDING_MODEL, truncation=True)
+
+
+def _embedding_pipeline(model, tokenizer):
+    from transformers import pipeline
+    return pipeline("feature-extraction", model=model, tokenizer=tokenizer, truncation=True)
+
+
+def _load_refusal_detector():
+    from .refusal import RefusalClassifier
+    from importlib import resources
+    if hasattr(resources, "files"):
+        resource = resources.files("teapotai").joinpath(REFUSAL_CLASSIFIER_FILE).open("rb")
+    else:  # Python < 3.9
+        resource = resources.open_binary("teapotai", REFUSAL_CLASSIFIER_FILE)
+    with resource as f:
+        return RefusalClassifier.load(f)
+
+
+def _call_tool(fn: Callable, arguments):
+    # Runs on a tool executor thread, which has no event loop of its own
+    result = fn(arguments)
+    if inspect.isawaitable(result):
+        import asyncio
+
+        async def wait():
+            return await result
+        result = asyncio.run(wait())
+    return result
+
+
+def _traceable(fn: Callable) -> Callable:
+    """
+    Apply `langsmith.traceable` to a TeapotAI method on its first call, so langsmith is only
+    imported once tracing can actually happen. Calls are not traced if the instance disables
+    `langsmith_tracing` or langsmith is not installed.
+    """
+    traced = None
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        nonlocal traced
+        if not self.settings.langsmith_tracing:
+            return fn(self, *args, **kwargs)
+        if traced is None:
+            try:
+                from langsmith import traceable
+            except ImportError:
+                traced = fn
+            else:
+                traced = traceable(fn)
+        return traced(self, *args, **kwargs)
+
+    return wrapper
+
+
+_TRUE_PATTERN = re.compile(r'\b(yes|true)\b', re.IGNORECASE)
+_FALSE_PATTERN = re.compile(r'\b(no|false)\b', re.IGNORECASE)
+_NON_NUMERIC_PATTERN = re.compile(r'[^0-9.-]')  # Allow negative and decimal
+
+
+def _field_type(type_annotation):
+    """
+    Resolve an extraction field annotation to bool, int, float or str, unwrapping Optional.
+    """
+    if get_origin(type_annotation) is not None:
+        args = [arg for arg in get_args(type_annotation) if arg is not type(None)]
+        if len(args) == 1 and len(get_args(type_annotation)) == 2:
+            type_annotation = args[0]
+    if type_annotation not in (bool, int, float, str):
+        raise ValueError(f"Teapot- Unsupported type annotation: {type_annotation}")
+    return type_annotation
+
+
+def _parse_numbers(values: List[str], number_type: type) -> list:
+    """
+    Convert cleaned numeric strings to int or float, with None for empty or malformed values.
+    """
+    parsed = [None] * len(values)
+    indices = [i for i, value in enumerate(values) if value]
+    if not indices:
+        return parsed
+    try:
+        # Fast path: convert the whole batch at once
+        numbers = np.array([values[i] for i in indices], dtype=np.float64 if number_type is float else np.int64)
+        for i, number in zip(indices, numbers.tolist()):
+            parsed[i] = number
+    except (ValueError, OverflowError):
+        for i in indices:
+            try:
+                parsed[i] = number_type(values[i])
+            except ValueError:
+                pass
+    return parsed
+
+
+def _padded_batches(tokenizer, texts: List[str], batch_size: int, **tokenizer_kwargs):
+    """
+    Tokenize texts in one call and yield them as padded batches of similar token length.
+
+    Args:
+        tokenizer: The tokenizer to encode and pad with.
+        texts (List[str]): The texts to encode.
+        batch_size (int): The maximum number of texts per batch.
+        **tokenizer_kwargs: Extra arguments for the tokenizer call (e.g. truncation).
+
+    Yields:
+        Tuple[np.ndarray, BatchEncoding]: The indices of the texts in the batch and the padded
+            PyTorch tensors for them.
+    """
+    encodings = tokenizer(list(texts), **tokenizer_kwargs)
+    lengths = np.fromiter((len(ids) for ids in encodings["input_ids"]), dtype=np.int64, count=len(texts))
+    order = np.argsort(lengths, kind="stable")
+    batch_size = max(1, batch_size)
+    for start in range(0, len(order), batch_size):
+        batch_indices = order[start:start + batch_size]
+        features = [{key: encodings[key][i] for key in encodings.keys()} for i in batch_indices]
+        yield batch_indices, tokenizer.pad(features, return_tensors="pt")
+
+
 class TeapotAI:
     """
     TeapotAI class for generating responses based on queries and context, optionally using RAG.
@@ -69,17 +317,39 @@ class TeapotAI:
         generator (pipeline): The text-to-text generation pipeline.
         documents (List[str]): List of documents used for context retrieval.
         embedding_model (pipeline): Embedding model for document retrieval.
-        document_embeddings (np.ndarray): Pre-generated embeddings for the documents.
+        document_embeddings (np.ndarray | CompressedEmbeddings): Pre-generated, L2-normalized embeddings for the
+            documents, compressed according to the `embedding_storage` setting.
+        index (DocumentIndex): The mutable document index backing `documents` and `document_embeddings`.
+        refusal_detector: Classifier used to detect refusals before falling back to a tool.
+        generation_cache (GenerationCache): Cache of generated outputs, or None if disabled.
+        draft_model: The draft model for speculative decoding, or None.
+        speculative_stats (SpeculativeStats): Draft acceptance statistics, or None if speculative decoding is off.
+        metrics (TeapotMetrics): Per-stage timings and token counts, recorded when the `metrics` setting is on.
     """
 
-    def __init__(self, model = None, tokenizer = None, documents: List[str] = [], tools: List[TeapotTool] = [], settings: TeapotAISettings = TeapotAISettings()):
+    def __init__(self, model = None, tokenizer = None, documents: List[str] = [], tools: List[TeapotTool] = [], settings: TeapotAISettings = TeapotAISettings(), embedding_model = None, index_path: Optional[str] = None, draft_model = None):
         """
         Initializes the TeapotAI class.
 
         Args:
             model (str): The model name for TeapotAI.
+            tokenizer: Optional tokenizer for the model.
             documents (List[str]): List of documents to use for context retrieval.
+            tools (List[TeapotTool]): Tools the model can fall back to when it refuses to answer.
             settings (TeapotAISettings): The settings configuration for TeapotAI.
+            embedding_model (pipeline): Optional feature-extraction pipeline used for retrieval embeddings.
+            index_path (str): Optional directory of a persistent embedding index. If it holds a
+                compatible index, its embeddings are memory-mapped and only new or changed
+                documents are embedded; the index is then written back with the current documents.
+            draft_model: Optional small seq2seq model sharing the tokenizer, used to propose tokens
+                when `speculative_decoding` is 'draft_model'.
+
+        Models that are not passed in are loaded when first needed: the generator and its
+        tokenizer on the first generation, the embedding model when documents are indexed or
+        retrieval runs, and the refusal classifier (and tool description embeddings) on the
+        first tool-use check. Set `background_warm_up` or call `warm_up` to load them ahead of time.
+        With `shared_models`, they are taken from the process-wide model registry, so only the
+        first instance in the process pays for loading them.
         """
         self.settings = settings
         if self.settings.verbose:
@@ -90,66 +360,622 @@ class TeapotAI:
   |_|\___|\__,_| .__/ \___/ \__/  /_/   \_\___|      \_____/
                |_|   """)
 
-        if self.settings.verbose:
-            print(f"Loading Model")
-
-        if model is None:
-            model = AutoModelForSeq2SeqLM.from_pretrained(
-                DEFAULT_MODEL,
-                revision=DEFAULT_MODEL_REVISION,
-              )
-        if tokenizer is None:
-            tokenizer = AutoTokenizer.from_pretrained(
-                DEFAULT_MODEL,
-                revision=DEFAULT_MODEL_REVISION
+        if "transformers" in sys.modules:
+            _quiet_transformers()
+
+        if self.settings.speculative_decoding not in ("off", "prompt_lookup", "draft_model"):
+            raise ValueError(f"Teapot- Unsupported speculative_decoding: {self.settings.speculative_decoding}")
+        if self.settings.speculative_decoding == "draft_model" and draft_model is None:
+            raise ValueError("Teapot- speculative_decoding 'draft_model' requires a draft_model")
+        if self.settings.tool_routing not in ("embedding", "llm"):
+            raise ValueError(f"Teapot- Unsupported tool_routing: {self.settings.tool_routing}")
+        if self.settings.embedding_storage not in EMBEDDING_STORAGE:
+            raise ValueError(f"Teapot- Unsupported embedding_storage: {self.settings.embedding_storage}")
+        if self.settings.inference_backend not in ("fp32", "int8"):
+            raise ValueError(f"Teapot- Unsupported inference_backend: {self.settings.inference_backend}")
+        if self.settings.inference_backend == "int8":
+            from .backends import quantize_int8
+            if model is not None:
+                model = quantize_int8(model)
+            if embedding_model is not None:
+                embedding_model = _embedding_pipeline(quantize_int8(embedding_model.model), embedding_model.tokenizer)
+            if draft_model is not None:
+                draft_model = quantize_int8(draft_model)
+        self.draft_model = draft_model
+        self.metrics = TeapotMetrics(enabled=self.settings.metrics)
+        self.speculative_stats = None
+        if self.settings.speculative_decoding != "off":
+            from .speculative import SpeculativeStats
+            self.speculative_stats = SpeculativeStats()
+
+        self._load_lock = threading.RLock()
+        self._model = model
+        self._tokenizer = tokenizer
+        self._embedding_model = embedding_model
+        self._traced_encoders = {}
+        self._refusal_detector = None
+        self._generation_cache_identity = None
+
+        self.tools = tools
+        self._tool_embeddings = None
+        self._separator_tokens = None
+        self._tool_executor = None
+        self._tool_executor_pid = None
+        self.index_path = index_path
+        self.index = None
+        self._context_cache = LRUCache(self.settings.context_cache_size)
+        self._embedding_cache = LRUCache(self.settings.embedding_cache_size)
+        self.generation_cache = None
+        if self.settings.generation_cache_size > 0 or self.settings.generation_cache_path is not None:
+            self.generation_cache = GenerationCache(
+                self.settings.generation_cache_size,
+                path=self.settings.generation_cache_path,
+                max_disk_entries=self.settings.generation_cache_disk_max_entries,
             )
 
-        self.model = model
-        self.tokenizer = tokenizer
+        if self.settings.background_warm_up:
+            self.warm_up(background=True)
 
-        # Get the path of the model file within the package
-        model_path = pkg_resources.resource_filename('teapotai', 'teapot_refusal_classifier.joblib')
+        if self.settings.use_rag:
+            self._index_documents(documents, index_path)
+        else:
+            self._documents = [chunk for document in documents for chunk in self._chunk_document(document)]
+
+    def _lazy(self, name: str, loader: Callable):
+        # Double-checked so concurrent first uses (or a warm-up thread) load each model once
+        value = getattr(self, name)
+        if value is None:
+            with self._load_lock:
+                value = getattr(self, name)
+                if value is None:
+                    value = loader()
+                    setattr(self, name, value)
+        return value
+
+    def _shared(self, key: tuple, loader: Callable):
+        if not self.settings.shared_models:
+            return loader()
+        return model_registry.get(key, loader)
+
+    def _load_generator(self):
+        if self.settings.verbose:
+            print("Loading Model")
+        if self.settings.inference_backend == "int8":
+            from transformers import AutoModelForSeq2SeqLM
+            from .backends import load_quantized
+            _quiet_transformers()
+            return load_quantized(AutoModelForSeq2SeqLM, DEFAULT_MODEL, DEFAULT_MODEL_REVISION, self.settings.inference_cache_dir)
+        return _load_model()
+
+    def _load_embedding(self):
+        if self.settings.inference_backend == "int8":
+            from transformers import AutoModel, AutoTokenizer
+            from .backends import load_quantized
+            _quiet_transformers()
+            model = load_quantized(AutoModel, DEFAULT_EMBEDDING_MODEL, cache_dir=self.settings.inference_cache_dir)
+            return _embedding_pipeline(model, AutoTokenizer.from_pretrained(DEFAULT_EMBEDDING_MODEL))
+        return _load_embedding_model()
+
+    @property
+    def model(self):
+        key = ("generator", DEFAULT_MODEL, DEFAULT_MODEL_REVISION, self.settings.inference_backend)
+        return self._lazy("_model", lambda: self._shared(key, self._load_generator))
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+        self._traced_encoders.pop("generator", None)
+        # Models without a revision are keyed by object, and a new object may reuse an old id
+        self._generation_cache_identity = None
+        if self.generation_cache is not None:
+            self.generation_cache.memory.clear()
+
+    @property
+    def tokenizer(self):
+        key = ("tokenizer", DEFAULT_MODEL, DEFAULT_MODEL_REVISION)
+        return self._lazy("_tokenizer", lambda: self._shared(key, _load_tokenizer))
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    @property
+    def embedding_model(self):
+        key = ("embedding", DEFAULT_EMBEDDING_MODEL, None, self.settings.inference_backend)
+        return self._lazy("_embedding_model", lambda: self._shared(key, self._load_embedding))
+
+    @embedding_model.setter
+    def embedding_model(self, embedding_model):
+        self._embedding_model = embedding_model
+        self._traced_encoders.pop("embedding", None)
+        self._embedding_cache.clear()
+
+    def _traced_encoder(self, name: str, encoder, input_ids, attention_mask):
+        """
+        Return the traced graph of an encoder, tracing it on first use with the given example inputs.
 
-        
-        self.refusal_detector = joblib.load(model_path)
+        Args:
+            name (str): Which encoder, 'generator' or 'embedding'.
+            encoder: The eager encoder module.
+            input_ids: Example input ids.
+            attention_mask: Example attention mask.
 
+        Returns:
+            torch.jit.ScriptModule: The traced encoder.
+        """
+        traced = self._traced_encoders.get(name)
+        if traced is None:
+            with self._load_lock:
+                traced = self._traced_encoders.get(name)
+                if traced is None:
+                    from .backends import trace_encoder
+                    traced = trace_encoder(encoder, input_ids, attention_mask)
+                    self._traced_encoders[name] = traced
+        return traced
+
+    @property
+    def refusal_detector(self):
+        return self._lazy("_refusal_detector", lambda: self._shared(("refusal_detector", REFUSAL_CLASSIFIER_FILE), _load_refusal_detector))
+
+    @refusal_detector.setter
+    def refusal_detector(self, refusal_detector):
+        self._refusal_detector = refusal_detector
+
+    def warm_up(self, background: bool = False) -> Optional[threading.Thread]:
+        """
+        Load every model this instance will need, and embed the tool descriptions, instead of
+        waiting for their first use.
 
-        self.documents = [chunk for document in documents for chunk in self._chunk_document(document)]
-        self.tools = tools
-        
-        if self.settings.use_rag:
-            self.embedding_model = pipeline("feature-extraction", model="teapotai/teapotembedding", truncation=True)
-            self.document_embeddings = self._generate_document_embeddings(self.documents)
+        Args:
+            background (bool): Load in a daemon thread and return immediately. Calls that need
+                a model still loading wait for it rather than loading it twice.
+
+        Returns:
+            threading.Thread: The loading thread if `background` is set, otherwise None.
+        """
+        def load():
+            self.tokenizer
+            self.model
+            if self.settings.use_rag or (self.settings.allow_tool_use and len(self.tools) > 0):
+                self.embedding_model
+            if self.settings.allow_tool_use and len(self.tools) > 0:
+                self.refusal_detector
+                if self.settings.tool_routing == "embedding":
+                    self._tool_description_embeddings()
+
+        if not background:
+            load()
+            return None
+        thread = threading.Thread(target=load, name="teapot-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def documents(self) -> List[str]:
+        return self.index.documents if self.index is not None else self._documents
+
+    @property
+    def document_embeddings(self) -> Optional[Union[np.ndarray, CompressedEmbeddings]]:
+        return self.index.embeddings if self.index is not None else None
+
+    def _index_manifest(self) -> dict:
+        """
+        Describe how the document index is built, so a saved index is only reused when the
+        embedding model and chunking settings that produced it are unchanged.
+
+        Returns:
+            dict: The embedding model, its revision and the chunking settings.
+        """
+        embedding_config = self.embedding_model.model.config
+        return {
+            "embedding_model": self.embedding_model.model.name_or_path,
+            "embedding_model_revision": getattr(embedding_config, "_commit_hash", None),
+            "chunking": {
+                "context_chunking": self.settings.context_chunking,
+                "tokenizer": getattr(self.tokenizer, "name_or_path", None),
+                "model_max_length": self.tokenizer.model_max_length,
+                "chunk_overlap": self.settings.chunk_overlap,
+            },
+            "normalized": True,
+            "embedding_backend": self.settings.inference_backend,
+            "dtype": self.settings.embedding_storage,
+        }
+
+    def _index_is_compatible(self, manifest: dict) -> bool:
+        expected = self._index_manifest()
+        # Indexes saved before inference backends existed were embedded in fp32
+        manifest = {"embedding_backend": "fp32", "dtype": "float32", **manifest}
+        return all(manifest.get(key) == value for key, value in expected.items())
+
+    def _index_documents(self, documents: List[str], index_path: Optional[str] = None):
+        """
+        Chunk and embed documents, reusing a saved index at `index_path` where possible.
+
+        Documents whose content hash is already in the index reuse their stored chunks, and
+        chunks whose content hash is already in the index reuse their stored embeddings, so
+        only new or changed documents are chunked and embedded. Unchanged documents keep the
+        ids they were saved under (e.g. by `add_documents` or `ingest`); new ones are identified
+        by their content hash. If the documents are unchanged (or none are given), the saved
+        embedding matrix is memory-mapped as is.
+
+        Args:
+            documents (List[str]): The documents to index.
+            index_path (str): Optional directory of a persistent index to reuse and update.
+        """
+        previous = None
+        if index_path is not None and index_exists(index_path):
+            previous = _load_index(index_path)
+            if not self._index_is_compatible(previous[2]):
+                if self.settings.verbose:
+                    print("Index was built with different settings, rebuilding...")
+                previous = None
+
+        document_hashes = [hash_text(document) for document in documents]
+        if previous is not None:
+            previous_chunks, previous_embeddings, manifest = previous
+            previous_records = manifest["documents"]
+            previous_token_counts = load_token_counts(index_path, len(previous_chunks))
+            if not documents or document_hashes == [record["hash"] for record in previous_records]:
+                self._set_index(previous_chunks, previous_embeddings, previous_records, manifest["chunk_hashes"], previous_token_counts)
+                return
+            known_documents = {}
+            for record in previous_records:
+                known_documents.setdefault(record["hash"], []).append(record)
+            known_chunks = {chunk_hash: row for row, chunk_hash in enumerate(manifest["chunk_hashes"])}
+        else:
+            previous_chunks, previous_embeddings, previous_token_counts = [], None, None
+            known_documents, known_chunks = {}, {}
+
+        chunks, records, seen = [], [], set()
+        for document, document_hash in zip(documents, document_hashes):
+            if document_hash in seen:
+                continue
+            seen.add(document_hash)
+            if document_hash in known_documents:
+                # The same content may have been saved under several ids
+                known = [(record.get("id", document_hash), [previous_chunks[row] for row in record["chunks"]]) for record in known_documents[document_hash]]
+            else:
+                known = [(document_hash, self._chunk_document(document))]
+            for document_id, document_chunks in known:
+                records.append({"id": document_id, "hash": document_hash, "chunks": list(range(len(chunks), len(chunks) + len(document_chunks)))})
+                chunks.extend(document_chunks)
+
+        chunk_hashes = [hash_text(chunk) for chunk in chunks]
+        reused = [(row, known_chunks[chunk_hash]) for row, chunk_hash in enumerate(chunk_hashes) if chunk_hash in known_chunks]
+        missing = [row for row, chunk_hash in enumerate(chunk_hashes) if chunk_hash not in known_chunks]
+
+        # An empty index does not need the embedding model yet; add_documents sets its width
+        dim = self.embedding_model.model.config.hidden_size if chunks else 0
+        embeddings = np.empty((len(chunks), dim), dtype=np.float32)
+        if reused:
+            rows, previous_rows = map(list, zip(*reused))
+            embeddings[rows] = np.asarray(previous_embeddings[previous_rows])
+        if missing:
+            embeddings[missing] = normalize_embeddings(self._generate_document_embeddings([chunks[row] for row in missing]))
+
+        token_counts = np.full(len(chunks), -1, dtype=np.int32)
+        if reused and previous_token_counts is not None:
+            token_counts[rows] = previous_token_counts[previous_rows]
+        uncounted = np.flatnonzero(token_counts < 0)
+        if len(uncounted):
+            token_counts[uncounted] = self._count_tokens([chunks[row] for row in uncounted])
+
+        self._set_index(chunks, embeddings, records, chunk_hashes, token_counts)
+        if index_path is not None:
+            self.save_index(index_path)
+            self.load_index(index_path)
+
+    def _set_index(self, chunks: List[str], embeddings: np.ndarray, records: List[dict], chunk_hashes: List[str],
+                   token_counts: Optional[np.ndarray] = None):
+        self.index = DocumentIndex(
+            chunks, embeddings, records, chunk_hashes,
+            search_factory=self._build_search,
+            compaction_threshold=self.settings.index_compaction_threshold,
+            storage=self.settings.embedding_storage,
+            token_counts=token_counts,
+        )
+
+    def _count_tokens(self, texts: List[str], batch_size: int = 1024) -> np.ndarray:
+        """
+        Args:
+            texts (List[str]): The texts to measure.
+            batch_size (int): Number of texts tokenized per call.
+
+        Returns:
+            np.ndarray: The int32 token length of each text, without special tokens.
+        """
+        token_counts = np.empty(len(texts), dtype=np.int32)
+        for start in range(0, len(texts), batch_size):
+            input_ids = self.tokenizer(list(texts[start:start + batch_size]), add_special_tokens=False)["input_ids"]
+            token_counts[start:start + len(input_ids)] = [len(ids) for ids in input_ids]
+        return token_counts
+
+    def add_documents(self, documents: List[str], ids: Optional[List[str]] = None) -> List[str]:
+        """
+        Add documents to the retrieval index of a live instance.
+
+        Only the given documents are chunked, and only chunks not already in the index are
+        embedded. Adding a document under an existing id replaces that document. Concurrent
+        `rag()` and `query()` calls keep using the previous index until the update is complete.
+
+        Args:
+            documents (List[str]): The documents to add.
+            ids (List[str]): Optional document ids. Defaults to each document's content hash.
+
+        Returns:
+            List[str]: The ids of the documents.
+        """
+        if not self.settings.use_rag:
+            raise ValueError("Teapot- Adding documents requires use_rag to be enabled")
+        if ids is None:
+            ids = [hash_text(document) for document in documents]
+        if len(ids) != len(documents):
+            raise ValueError("Teapot- The number of ids must match the number of documents")
+
+        chunked = []
+        for document_id, document in zip(ids, documents):
+            document_hash = hash_text(document)
+            if not self._is_indexed(document_id, document_hash):
+                chunked.append((document_id, document_hash, self._chunk_document(document)))
+        self._add_chunked(chunked)
+
+        return list(ids)
+
+    def ingest(self, source, pattern: str = "**/*", index_path: Optional[str] = None,
+               callback: Optional[Callable[[IngestStats], None]] = None) -> IngestStats:
+        """
+        Add a corpus of any size to the retrieval index as a streaming pipeline.
+
+        Documents are read lazily, chunked in `ingest_num_workers` processes and embedded in
+        batches of `ingest_batch_size` chunks on a separate thread, with a bounded queue between
+        the stages, so memory use does not depend on the corpus size. Each batch is searchable as
+        soon as it is added. With an index path the index is saved every
+        `ingest_checkpoint_interval` documents and at the end; documents whose id and content are
+        already indexed are skipped, so an interrupted ingestion resumes by ingesting again.
+
+        Args:
+            source: A file, directory or glob pattern, or an iterable of document texts, file paths
+                or (id, text) tuples. Files are identified by their path, texts by their content hash.
+            pattern (str): The glob pattern matched inside directories.
+            index_path (str): Directory to checkpoint the index to. Defaults to the instance's `index_path`.
+            callback (Callable): Optional function called with the IngestStats after each batch.
+
+        Returns:
+            IngestStats: Document and chunk counts, checkpoints and throughput.
+        """
+        if not self.settings.use_rag:
+            raise ValueError("Teapot- Ingesting documents requires use_rag to be enabled")
+        return _ingest(self, source, pattern, index_path if index_path is not None else self.index_path, callback)
+
+    def _is_indexed(self, document_id: str, document_hash: str) -> bool:
+        record = self.index.records.get(document_id)
+        return record is not None and record["hash"] == document_hash
+
+    def _add_chunked(self, documents: List[Tuple[str, str, List[str]]], show_progress: bool = True) -> int:
+        """
+        Embed chunked documents and add them to the index in one update.
+
+        Chunks whose content hash is already in the index reuse their stored embedding.
+
+        Args:
+            documents (List[Tuple[str, str, List[str]]]): Tuples of (id, content hash, chunk texts).
+            show_progress (bool): Whether to report the embedding pass when verbose.
+
+        Returns:
+            int: The number of chunks embedded.
+        """
+        if not documents:
+            return 0
+        if self.index.dim == 0:
+            self._set_index([], np.empty((0, self.embedding_model.model.config.hidden_size), dtype=np.float32), list(self.index.records.values()), [])
+
+        all_token_counts = self._count_tokens([chunk for _, _, chunks in documents for chunk in chunks])
+        entries, missing, offset = {}, [], 0
+        for document_id, document_hash, chunks in documents:
+            chunk_hashes = [hash_text(chunk) for chunk in chunks]
+            token_counts = all_token_counts[offset:offset + len(chunks)]
+            offset += len(chunks)
+            embeddings = np.empty((len(chunks), self.index.dim), dtype=np.float32)
+            for row, chunk_hash in enumerate(chunk_hashes):
+                stored = self.index.embedding_for_chunk(chunk_hash)
+                if stored is None:
+                    missing.append((embeddings, row, chunks[row]))
+                else:
+                    embeddings[row] = stored
+            entries[document_id] = (document_id, document_hash, chunks, chunk_hashes, embeddings, token_counts)
+
+        if missing:
+            texts = [chunk for _, _, chunk in missing]
+            new_embeddings = normalize_embeddings(self._generate_document_embeddings(texts) if show_progress else self._embed(texts))
+            for (embeddings, row, _), embedding in zip(missing, new_embeddings):
+                embeddings[row] = embedding
+        self.index.add(list(entries.values()))
+        return len(missing)
+
+    def remove_documents(self, ids: List[str]) -> int:
+        """
+        Remove documents from the retrieval index of a live instance.
+
+        Removed chunks are excluded from retrieval immediately and their storage is reclaimed
+        once enough of the index has been removed (see `index_compaction_threshold`).
+
+        Args:
+            ids (List[str]): The ids of the documents to remove. Unknown ids are ignored.
+
+        Returns:
+            int: The number of chunks removed.
+        """
+        if not self.settings.use_rag:
+            raise ValueError("Teapot- Removing documents requires use_rag to be enabled")
+        return self.index.remove(ids)
+
+    def update_document(self, document_id: str, document: str):
+        """
+        Replace the text of an existing document, re-embedding only its changed chunks.
+
+        Args:
+            document_id (str): The id of the document to replace.
+            document (str): The new document text.
+        """
+        if not self.settings.use_rag or document_id not in self.index.records:
+            raise ValueError(f"Teapot- Unknown document id: {document_id}")
+        self.add_documents([document], ids=[document_id])
+
+    def _build_search(self, embeddings: np.ndarray) -> VectorSearch:
+        """
+        Build the configured search backend over normalized document embeddings.
+
+        Args:
+            embeddings (np.ndarray): The L2-normalized document embeddings.
+
+        Returns:
+            VectorSearch: The search backend selected by `settings.rag_index`.
+        """
+        if self.settings.rag_index == "exact":
+            return ExactSearch(embeddings)
+        if self.settings.rag_index == "ivf":
+            return IVFSearch(embeddings, num_lists=self.settings.rag_ivf_num_lists, num_probes=self.settings.rag_ivf_num_probes)
+        raise ValueError(f"Teapot- Unsupported rag_index: {self.settings.rag_index}")
+
+    def save_index(self, path: str):
+        """
+        Save the chunked documents and their embeddings as a persistent index.
+
+        Args:
+            path (str): The directory to write the index to.
+        """
+        if not self.settings.use_rag:
+            raise ValueError("Teapot- Saving an index requires use_rag to be enabled")
+        chunks, embeddings, records, chunk_hashes, token_counts = self.index.export()
+        manifest = {
+            **self._index_manifest(),
+            "documents": records,
+            "chunk_hashes": chunk_hashes,
+        }
+        _save_index(path, chunks, embeddings, manifest, token_counts)
+
+    def load_index(self, path: str, mmap: bool = True):
+        """
+        Replace the current documents with a persistent index saved by `save_index`.
+
+        Args:
+            path (str): The index directory.
+            mmap (bool): Whether to memory-map the embedding matrix instead of reading it into memory.
+        """
+        if not self.settings.use_rag:
+            raise ValueError("Teapot- Loading an index requires use_rag to be enabled")
+        chunks, embeddings, manifest = _load_index(path, mmap=mmap)
+        if not self._index_is_compatible(manifest):
+            raise ValueError(f"Teapot- Index at {path} was built with a different embedding model or chunking settings")
+        self._set_index(chunks, embeddings, manifest["documents"], manifest["chunk_hashes"], load_token_counts(path, len(chunks)))
 
     def _chunk_document(self, context: str) -> List[str]:
         """
         Chunk the input context into smaller segments if necessary based on the settings.
 
+        See `teapotai.chunking.chunk_document`.
+
         Args:
             context (str): The document context to chunk.
 
         Returns:
             List[str]: A list of chunked document strings.
         """
-        if self.settings.context_chunking:
-            tokenized_context = self.tokenizer(context).get("input_ids")
-            if len(tokenized_context) > self.tokenizer.model_max_length:
-                paragraphs = context.split("\n\n")
-                documents = []
-                for paragraph in paragraphs:
-                    tokens = self.tokenizer(paragraph).get("input_ids")
-                    if len(tokens) > self.tokenizer.model_max_length:
-                        for i in range(0, len(tokens), self.tokenizer.model_max_length):
-                            chunk_tokens = tokens[i:i + self.tokenizer.model_max_length]
-                            chunk_text = self.tokenizer.decode(chunk_tokens, skip_special_tokens=True)
-                            documents.append(chunk_text)
-                    else:
-                        documents.append(paragraph)
-                return documents
-            else:
-                return [context]
-        else:
-            return [context]
+        return chunk_document(context, self.tokenizer, self.settings.context_chunking, self.settings.chunk_overlap)
+
+    def _context_chunks(self, context: str, embed_above: Optional[int] = None) -> tuple:
+        """
+        Chunk a caller-provided context, and optionally embed the chunks, through an LRU
+        cache keyed by the context's content hash, so repeated contexts are neither
+        re-tokenized nor re-embedded.
+
+        Args:
+            context (str): The context to chunk.
+            embed_above (int): Also return normalized chunk embeddings if there are more than
+                this many chunks.
+
+        Returns:
+            tuple: The chunks, their normalized embeddings (or None) and their token lengths.
+        """
+        key = hash_text(context)
+        chunks, embeddings, token_counts = self._context_cache.get(key, (None, None, None))
+        if chunks is None:
+            with self.metrics.stage("chunking"):
+                chunks = self._chunk_document(context)
+                token_counts = self._count_tokens(chunks)
+        if embeddings is None and embed_above is not None and len(chunks) > embed_above:
+            embeddings = normalize_embeddings(self._generate_document_embeddings(chunks))
+        self._context_cache.put(key, (chunks, embeddings, token_counts))
+        return chunks, embeddings, token_counts
+
+    def _embed(self, texts: List[str], show_progress: bool = False, pooling: str = "cls") -> np.ndarray:
+        """
+        Embed texts in length-bucketed, padded batches using the embedding model.
+
+        All texts are tokenized in a single call, ordered by token length and grouped into
+        batches of `embedding_batch_size`, so each batch is only padded to its own longest
+        member. The pooled output of each text is written straight into a preallocated matrix.
+
+        Args:
+            texts (List[str]): The texts to embed.
+            show_progress (bool): Whether to display a progress bar over the batches.
+            pooling (str): 'cls' for the CLS token (used for retrieval) or 'mean' for the mean
+                over all tokens (used by the refusal classifier).
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(texts), hidden_size), in input order.
+        """
+        import torch
+
+        model = self.embedding_model.model
+        tokenizer = self.embedding_model.tokenizer
+        embeddings = np.empty((len(texts), model.config.hidden_size), dtype=np.float32)
+        if len(texts) == 0:
+            return embeddings
+
+        batches = _padded_batches(tokenizer, texts, self.settings.embedding_batch_size, truncation=True)
+        if show_progress:
+            from tqdm import tqdm
+            batch_size = max(1, self.settings.embedding_batch_size)
+            batches = tqdm(batches, desc="Document Embedding", unit=" batch", total=(len(texts) + batch_size - 1) // batch_size)
+
+        with torch.inference_mode():
+            for batch_indices, batch in batches:
+                batch = batch.to(model.device)
+                if self.settings.inference_trace:
+                    encoder = self._traced_encoder("embedding", model, batch["input_ids"], batch["attention_mask"])
+                    hidden_states = encoder(batch["input_ids"], batch["attention_mask"])
+                else:
+                    hidden_states = model(**batch)[0]
+                if pooling == "mean":
+                    mask = batch["attention_mask"].unsqueeze(-1).to(hidden_states.dtype)
+                    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
+                else:
+                    pooled = hidden_states[:, 0]
+                embeddings[batch_indices] = pooled.float().cpu().numpy()
+
+        return embeddings
+
+    def _embed_cached(self, texts: List[str], pooling: str = "cls") -> np.ndarray:
+        """
+        Embed short texts such as queries and answers, reusing embeddings already computed
+        for the same text. Each distinct uncached text is embedded once, in one batched pass.
+
+        Args:
+            texts (List[str]): The texts to embed.
+            pooling (str): The pooling passed to `_embed`.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(texts), hidden_size), in input order.
+        """
+        if len(texts) == 0:
+            return self._embed(texts, pooling=pooling)
+        cached = [self._embedding_cache.get((pooling, text)) for text in texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+        computed = dict(zip(missing, self._embed(missing, pooling=pooling))) if missing else {}
+        for text, embedding in computed.items():
+            self._embedding_cache.put((pooling, text), embedding)
+        return np.stack([embedding if embedding is not None else computed[text] for text, embedding in zip(texts, cached)])
 
     def _generate_document_embeddings(self, documents: List[str]) -> np.ndarray:
         """
@@ -159,42 +985,78 @@ class TeapotAI:
             documents (List[str]): A list of document strings to generate embeddings for.
 
         Returns:
-            np.ndarray: A NumPy array of document embeddings.
+            np.ndarray: A float32 NumPy array of document embeddings.
         """
-        embeddings = []
-
         if self.settings.verbose:
             print("Generating embeddings for documents...")
-            for doc in tqdm(documents, desc="Document Embedding", unit=" doc"):
-                embeddings.append(self.embedding_model(doc)[0][0])
-                # embeddings.append(np.mean(self.embedding_model(doc, truncation=True)[0], axis=0))
-        else:
-            for doc in documents:
-                embeddings.append(self.embedding_model(doc)[0][0])
-                # embeddings.append(np.mean(self.embedding_model(doc, truncation=True)[0], axis=0))
+        return self._embed(documents, show_progress=self.settings.verbose)
 
-        return np.array(embeddings)
-
-    def _retrieval(self, query: str, documents: List[str], document_embeddings: np.ndarray) -> List[str]:
+    def _retrieval(self, query: str, documents: List[str], document_embeddings: np.ndarray, search: Optional[VectorSearch] = None, alive: Optional[np.ndarray] = None) -> List[str]:
         """
         Retrieve the most relevant documents based on cosine similarity to the query.
 
         Args:
             query (str): The query string for retrieval.
             documents (List[str]): List of document strings to search through.
-            document_embeddings (np.ndarray): The embeddings for the documents.
+            document_embeddings (np.ndarray): The L2-normalized embeddings for the documents.
+            search (VectorSearch): Optional prebuilt search backend over `document_embeddings`.
+                Defaults to exact search.
+            alive (np.ndarray): Optional mask of rows that may be returned.
 
         Returns:
             List[str]: A list of top relevant documents based on the query.
         """
-        query_embedding = self.embedding_model(query)[0][0]
-        # query_embedding = np.mean(self.embedding_model(query, truncation=True)[0], axis=0)
-        similarities = cosine_similarity([query_embedding], document_embeddings)[0]
-        filtered_indices = [i for i, similarity in enumerate(similarities) if similarity >= self.settings.rag_similarity_threshold]
-        top_n_indices = sorted(filtered_indices, key=lambda i: similarities[i], reverse=True)[:self.settings.rag_num_results]
+        top_n_indices, _ = self._retrieve(query, documents, document_embeddings, search, alive)
 
         return [documents[i] for i in top_n_indices]
 
+    def _retrieve(self, query: str, documents: List[str], document_embeddings: np.ndarray, search: Optional[VectorSearch] = None,
+                  alive: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # Like _retrieval, returning the row indices and similarity scores of the results
+        with self.metrics.stage("query_embedding"):
+            query_embedding = normalize_embeddings(self._embed_cached([query]))[0]
+        if search is None:
+            search = ExactSearch(document_embeddings)
+        return self._search(query_embedding[None], documents, document_embeddings, search, alive)[0]
+
+    def _search(self, query_embeddings: np.ndarray, documents: List[str], document_embeddings, search: VectorSearch,
+                alive: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Find the best chunks for each query, reranking at full precision if embeddings are compressed.
+
+        With compressed embeddings and `embedding_rerank` set, `embedding_rerank` candidates are
+        retrieved from the compressed embeddings without a threshold. Their texts are embedded again
+        (through the embedding cache) and the candidates re-scored, so the threshold and the final
+        order use full-precision similarities.
+
+        Args:
+            query_embeddings (np.ndarray): The normalized (num_queries, dim) query embeddings.
+            documents (List[str]): The chunk texts by row.
+            document_embeddings (np.ndarray | CompressedEmbeddings): The chunk embeddings.
+            search (VectorSearch): The search backend over `document_embeddings`.
+            alive (np.ndarray): Optional mask of rows that may be returned.
+
+        Returns:
+            List[Tuple[np.ndarray, np.ndarray]]: The row indices and scores of each query's results.
+        """
+        k, threshold = self.settings.rag_num_results, self.settings.rag_similarity_threshold
+        num_candidates = self.settings.embedding_rerank
+        if not isinstance(document_embeddings, CompressedEmbeddings) or num_candidates <= 0:
+            with self.metrics.stage("similarity"):
+                return search.search_batch(query_embeddings, k, threshold, alive=alive)
+
+        with self.metrics.stage("similarity"):
+            candidates = [indices for indices, _ in search.search_batch(query_embeddings, max(k, num_candidates), alive=alive)]
+        with self.metrics.stage("rerank"):
+            rows = np.unique(np.concatenate(candidates)) if candidates else np.empty(0, dtype=np.int64)
+            if len(rows) == 0:
+                return [(indices, np.empty(0, dtype=np.float32)) for indices in candidates]
+            embeddings = normalize_embeddings(self._embed_cached([documents[row] for row in rows]))
+            return [
+                rerank(query_embedding, indices, embeddings[np.searchsorted(rows, indices)], k, threshold)
+                for query_embedding, indices in zip(query_embeddings, candidates)
+            ]
+
     def rag(self, query: str) -> List[str]:
         """
         Perform Retrieval-Augmented Generation (RAG) based on the query and the documents.
@@ -205,22 +1067,239 @@ class TeapotAI:
         Returns:
             List[str]: A list of top documents retrieved using RAG.
         """
-        if not self.settings.use_rag or not self.documents:
-            return []
-
-        return self._retrieval(query, self.documents, self.document_embeddings)
+        return [chunk.text for chunk in self._rag_chunks([query])[0]]
 
     def _detect_refusal(self, input_text:str) -> bool:
-      # Teapotllm is consistent with refusal format
-      if "I'm sorry" in input_text or "I don't" in input_text:
-          return True
-      # Invoke custom refusal detection model for more complicated queries
-      embedding = np.mean(self.embedding_model(input_text, truncation=True)[0], axis=0)
-      score = float(self.refusal_detector.predict_proba([embedding])[0][1])
-      return score > 0.5
+      return self.detect_refusals([input_text])[0]
+
+    def detect_refusals(self, texts: List[str]) -> List[bool]:
+        """
+        Detect which model answers are refusals.
+
+        Teapotllm is consistent with its refusal format, so answers are first checked for
+        refusal phrases. The rest are embedded in one batched pass (reusing cached embeddings)
+        and scored by the refusal classifier in one call.
+
+        Args:
+            texts (List[str]): The model answers.
+
+        Returns:
+            List[bool]: Whether each answer is a refusal.
+        """
+        with self.metrics.stage("refusal_detection"):
+            refusals = ["I'm sorry" in text or "I don't" in text for text in texts]
+            # Invoke custom refusal detection model for more complicated answers
+            unresolved = [i for i, refusal in enumerate(refusals) if not refusal]
+            if unresolved:
+                embeddings = self._embed_cached([texts[i] for i in unresolved], pooling="mean")
+                scores = self.refusal_detector.predict_proba(embeddings)[:, 1]
+                for i, score in zip(unresolved, scores):
+                    refusals[i] = bool(score > 0.5)
+            return refusals
+
+
+    def _generation_kwargs(self) -> dict:
+        """
+        Returns:
+            dict: The `model.generate` arguments for the configured generation parameters. The
+                decoding strategy is always passed, so the settings override the checkpoint's
+                generation config.
+        """
+        settings = self.settings
+        kwargs = {
+            "max_length": settings.generation_max_length,
+            "num_beams": settings.generation_num_beams,
+            "do_sample": settings.generation_do_sample,
+            "repetition_penalty": settings.generation_repetition_penalty,
+        }
+        if settings.generation_do_sample:
+            kwargs.update(temperature=settings.generation_temperature, top_p=settings.generation_top_p)
+        return kwargs
+
+    def _speculative(self, inputs) -> bool:
+        settings = self.settings
+        if settings.speculative_decoding == "off" or inputs["input_ids"].shape[0] != 1:
+            return False
+        from .speculative import supports_speculative_decoding
+        return supports_speculative_decoding(self.model, self._generation_kwargs())
+
+    def _generate_ids(self, inputs, **kwargs):
+        """
+        Generate token ids for tokenized inputs with the configured generation parameters,
+        encoding through the traced encoder when `inference_trace` is set and verifying draft
+        tokens when `speculative_decoding` applies.
+
+        Args:
+            inputs (BatchEncoding): The tokenized prompts, on the model's device.
+            **kwargs: Extra arguments for `model.generate` (a streamer and stopping criteria
+                are also honoured by speculative decoding).
+
+        Returns:
+            torch.Tensor: The generated token ids.
+        """
+        metrics = self.metrics
+        speculative = self._speculative(inputs)
+        encoder_outputs = None
+        # With metrics on, the encoder runs separately so it can be timed on its own
+        if (self.settings.inference_trace or speculative or metrics.enabled) and self.model.config.is_encoder_decoder:
+            with metrics.stage("encoder"):
+                encoder_outputs = self._run_encoder(inputs)
+
+        started_at = time.perf_counter()
+        if speculative:
+            from .speculative import speculative_generate, PromptLookupDrafter, DraftModelDrafter
+            if self.settings.speculative_decoding == "draft_model":
+                drafter = DraftModelDrafter(self.draft_model, inputs["input_ids"], inputs["attention_mask"])
+            else:
+                drafter = PromptLookupDrafter(inputs["input_ids"][0].tolist(), self.settings.speculative_ngram_size)
+            outputs = speculative_generate(
+                self.model, encoder_outputs, inputs["attention_mask"], drafter,
+                max_length=self.settings.generation_max_length,
+                num_draft_tokens=self.settings.speculative_num_tokens,
+                stats=self.speculative_stats,
+                streamer=kwargs.get("streamer"),
+                stopping_criteria=kwargs.get("stopping_criteria"),
+            )
+        elif encoder_outputs is not None:
+            outputs = self.model.generate(
+                encoder_outputs=encoder_outputs,
+                attention_mask=inputs["attention_mask"],
+                **self._generation_kwargs(),
+                **kwargs,
+            )
+        else:
+            outputs = self.model.generate(**inputs, **self._generation_kwargs(), **kwargs)
+
+        self._record_decoder(started_at, inputs["attention_mask"], outputs)
+        return outputs
+
+    def _run_encoder(self, inputs):
+        # Through the traced encoder when `inference_trace` is set
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+        with torch.no_grad():
+            if self.settings.inference_trace:
+                encoder = self._traced_encoder("generator", self.model.get_encoder(), inputs["input_ids"], inputs["attention_mask"])
+                return BaseModelOutput(last_hidden_state=encoder(inputs["input_ids"], inputs["attention_mask"]))
+            return self.model.get_encoder()(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+
+    def score_options(self, input_text: str, options: List[str]) -> List[float]:
+        """
+        Score candidate outputs for a prompt by their likelihood under the model.
+
+        The prompt is encoded once, and the options are scored by teacher-forced decoder passes in
+        batches of `generation_batch_size` that share the encoding. Nothing is generated. Each
+        score is the mean log-probability of the option's tokens, end of sequence included, so
+        longer options are not penalized for their length.
+
+        Args:
+            input_text (str): The text prompt.
+            options (List[str]): The candidate outputs.
+
+        Returns:
+            List[float]: The score of each option, in order. Higher is more likely.
+        """
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+
+        device = self.model.device
+        with self.metrics.stage("tokenization"):
+            inputs = self.tokenizer(input_text, return_tensors="pt").to(device)
+        with self.metrics.stage("encoder"):
+            hidden = self._run_encoder(inputs).last_hidden_state
+
+        scores = []
+        started_at = time.perf_counter()
+        for start in range(0, len(options), self.settings.generation_batch_size):
+            batch = list(options[start:start + self.settings.generation_batch_size])
+            with self.metrics.stage("tokenization"):
+                labels = self.tokenizer(batch, padding=True, return_tensors="pt").to(device)
+            label_ids, label_mask = labels["input_ids"], labels["attention_mask"]
+            with torch.inference_mode():
+                logits = self.model(
+                    encoder_outputs=BaseModelOutput(last_hidden_state=hidden.expand(len(batch), -1, -1)),
+                    attention_mask=inputs["attention_mask"].expand(len(batch), -1),
+                    decoder_input_ids=self.model.prepare_decoder_input_ids_from_labels(labels=label_ids),
+                ).logits
+                log_probs = torch.log_softmax(logits.float(), dim=-1).gather(-1, label_ids[..., None])[..., 0]
+                scores.extend(((log_probs * label_mask).sum(dim=1) / label_mask.sum(dim=1)).tolist())
+        if self.metrics.enabled:
+            self.metrics.record("decoder", time.perf_counter() - started_at, tokens_in=int(inputs["attention_mask"].sum()))
+        return scores
+
+    def _record_decoder(self, started_at: float, attention_mask, outputs):
+        # Output ids start with the decoder start token; padding is not generated
+        if self.metrics.enabled:
+            self.metrics.record(
+                "decoder", time.perf_counter() - started_at,
+                tokens_in=int(attention_mask.sum()),
+                tokens_out=int((outputs[:, 1:] != self.model.generation_config.pad_token_id).sum()),
+            )
+
+    def _generation_cache_keys(self, input_texts: List[str], cache_parameters: Optional[dict] = None) -> List[str]:
+        """
+        Build generation cache keys from the prompts, the generation parameters and the model identity.
+
+        Args:
+            input_texts (List[str]): The prompts.
+            cache_parameters (dict): Extra parameters to include in the keys.
+
+        Returns:
+            List[str]: One cache key per prompt.
+        """
+        model, _ = self._generation_cache_model()
+        # The checkpoint's generation config, as overridden by the arguments passed to generate
+        generation_config = self.model.generation_config.to_diff_dict()
+        generation_config.pop("transformers_version", None)
+        parameters = {**generation_config, **self._generation_kwargs(), **(cache_parameters or {})}
+        return [GenerationCache.key(input_text, parameters, model) for input_text in input_texts]
+
+    def _generation_cache_model(self) -> Tuple[dict, bool]:
+        """
+        Identify the generator's weights for generation cache keys.
+
+        A hub model is identified by its name and revision, and a local checkpoint by its
+        path and the modification time of its files when first used here, so a checkpoint
+        saved again under the same path gets new keys. Other models (e.g. built in memory)
+        cannot be identified across processes: they are keyed by object and their
+        generations stay in the in-memory tier.
+
+        Returns:
+            Tuple[dict, bool]: The model part of the keys, and whether the disk tier may be used.
+        """
+        model = self.model
+        cached = self._generation_cache_identity
+        if cached is not None and cached[0] is model:
+            return cached[1], cached[2]
+
+        config = model.config
+        name = getattr(config, "_name_or_path", None) or None
+        revision = getattr(config, "_commit_hash", None) or local_checkpoint_revision(name)
+        identity = {"name": name, "revision": revision, "backend": self.settings.inference_backend}
+        persist = revision is not None
+        if not persist:
+            identity["instance"] = id(model)
+        self._generation_cache_identity = (model, identity, persist)
+        return identity, persist
+
+    def _use_generation_cache(self) -> bool:
+        # Sampled generations are meant to differ between calls, so they are never cached
+        return self.generation_cache is not None and not self.settings.generation_do_sample
+
+    def clear_cache(self):
+        """
+        Invalidate cached generations (in memory and on disk) and cached chunked contexts.
 
+        Cache keys already cover the prompt, generation parameters and model revision, so this
+        is only needed after changes they cannot see, such as fine-tuning the loaded weights
+        in place or changing tool implementations whose results end up in prompts.
+        """
+        self._context_cache.clear()
+        self._embedding_cache.clear()
+        if self.generation_cache is not None:
+            self.generation_cache.clear()
 
-    @traceable
+    @_traceable
     def generate(self, input_text: str) -> str:
         """
         Generate text based on the input string using the TeapotLLM model.
@@ -231,14 +1310,26 @@ class TeapotAI:
         Returns:
             str: The generated output from the model.
         """
-        # Tokenize the input text
-        inputs = self.tokenizer(input_text, return_tensors="pt")
+        result, key = None, None
+        if self._use_generation_cache():
+            key = self._generation_cache_keys([input_text])[0]
+            persist = self._generation_cache_model()[1]
+            result = self.generation_cache.get(key, persist)
+
+        if result is None:
+            # Tokenize the input text
+            with self.metrics.stage("tokenization"):
+                inputs = self.tokenizer(input_text, return_tensors="pt")
+
+            # Generate output (model inference)
+            outputs = self._generate_ids(inputs)
 
-        # Generate output (model inference)
-        outputs = self.model.generate(**inputs, max_length=512)
+            # Decode the generated output
+            with self.metrics.stage("decoding"):
+                result = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
 
-        # Decode the generated output
-        result = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+            if key is not None:
+                self.generation_cache.put(key, result, persist)
 
 
         if self.settings.log_level == "debug":
@@ -248,7 +1339,503 @@ class TeapotAI:
 
         return result
 
-    @traceable
+    @_traceable
+    def generate_batch(self, input_texts: List[str]) -> List[str]:
+        """
+        Generate text for many prompts at once using padded batches.
+
+        Prompts are tokenized in one call, sorted by token length and decoded in batches of
+        `generation_batch_size`, so each batch is only padded to its own longest prompt. With
+        the generation cache enabled, only prompts without a cached result are decoded.
+
+        Args:
+            input_texts (List[str]): The text prompts to generate responses for.
+
+        Returns:
+            List[str]: The generated outputs, in the same order as `input_texts`.
+        """
+        return self._cached_generate(input_texts, lambda indices: self._decode_batch([input_texts[i] for i in indices]))
+
+    def _cached_generate(self, input_texts: List[str], decode: Callable[[List[int]], List[str]], cache_parameters: Optional[dict] = None) -> List[str]:
+        """
+        Serve prompts from the generation cache and decode the rest, each distinct prompt once.
+
+        Args:
+            input_texts (List[str]): The text prompts to generate responses for.
+            decode (Callable): Generates the outputs for a list of indices into `input_texts`.
+            cache_parameters (dict): Extra parameters that distinguish how `decode` generates.
+
+        Returns:
+            List[str]: The generated outputs, in the same order as `input_texts`.
+        """
+        results = [None] * len(input_texts)
+        if len(input_texts) == 0:
+            return results
+
+        keys = None
+        if self._use_generation_cache():
+            keys = self._generation_cache_keys(input_texts, cache_parameters)
+            persist = self._generation_cache_model()[1]
+            results = [self.generation_cache.get(key, persist) for key in keys]
+        # Repeated prompts are only decoded once
+        missing = {}
+        for i, result in enumerate(results):
+            if result is None:
+                missing.setdefault(input_texts[i], []).append(i)
+        missing_indices = list(missing.values())
+
+        if missing:
+            for indices, result in zip(missing_indices, decode([indices[0] for indices in missing_indices])):
+                for i in indices:
+                    results[i] = result
+                if keys is not None:
+                    self.generation_cache.put(keys[indices[0]], result, persist)
+
+        if self.settings.log_level == "debug":
+            for input_text, result in zip(input_texts, results):
+                print("="*100)
+                print(input_text)
+                print(result)
+
+        return results
+
+    def _decode_batch(self, input_texts: List[str]) -> List[str]:
+        results = [None] * len(input_texts)
+        with self.metrics.stage("tokenization"):
+            batches = list(_padded_batches(self.tokenizer, input_texts, self.settings.generation_batch_size))
+        for batch_indices, batch in batches:
+            outputs = self._generate_ids(batch.to(self.model.device))
+            with self.metrics.stage("decoding"):
+                decoded = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            for i, result in zip(batch_indices, decoded):
+                results[i] = result
+        return results
+
+    def _decode_with_shared_prefix(self, prefixes: List[str], suffixes: List[str]) -> List[str]:
+        """
+        Generate for prompts made of a prefix shared by many prompts and a short suffix.
+
+        Each distinct prefix is run through the encoder once. Suffixes are encoded as padded
+        batches, and the decoder cross-attends to the prefix encoding concatenated with the
+        suffix encoding. Because prefix and suffix are encoded separately, outputs can differ
+        slightly from encoding the full prompt.
+
+        Args:
+            prefixes (List[str]): The prefix of each prompt.
+            suffixes (List[str]): The suffix of each prompt.
+
+        Returns:
+            List[str]: The generated outputs, in order.
+        """
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+
+        unique_prefixes = list(dict.fromkeys(prefixes))
+        prefix_rows = {prefix: row for row, prefix in enumerate(unique_prefixes)}
+        max_length = self.tokenizer.model_max_length
+        encoder = self.model.get_encoder()
+        device = self.model.device
+
+        # The prefix is encoded without the end of sequence token, which ends the suffix
+        prefix_states, prefix_masks = [None] * len(unique_prefixes), [None] * len(unique_prefixes)
+        with self.metrics.stage("encoder"), torch.inference_mode():
+            for batch_indices, batch in _padded_batches(self.tokenizer, unique_prefixes, self.settings.generation_batch_size,
+                                                        add_special_tokens=False, truncation=True, max_length=max_length):
+                batch = batch.to(device)
+                states = encoder(**batch).last_hidden_state
+                for i, row in enumerate(batch_indices):
+                    prefix_states[row], prefix_masks[row] = states[i], batch["attention_mask"][i]
+
+        results = [None] * len(suffixes)
+        for batch_indices, batch in _padded_batches(self.tokenizer, suffixes, self.settings.generation_batch_size, truncation=True):
+            batch = batch.to(device)
+            rows = [prefix_rows[prefixes[i]] for i in batch_indices]
+            with self.metrics.stage("encoder"), torch.inference_mode():
+                suffix_states = encoder(**batch).last_hidden_state
+            # Prefixes in a batch may differ, so pad their encodings to a common length
+            prefix_length = max(prefix_states[row].shape[0] for row in rows)
+            hidden = suffix_states.new_zeros((len(rows), prefix_length, suffix_states.shape[-1]))
+            mask = batch["attention_mask"].new_zeros((len(rows), prefix_length))
+            for i, row in enumerate(rows):
+                hidden[i, :prefix_states[row].shape[0]] = prefix_states[row]
+                mask[i, :prefix_masks[row].shape[0]] = prefix_masks[row]
+            attention_mask = torch.cat([mask, batch["attention_mask"]], dim=1)
+            started_at = time.perf_counter()
+            outputs = self.model.generate(
+                encoder_outputs=BaseModelOutput(last_hidden_state=torch.cat([hidden, suffix_states], dim=1)),
+                attention_mask=attention_mask,
+                **self._generation_kwargs(),
+            )
+            self._record_decoder(started_at, attention_mask, outputs)
+            with self.metrics.stage("decoding"):
+                decoded = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            for i, result in zip(batch_indices, decoded):
+                results[i] = result
+        return results
+
+    def generate_stream(self, input_text: str, executor: Optional[Executor] = None) -> "TeapotStream":
+        """
+        Generate text for a prompt, yielding text increments as tokens are produced.
+
+        Args:
+            input_text (str): The text prompt to generate a response for.
+            executor (Executor): Optional executor to run generation on. Defaults to a new
+                background thread.
+
+        Returns:
+            TeapotStream: An iterator of text increments. Closing it cancels generation; its
+                `time_to_first_token` attribute reports the time to the first token.
+        """
+        return self._stream(input_text, executor, time.perf_counter())
+
+    def _stream(self, input_text: str, executor: Optional[Executor], started_at: float) -> "TeapotStream":
+        from .streaming import TeapotStream
+
+        with self.metrics.stage("tokenization"):
+            inputs = self.tokenizer(input_text, return_tensors="pt").to(self.model.device)
+        return TeapotStream(
+            self.tokenizer,
+            lambda **kwargs: self._generate_ids(inputs, **kwargs),
+            executor=executor,
+            started_at=started_at,
+        )
+
+    def query_stream(self, query: str, context: str = "", system_prompt: str = DEFAULT_SYSTEM_PROMPT, executor: Optional[Executor] = None) -> "TeapotStream":
+        """
+        Stream the answer to a query. Retrieval and prompting match `query`, but tool use is
+        not applied because it depends on the complete answer.
+
+        Args:
+            query (str): The query string to be answered.
+            context (str): The context to guide the response. Defaults to an empty string.
+            system_prompt (str): The system prompt.
+            executor (Executor): Optional executor to run generation on.
+
+        Returns:
+            TeapotStream: An iterator of text increments.
+        """
+        started_at = time.perf_counter()
+        return self._stream(self._query_prompt(query, context, system_prompt, self._rag_chunks([query])[0]), executor, started_at)
+
+    def chat_stream(self, conversation_history: List[dict], executor: Optional[Executor] = None) -> "TeapotStream":
+        """
+        Stream the response to a conversation. See `chat` and `query_stream`.
+
+        Args:
+            conversation_history (List[dict]): A list of previous messages, each containing 'content'.
+            executor (Executor): Optional executor to run generation on.
+
+        Returns:
+            TeapotStream: An iterator of text increments.
+        """
+        formatted_last_user, chat_history = self._chat_query(conversation_history)
+        return self.query_stream(formatted_last_user, context=chat_history, executor=executor)
+
+    def rag_batch(self, queries: List[str]) -> List[List[str]]:
+        """
+        Perform RAG for many queries with a single embedding pass and batched scoring.
+
+        Args:
+            queries (List[str]): The query strings to perform RAG on.
+
+        Returns:
+            List[List[str]]: The top documents for each query, in the same order as `queries`.
+        """
+        return [[chunk.text for chunk in chunks] for chunks in self._rag_chunks(queries)]
+
+    def _rag_chunks(self, queries: List[str]) -> List[List[RetrievedChunk]]:
+        """
+        Retrieve the top chunks for each query, with their scores and token lengths.
+
+        Token lengths come from the index; chunks of indexes saved without them are tokenized here.
+
+        Args:
+            queries (List[str]): The query strings to perform RAG on.
+
+        Returns:
+            List[List[RetrievedChunk]]: The top chunks for each query, best first.
+        """
+        if not self.settings.use_rag:
+            return [[] for _ in queries]
+
+        snapshot = self.index.snapshot
+        if snapshot.num_live == 0 or len(queries) == 0:
+            return [[] for _ in queries]
+
+        with self.metrics.stage("query_embedding"):
+            query_embeddings = normalize_embeddings(self._embed_cached(queries))
+        results = self._search(query_embeddings, snapshot.chunks, snapshot.embeddings, snapshot.search, snapshot.alive)
+
+        token_counts = [snapshot.token_counts[indices] for indices, _ in results]
+        uncounted = [(i, j) for i, counts in enumerate(token_counts) for j in np.flatnonzero(counts < 0)]
+        if uncounted:
+            token_counts = [counts.copy() for counts in token_counts]
+            for (i, j), count in zip(uncounted, self._count_tokens([snapshot.chunks[results[i][0][j]] for i, j in uncounted])):
+                token_counts[i][j] = count
+        return [
+            [RetrievedChunk(snapshot.chunks[row], float(score), int(count)) for row, score, count in zip(indices, scores, counts)]
+            for (indices, scores), counts in zip(results, token_counts)
+        ]
+
+    def _query_prompt(self, query: str, context: str, system_prompt: str, rag_chunks: List[RetrievedChunk], tool_context: str = "") -> str:
+        """
+        Build the model prompt for a query from retrieved documents and the caller's context.
+
+        Args:
+            query (str): The query string to be answered.
+            context (str): The context provided by the caller.
+            system_prompt (str): The system prompt.
+            rag_chunks (List[RetrievedChunk]): Documents retrieved for the query.
+            tool_context (str): Tool results for the query, always kept in the prompt.
+
+        Returns:
+            str: The full prompt for the model.
+        """
+        return self._pack_context(query, context, system_prompt, rag_chunks, tool_context).prompt
+
+    def pack_context(self, query: str, context: str = "", system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> ContextPack:
+        """
+        Build the prompt `query` would generate from, and report what fit in `max_context_length`.
+
+        Args:
+            query (str): The query string to be answered.
+            context (str): The context provided by the caller.
+            system_prompt (str): The system prompt.
+
+        Returns:
+            ContextPack: The prompt, the included and dropped context segments and the token counts.
+        """
+        return self._pack_context(query, context, system_prompt, self._rag_chunks([query])[0])
+
+    def _pack_context(self, query: str, context: str, system_prompt: str, rag_chunks: List[RetrievedChunk], tool_context: str = "") -> ContextPack:
+        """
+        Fit retrieved documents and the caller's context into `max_context_length` tokens.
+
+        The system prompt and query, and tool results placed just before them, are always kept. Caller context comes first, then retrieved
+        chunks by similarity; a segment is dropped if it does not fit in the remaining budget.
+        Long contexts are chunked, and only their chunks most similar to the query are
+        candidates. Token lengths of indexed chunks come from the index and those of contexts
+        from the context cache, so only the system prompt and query are tokenized here. When
+        nothing is dropped the prompt is the plain concatenation of all the parts.
+
+        Each call is recorded as a 'context_packing' metrics event with its token counts and
+        number of dropped segments.
+
+        Args:
+            query (str): The query string to be answered.
+            context (str): The context provided by the caller.
+            system_prompt (str): The system prompt.
+            rag_chunks (List[RetrievedChunk]): Documents retrieved for the query, best first.
+            tool_context (str): Tool results for the query.
+
+        Returns:
+            ContextPack: The prompt and what it includes.
+        """
+        started_at = time.perf_counter()
+        suffix = f"\n{system_prompt}\n{query}"
+        if tool_context:
+            suffix = f"\n{tool_context}{suffix}"
+        fixed_tokens = int(self._count_tokens([suffix])[0]) + self.tokenizer.num_special_tokens_to_add()
+
+        context_retrieved = False
+        if self.settings.context_chunking:
+            chunks, embeddings, token_counts = self._context_chunks(context, embed_above=self.settings.rag_num_results)
+            if embeddings is not None:
+                indices, scores = self._retrieve(query, chunks, embeddings)
+                context_chunks = [RetrievedChunk(chunks[i], float(score), int(token_counts[i])) for i, score in zip(indices, scores)]
+                context_retrieved = True
+            else:
+                context_chunks = [RetrievedChunk(chunk, math.inf, int(count)) for chunk, count in zip(chunks, token_counts)]
+        else:
+            context_chunks = [RetrievedChunk(context, math.inf, int(self._count_tokens([context])[0]))]
+
+        if self._separator_tokens is None:
+            self._separator_tokens = int(self._count_tokens(["\n\n"])[0])
+        segments = list(rag_chunks) + context_chunks
+        budget = self.settings.max_context_length
+        keep = pack_segments(segments, budget - fixed_tokens, self._separator_tokens)
+
+        rag_context = "\n\n".join(chunk.text for chunk, kept in zip(rag_chunks, keep) if kept)
+        context_keep = keep[len(rag_chunks):]
+        context_text = "\n\n".join(chunk.text for chunk, kept in zip(context_chunks, context_keep) if kept)
+        if context_retrieved:
+            full_context = rag_context + "\n\n" + context_text
+        else:
+            full_context = f"{rag_context}\n{context if all(context_keep) else context_text}"
+
+        context_tokens = sum(chunk.num_tokens + self._separator_tokens for chunk, kept in zip(segments, keep) if kept)
+        pack = ContextPack(
+            prompt=f"{full_context}{suffix}",
+            included=[chunk.text for chunk, kept in zip(segments, keep) if kept],
+            dropped=[chunk.text for chunk, kept in zip(segments, keep) if not kept],
+            prompt_tokens=fixed_tokens + context_tokens,
+            context_tokens=context_tokens,
+            budget=budget,
+        )
+        self.metrics.record(
+            "context_packing", time.perf_counter() - started_at,
+            prompt_tokens=pack.prompt_tokens, context_tokens=pack.context_tokens, dropped=len(pack.dropped),
+        )
+        return pack
+
+    def _tool_description_embeddings(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The L2-normalized embeddings of the tool descriptions, computed once
+                and recomputed only if the tools change.
+        """
+        descriptions = [f"{tool.name} - {tool.description}" for tool in self.tools]
+        cached = self._tool_embeddings
+        if cached is None or cached[0] != descriptions:
+            cached = (descriptions, normalize_embeddings(self._embed(descriptions)))
+            self._tool_embeddings = cached
+        return cached[1]
+
+    def _select_tool_with_llm(self, query: str) -> Optional[TeapotTool]:
+        selected_tool_name = self.generate(f"{chr(10).join(f'{t.name} - {t.description}' for t in self.tools)}\nQuery: '{query}'\nExtract the name of the tool to use:")
+        selected_tool = [tool for tool in self.tools if tool.name.lower()==selected_tool_name.lower()]
+        return selected_tool[0] if len(selected_tool) > 0 else None
+
+    def _select_tools(self, queries: List[str]) -> List[Optional[TeapotTool]]:
+        """
+        Pick a tool for each query.
+
+        With 'embedding' routing, the tool whose description is most similar to the query is
+        picked, in one scoring step for all queries. The model picks instead, as with 'llm'
+        routing, when the two best tools score within `tool_routing_margin` of each other or
+        when no tool reaches `tool_routing_min_score`, so a query unrelated to every tool does
+        not get one just because some tool ranks first.
+
+        Args:
+            queries (List[str]): The queries.
+
+        Returns:
+            List[Optional[TeapotTool]]: The tool for each query, or None if the model named no known tool.
+        """
+        if self.settings.tool_routing == "llm" or len(queries) == 0:
+            return [self._select_tool_with_llm(query) for query in queries]
+
+        with self.metrics.stage("query_embedding"):
+            query_embeddings = normalize_embeddings(self._embed_cached(queries))
+        with self.metrics.stage("similarity"):
+            scores = query_embeddings @ self._tool_description_embeddings().T
+        ranked = np.argsort(-scores, axis=1)
+        selected = []
+        for query, query_scores, order in zip(queries, scores, ranked):
+            ambiguous = len(order) > 1 and query_scores[order[0]] - query_scores[order[1]] < self.settings.tool_routing_margin
+            if ambiguous or query_scores[order[0]] < self.settings.tool_routing_min_score:
+                selected.append(self._select_tool_with_llm(query))
+            else:
+                selected.append(self.tools[order[0]])
+        return selected
+
+    def _run_tools(self, calls: List[tuple]) -> List:
+        """
+        Run tool functions concurrently on a thread pool, each bounded by its timeout.
+
+        A tool that times out keeps running in its thread, but its result is discarded.
+
+        Args:
+            calls (List[tuple]): (tool, arguments) pairs.
+
+        Returns:
+            List: The result of each call, or an error message for calls that timed out.
+        """
+        if self._tool_executor is None or self._tool_executor_pid != os.getpid():
+            # Executor threads do not survive a fork, so each process needs its own
+            self._tool_executor = ThreadPoolExecutor(self.settings.tool_max_workers, thread_name_prefix="teapot-tool")
+            self._tool_executor_pid = os.getpid()
+
+        started_at = time.perf_counter()
+        futures = [self._tool_executor.submit(_call_tool, tool.fn, arguments) for tool, arguments in calls]
+        results = []
+        for (tool, _), future in zip(calls, futures):
+            timeout = tool.timeout if tool.timeout is not None else self.settings.tool_timeout
+            try:
+                remaining = None if timeout is None else max(0.0, started_at + timeout - time.perf_counter())
+                results.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                future.cancel()
+                results.append(f"Error: {tool.name} timed out")
+        if calls:
+            self.metrics.record("tool_execution", time.perf_counter() - started_at)
+        return results
+
+    def _use_tools(self, queries: List[str], contexts: List[str], rag_chunks: List[List[RetrievedChunk]], results: List[str],
+                   system_prompt: str, recursive_depth: Optional[int], tool_contexts: Optional[List[str]] = None) -> List[str]:
+        """
+        Fall back to tool calls for the answers where the model refused to answer from the
+        available context.
+
+        Refusals are detected in one batch, tools are picked for all refused queries at once
+        and their functions run concurrently. Answers that need the model again are generated
+        as one batch from prompts packed again from the original query, context and retrieved
+        chunks, so retrieval is not repeated. Tool results are always kept in those prompts;
+        the documents and context make room for them.
+
+        Args:
+            queries (List[str]): The original queries.
+            contexts (List[str]): The context provided with each query.
+            rag_chunks (List[List[RetrievedChunk]]): The chunks retrieved for each query.
+            results (List[str]): The model's answers.
+            system_prompt (str): The system prompt.
+            recursive_depth (int): Remaining tool calls. Defaults to `max_tool_calls`.
+            tool_contexts (List[str]): Results of earlier tool calls for each query.
+
+        Returns:
+            List[str]: The tool-assisted answers, or the original answers where no tool was used.
+        """
+        results = list(results)
+        if not self.settings.allow_tool_use or len(self.tools) == 0: # Tool use disabled
+            return results
+        if recursive_depth is None:
+            recursive_depth = self.settings.max_tool_calls
+        # Check if we have hit recursive depth
+        if recursive_depth <= 0 or len(results) == 0:
+            return results
+
+        refused = [i for i, refusal in enumerate(self.detect_refusals(results)) if refusal]
+        calls = []
+        for i, tool in zip(refused, self._select_tools([queries[i] for i in refused])):
+            if tool is None:
+                continue
+            try: # Attempt to extract tool schema and use
+                tool_extraction = self.extract(tool.schema, query=f"Query:'{queries[i]}' (If you can't extract return None)")
+            except ValidationError:
+                calls.append((i, tool, None, "Error: Unable to use tool"))
+                continue
+            calls.append((i, tool, tool_extraction, None))
+
+        runnable = [(tool, tool_extraction) for _, tool, tool_extraction, error in calls if error is None]
+        tool_results = iter(self._run_tools(runnable))
+        if tool_contexts is None:
+            tool_contexts = [""] * len(queries)
+        followups = []
+        for i, tool, tool_extraction, error in calls:
+            tool_result = error if error is not None else next(tool_results)
+            if tool.directly_return_result:
+                results[i] = tool_result
+            else:
+                tool_context = f"{tool.name}({tool_extraction}) => {tool_result}"
+                followups.append((i, f"{tool_contexts[i]}\n{tool_context}" if tool_contexts[i] else tool_context))
+
+        if followups:
+            indices = [i for i, _ in followups]
+            followup_tool_contexts = [tool_context for _, tool_context in followups]
+            followup_texts = [
+                self._query_prompt(queries[i], contexts[i], system_prompt, rag_chunks[i], tool_context)
+                for i, tool_context in followups
+            ]
+            answers = self._use_tools(
+                [queries[i] for i in indices], [contexts[i] for i in indices], [rag_chunks[i] for i in indices],
+                self.generate_batch(followup_texts), system_prompt, recursive_depth - 1, followup_tool_contexts,
+            )
+            for i, answer in zip(indices, answers):
+                results[i] = answer
+
+        return results
+
+    @_traceable
     def query(self, query: str, context: str = "", system_prompt: str = DEFAULT_SYSTEM_PROMPT, recursive_depth: int = None) -> str:
         """
         Handle a query and context, using RAG if no context is provided, and return a generated response.
@@ -260,55 +1847,84 @@ class TeapotAI:
         Returns:
             str: The generated response based on the input query and context.
         """
+        rag_chunks = self._rag_chunks([query])[0]
+        input_text = self._query_prompt(query, context, system_prompt, rag_chunks)
 
+        result = self.generate(input_text)
 
-        if self.settings.use_rag:
-            rag_context = "\n\n".join(self.rag(query))
+        return self._use_tools([query], [context], [rag_chunks], [result], system_prompt, recursive_depth)[0]
 
-        full_context = f"{rag_context}\n{context}"
+    @_traceable
+    def __call__(self, query: str, context: str = "", system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+                 options: Optional[List[str]] = None, return_scores: bool = False):
+        """
+        Answer a query, or choose its answer among `options`.
 
-        if self.settings.context_chunking:
-            documents = self._chunk_document(context)
-            if len(documents) > self.settings.rag_num_results:
-                document_embeddings = self._generate_document_embeddings(documents)
-                rag_documents = self._retrieval(query, documents, document_embeddings)
-                full_context = rag_context + "\n\n" + "\n\n".join(rag_documents)
+        Without options this is `query`. With options nothing is generated: the prompt is built
+        as `query` builds it (with RAG if no context is provided) and the options are ranked by
+        `score_options` in one encoder pass.
 
-        input_text = f"{full_context}\n{system_prompt}\n{query}"
+        Args:
+            query (str): The query string to be answered.
+            context (str): The context to guide the response. Defaults to an empty string.
+            system_prompt (str): The system prompt.
+            options (List[str]): Optional candidate answers.
+            return_scores (bool): Whether to also return the score of each option.
 
-        result = self.generate(input_text)
+        Returns:
+            str: The generated response, or the most likely option. With `return_scores`, a
+            (best option, scores) tuple, the scores being in the order of `options`.
+        """
+        if options is None:
+            if return_scores:
+                raise ValueError("Teapot- return_scores requires options")
+            return self.query(query, context=context, system_prompt=system_prompt)
+        if len(options) == 0:
+            raise ValueError("Teapot- options must not be empty")
+
+        input_text = self._query_prompt(query, context, system_prompt, self._rag_chunks([query])[0])
+        scores = self.score_options(input_text, options)
+        best = options[int(np.argmax(scores))]
+        return (best, scores) if return_scores else best
+
+    @_traceable
+    def query_batch(self, queries: List[str], contexts: Optional[List[str]] = None, system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> List[str]:
+        """
+        Answer many queries at once: retrieval runs as one embedding pass and one scoring
+        step, and generation runs in padded, length-sorted batches.
 
-        if self.settings.allow_tool_use and len(self.tools) > 0: # Tool use enabled
-            if recursive_depth is None:
-                recursive_depth = self.settings.max_tool_calls
-            # Check if we have hit recusrve depth
-            if recursive_depth > 0:
-              if self._detect_refusal(result):
-                  selected_tool_name = self.generate(f"{chr(10).join(f'{t.name} - {t.description}' for t in self.tools)}\nQuery: '{query}'\nExtract the name of the tool to use:")
-                  selected_tool = [tool for tool in self.tools if tool.name.lower()==selected_tool_name.lower()]
-                  if len(selected_tool) > 0:
-                    try: # Attempt to extract tool schema and use
-                      tool_extraction = self.extract(selected_tool[0].schema, query=f"Query:'{query}' (If you can't extract return None)")
-                      tool_result = selected_tool[0].fn(tool_extraction)
-                    except ValidationError as e:
-                      tool_result = f"Error: Unable to use tool"
-                    if selected_tool[0].directly_return_result:
-                      result = tool_result
-                    else:
-                      result = self.query(query=input_text, context=f"{selected_tool[0].name}({tool_extraction}) => {tool_result}", system_prompt=system_prompt, recursive_depth = recursive_depth - 1)
+        Args:
+            queries (List[str]): The query strings to be answered.
+            contexts (List[str]): Optional context for each query. Defaults to no context.
+            system_prompt (str): The system prompt shared by all queries.
 
-        return result
+        Returns:
+            List[str]: The generated responses, in the same order as `queries`.
+        """
+        if contexts is None:
+            contexts = [""] * len(queries)
+        if len(contexts) != len(queries):
+            raise ValueError("Teapot- The number of contexts must match the number of queries")
 
-    @traceable
-    def chat(self, conversation_history: List[dict]) -> str:
+        rag_chunks = self._rag_chunks(queries)
+        input_texts = [
+            self._query_prompt(query, context, system_prompt, chunks)
+            for query, context, chunks in zip(queries, contexts, rag_chunks)
+        ]
+        results = self.generate_batch(input_texts)
+
+        return self._use_tools(queries, contexts, rag_chunks, results, system_prompt, None)
+
+    def _chat_query(self, conversation_history: List[dict]) -> tuple:
         """
-        Engage in a chat by taking a list of previous messages and generating a response.
+        Split a conversation into the query (the last user message) and its context (the rest
+        of the conversation).
 
         Args:
             conversation_history (List[dict]): A list of previous messages, each containing 'content'.
 
         Returns:
-            str: The generated response based on the conversation history.
+            tuple: The formatted query and the formatted chat history.
         """
         last_user_index = next(
             (i for i in reversed(range(len(conversation_history))) if conversation_history[i].get('role') == 'user'),
@@ -328,12 +1944,104 @@ class TeapotAI:
             chat_history = ""
             formatted_last_user = ""
 
+        return formatted_last_user, chat_history
+
+    @_traceable
+    def chat(self, conversation_history: List[dict]) -> str:
+        """
+        Engage in a chat by taking a list of previous messages and generating a response.
+
+        Args:
+            conversation_history (List[dict]): A list of previous messages, each containing 'content'.
+
+        Returns:
+            str: The generated response based on the conversation history.
+        """
+        formatted_last_user, chat_history = self._chat_query(conversation_history)
+
         return self.query(query=formatted_last_user, context=chat_history)
 
-    @traceable
+    def _extraction_prompts(self, class_annotation: BaseModel, query: str, context: str) -> List[tuple]:
+        """
+        Build one extraction prompt per field of a Pydantic class.
+
+        Args:
+            class_annotation (BaseModel): The Pydantic class to extract fields for.
+            query (str): The query string to guide the extraction.
+            context (str): The context to extract from.
+
+        Returns:
+            List[tuple]: (field name, type annotation, prefix, suffix) for each field. The
+                prompt is the prefix shared by all fields and the field's suffix, joined by a newline.
+        """
+        prefix = f"{context}\n{query}" if context else query
+        prompts = []
+        for field_name, field in class_annotation.model_fields.items():
+            _field_type(field.annotation)
+            description = field.description
+            description_annotation = f"({description})" if description else ""
+            prompts.append((field_name, field.annotation, prefix, f"Extract the field {field_name} {description_annotation}"))
+        return prompts
+
+    def _generate_extractions(self, prompts: List[tuple]) -> List[str]:
+        """
+        Generate the values for extraction prompts in one batched pass.
+
+        With `extract_encoder_reuse`, each shared prefix is encoded once and reused for all of
+        its fields; otherwise every full prompt goes through `generate_batch`.
+
+        Args:
+            prompts (List[tuple]): Prompts as returned by `_extraction_prompts`.
+
+        Returns:
+            List[str]: The generated text for each prompt.
+        """
+        input_texts = [f"{prefix}\n{suffix}" for _, _, prefix, suffix in prompts]
+        if self.settings.extract_encoder_reuse and self.model.config.is_encoder_decoder and all(prefix for _, _, prefix, _ in prompts):
+            return self._cached_generate(
+                input_texts,
+                lambda indices: self._decode_with_shared_prefix([prompts[i][2] for i in indices], [prompts[i][3] for i in indices]),
+                cache_parameters={"encoder_reuse": True},
+            )
+        return self.generate_batch(input_texts)
+
+    def _parse_fields(self, type_annotations: list, results: List[str]) -> list:
+        """
+        Parse generated field values into their annotated types. Values are grouped by type
+        and each group is parsed in one pass.
+
+        Args:
+            type_annotations (list): The type annotation of each field.
+            results (List[str]): The generated text for each field.
+
+        Returns:
+            list: The parsed values, with None for values that could not be parsed.
+        """
+        parsed = [None] * len(results)
+        groups = {}
+        for i, type_annotation in enumerate(type_annotations):
+            groups.setdefault(_field_type(type_annotation), []).append(i)
+
+        for field_type, indices in groups.items():
+            values = [results[i] for i in indices]
+            if field_type is bool:
+                values = [
+                    True if _TRUE_PATTERN.search(value) else (False if _FALSE_PATTERN.search(value) else None)
+                    for value in values
+                ]
+            elif field_type is str:
+                values = [value.strip() if value is not None else value for value in values]
+            else:
+                values = _parse_numbers([_NON_NUMERIC_PATTERN.sub("", value) for value in values], field_type)
+            for i, value in zip(indices, values):
+                parsed[i] = value
+        return parsed
+
+    @_traceable
     def extract(self, class_annotation: BaseModel, query: str = "", context: str = "") -> BaseModel:
         """
         Extract fields from a Pydantic class annotation by querying and processing each field.
+        The prompts for all fields are generated together as one batch.
 
         Args:
             class_annotation (BaseModel): The Pydantic class to extract fields from.
@@ -344,40 +2052,40 @@ class TeapotAI:
             BaseModel: An instance of the provided Pydantic class with extracted field values.
         """
         if self.settings.use_rag and context is not None:
-            context_documents = self.rag(query)
-            context = "\n".join(context_documents) + context
+            context = "\n".join(self.rag(query) + ([context] if context else []))
 
-        output = {}
-        for field_name, field in class_annotation.model_fields.items():
-            type_annotation = field.annotation
-            description = field.description
-            description_annotation = f"({description})" if description else ""
+        prompts = self._extraction_prompts(class_annotation, query, context)
+        values = self._parse_fields([type_annotation for _, type_annotation, _, _ in prompts], self._generate_extractions(prompts))
 
-            result = self.generate(f"{query}\nExtract the field {field_name} {description_annotation}")
-
-            if type_annotation == bool or type_annotation == Optional[bool]:
-                parsed_result = (
-                    True if re.search(r'\b(yes|true)\b', result, re.IGNORECASE)
-                    else (False if re.search(r'\b(no|false)\b', result, re.IGNORECASE) else None)
-                )
-            elif type_annotation in [int, float, Optional[int], Optional[float]]:
-                cleaned = re.sub(r'[^0-9.-]', '', result)  # Allow negative and decimal
-                if cleaned:
-                    try:
-                        parsed_result = type_annotation(cleaned)
-                    except Exception:
-                        parsed_result = None
-                else:
-                    parsed_result = None
-            elif type_annotation == str or type_annotation == Optional[str]:
-                if result is not None:
-                  parsed_result = result.strip()
-                else:
-                  parsed_result = result
-            else:
-                raise ValueError(f"Teapot- Unsupported type annotation: {type_annotation}")
+        return class_annotation(**{field_name: value for (field_name, _, _, _), value in zip(prompts, values)})
+
+    @_traceable
+    def extract_batch(self, class_annotation: BaseModel, queries: List[str], contexts: Optional[List[str]] = None) -> List[BaseModel]:
+        """
+        Extract a Pydantic class for many queries at once. Retrieval runs as one embedding
+        pass and the prompts for every field of every query are generated as padded batches.
+
+        Args:
+            class_annotation (BaseModel): The Pydantic class to extract fields from.
+            queries (List[str]): The query strings to guide each extraction.
+            contexts (List[str]): Optional context for each query.
+
+        Returns:
+            List[BaseModel]: One instance of the Pydantic class per query, in order.
+        """
+        if contexts is None:
+            contexts = [""] * len(queries)
+        if len(contexts) != len(queries):
+            raise ValueError("Teapot- The number of contexts must match the number of queries")
 
+        if self.settings.use_rag:
+            contexts = ["\n".join(rag_documents + ([context] if context else [])) for rag_documents, context in zip(self.rag_batch(queries), contexts)]
 
-            output[field_name] = parsed_result
+        prompts = [prompt for query, context in zip(queries, contexts) for prompt in self._extraction_prompts(class_annotation, query, context)]
+        values = iter(self._parse_fields([type_annotation for _, type_annotation, _, _ in prompts], self._generate_extractions(prompts)))
 
-        return class_annotation(**output)
\ No newline at end of file
+        num_fields = len(class_annotation.model_fields)
+        return [
+            class_annotation(**{field_name: next(values) for field_name, _, _, _ in prompts[i * num_fields:(i + 1) * num_fields]})
+            for i in range(len(queries))
+        ]
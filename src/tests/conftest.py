@@ -0,0 +1,13 @@
+import pytest
+
+from .tiny_models import build_generator, build_embedding_pipeline
+
+
+@pytest.fixture(scope="session")
+def tiny_generator():
+    return build_generator()
+
+
+@pytest.fixture(scope="session")
+def tiny_embedding_model():
+    return build_embedding_pipeline()
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from transformers import AutoModelForSeq2SeqLM
+
+from teapotai import TeapotAI, TeapotAISettings
+from teapotai.backends import compare_backends, load_quantized, quantize_int8
+
+
+PROMPTS = ["where is the eiffel tower", "what is the capital of italy", "the sky is blue", "a"]
+
+
+def _teapot(tiny_generator, tiny_embedding_model, **settings):
+    model, tokenizer = tiny_generator
+    return TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                    settings=TeapotAISettings(verbose=False, **settings))
+
+
+def test_int8_backend_quantizes_without_touching_inputs(tiny_generator, tiny_embedding_model):
+    reference = _teapot(tiny_generator, tiny_embedding_model)
+    quantized = _teapot(tiny_generator, tiny_embedding_model, inference_backend="int8")
+    assert isinstance(reference.model.lm_head, torch.nn.Linear)
+    assert not isinstance(quantized.model.lm_head, torch.nn.Linear)
+    assert quantized.embedding_model.model is not tiny_embedding_model.model
+
+    report = compare_backends(reference, quantized, PROMPTS)
+    assert report["num_samples"] == len(PROMPTS)
+    assert 0 <= report["generation_exact_match"] <= 1
+    assert report["embedding_cosine_min"] > 0.9
+    assert report["candidate_model_mb"] < report["reference_model_mb"]
+
+
+def test_quantize_int8_leaves_the_model_in_its_mode(tiny_generator):
+    model = AutoModelForSeq2SeqLM.from_config(tiny_generator[0].config)
+    model.train()
+    quantized = quantize_int8(model)
+    assert model.training and isinstance(model.lm_head, torch.nn.Linear)
+    assert not quantized.training and not isinstance(quantized.lm_head, torch.nn.Linear)
+
+
+def test_traced_encoders_match_eager(tiny_generator, tiny_embedding_model):
+    eager = _teapot(tiny_generator, tiny_embedding_model)
+    traced = _teapot(tiny_generator, tiny_embedding_model, inference_trace=True)
+    assert traced.generate_batch(PROMPTS) == eager.generate_batch(PROMPTS)
+    assert traced.generate(PROMPTS[0]) == eager.generate(PROMPTS[0])
+    np.testing.assert_allclose(traced._embed(PROMPTS), eager._embed(PROMPTS), atol=1e-5)
+    assert set(traced._traced_encoders) == {"generator", "embedding"}
+
+
+def test_unsupported_backend_is_rejected(tiny_generator, tiny_embedding_model):
+    with pytest.raises(ValueError):
+        _teapot(tiny_generator, tiny_embedding_model, inference_backend="fp8")
+
+
+def test_quantized_weights_are_cached_on_disk(tiny_generator, tmp_path, monkeypatch):
+    model, tokenizer = tiny_generator
+    model.save_pretrained(tmp_path / "model")
+    inputs = tokenizer(PROMPTS, return_tensors="pt", padding=True)
+
+    first = load_quantized(AutoModelForSeq2SeqLM, str(tmp_path / "model"), cache_dir=str(tmp_path / "cache"))
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("fp32 weights should not be loaded on a cache hit")
+    monkeypatch.setattr(AutoModelForSeq2SeqLM, "from_pretrained", fail)
+    second = load_quantized(AutoModelForSeq2SeqLM, str(tmp_path / "model"), cache_dir=str(tmp_path / "cache"))
+    assert torch.equal(first.generate(**inputs, max_length=16), second.generate(**inputs, max_length=16))
@@ -0,0 +1,57 @@
+import multiprocessing
+
+import pytest
+from teapotai.cache import LRUCache, SQLiteCache, GenerationCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.get("b", "missing") == "missing"
+    assert cache.stats() == {"size": 2, "hits": 1, "misses": 1, "evictions": 1}
+
+
+def test_lru_cache_disabled_with_zero_size():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert len(cache) == 0 and cache.get("a") is None
+
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1" and cache.evictions == 1
+    assert SQLiteCache(cache.path).get("c") == "3"
+
+
+def _use_inherited_cache(cache, results):
+    parent_connection = cache._connection
+    cache.put("child", "2")
+    results.put((cache.get("parent"), cache._connection is not parent_connection))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="requires fork")
+def test_sqlite_cache_reconnects_after_fork(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    cache.put("parent", "1")
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=_use_inherited_cache, args=(cache, results))
+    process.start()
+    assert results.get(timeout=30) == ("1", True)
+    process.join()
+    assert cache.get("child") == "2" and len(cache) == 2
+
+
+def test_generation_cache_keys_cover_parameters_and_model():
+    key = GenerationCache.key("prompt", {"max_length": 512}, {"name": "teapot", "revision": "a"})
+    assert key == GenerationCache.key("prompt", {"max_length": 512}, {"revision": "a", "name": "teapot"})
+    assert key != GenerationCache.key("prompt", {"max_length": 256}, {"name": "teapot", "revision": "a"})
+    assert key != GenerationCache.key("prompt", {"max_length": 512}, {"name": "teapot", "revision": "b"})
@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+from teapotai.index import normalize_embeddings, top_k, save_index, load_index, ChunkStore, CompressedEmbeddings, ExactSearch, IVFSearch, DocumentIndex
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    rng = np.random.default_rng(0)
+    return normalize_embeddings(rng.standard_normal((2000, 16)))
+
+
+def test_top_k_matches_full_sort():
+    scores = np.random.default_rng(1).standard_normal(500).astype(np.float32)
+    expected = [i for i in sorted(range(len(scores)), key=lambda i: scores[i], reverse=True) if scores[i] >= 0.5][:7]
+    assert top_k(scores, 7, threshold=0.5).tolist() == expected
+    assert top_k(scores, 1000).tolist() == sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+    assert top_k(scores, 0).tolist() == []
+    assert top_k(scores, 5, threshold=10.0).tolist() == []
+
+
+def test_exact_search_matches_cosine_similarity(embeddings):
+    query = normalize_embeddings(np.random.default_rng(2).standard_normal((1, 16)))[0]
+    indices, scores = ExactSearch(embeddings).search(query, 5)
+    cosine = embeddings @ query
+    assert indices.tolist() == np.argsort(-cosine)[:5].tolist()
+    np.testing.assert_allclose(scores, cosine[indices])
+
+
+def test_ivf_search_probing_all_lists_is_exact(embeddings):
+    queries = normalize_embeddings(np.random.default_rng(3).standard_normal((20, 16)))
+    exact = ExactSearch(embeddings)
+    ivf = IVFSearch(embeddings, num_lists=16, num_probes=16)
+    for query in queries:
+        assert ivf.search(query, 10)[0].tolist() == exact.search(query, 10)[0].tolist()
+
+
+def test_ivf_recall_increases_with_probes(embeddings):
+    queries = normalize_embeddings(np.random.default_rng(4).standard_normal((50, 16)))
+    exact = ExactSearch(embeddings)
+    ivf = IVFSearch(embeddings, num_lists=32)
+
+    def recall(num_probes):
+        ivf.num_probes = num_probes
+        hits = [len(set(ivf.search(q, 10)[0]) & set(exact.search(q, 10)[0])) for q in queries]
+        return sum(hits) / (10 * len(queries))
+
+    assert recall(1) <= recall(8) <= recall(32) == 1.0
+
+
+def test_ivf_search_empty():
+    indices, scores = IVFSearch(np.empty((0, 16), dtype=np.float32)).search(np.ones(16, dtype=np.float32), 3)
+    assert len(indices) == 0 and len(scores) == 0
+
+
+def _entry(document_id, rows):
+    vectors = normalize_embeddings(np.random.default_rng(len(document_id)).standard_normal((rows, 16)))
+    return (document_id, document_id, [f"{document_id}-{i}" for i in range(rows)], [f"{document_id}-{i}" for i in range(rows)], vectors)
+
+
+def test_document_index_snapshots_are_isolated_from_updates():
+    index = DocumentIndex([], np.empty((0, 16), dtype=np.float32), [], [])
+    index.add([_entry("a", 3)])
+    before = index.snapshot
+    index.add([_entry("b", 2)])
+    index.remove(["a"])
+
+    assert len(before.embeddings) == 3 and before.alive is None
+    assert [before.chunks[i] for i in range(len(before.embeddings))] == ["a-0", "a-1", "a-2"]
+    # Removing 3 of 5 rows crossed the compaction threshold
+    assert index.documents == ["b-0", "b-1"]
+    assert index.records["b"]["chunks"] == [0, 1]
+    assert len(index.snapshot.embeddings) == 2
+
+
+def test_document_index_tombstones_until_compaction():
+    index = DocumentIndex([], np.empty((0, 16), dtype=np.float32), [], [], compaction_threshold=0.9)
+    index.add([_entry("a", 2), _entry("b", 2)])
+    query = np.array(index.snapshot.embeddings[0])
+    assert index.remove(["a", "missing"]) == 2
+    snapshot = index.snapshot
+    indices, _ = snapshot.search.search(query, 4, alive=snapshot.alive)
+    assert sorted(indices.tolist()) == [2, 3]
+    assert index.documents == ["b-0", "b-1"]
+
+    index.compact()
+    assert index.snapshot.alive is None
+    assert index.documents == ["b-0", "b-1"]
+    np.testing.assert_array_equal(index.embeddings, _entry("b", 2)[4])
+
+
+@pytest.mark.parametrize("storage, tolerance", [("float16", 1e-3), ("int8", 2e-2)])
+def test_compressed_embeddings_score_close_to_float32(embeddings, storage, tolerance):
+    compressed = CompressedEmbeddings.encode(embeddings, storage)
+    queries = normalize_embeddings(np.random.default_rng(5).standard_normal((8, 16)))
+    assert compressed.nbytes < embeddings.nbytes / 1.9
+    np.testing.assert_allclose(compressed.score(queries), queries @ embeddings.T, atol=tolerance)
+    np.testing.assert_allclose(compressed.score(queries[0]), embeddings @ queries[0], atol=tolerance)
+    np.testing.assert_allclose(np.asarray(compressed[10:20]), embeddings[10:20], atol=tolerance)
+    np.testing.assert_allclose(compressed[3], embeddings[3], atol=tolerance)
+
+    exact = ExactSearch(embeddings).search_batch(queries, 10)
+    approximate = ExactSearch(compressed).search_batch(queries, 10)
+    hits = sum(len(set(a[0]) & set(e[0])) for a, e in zip(approximate, exact))
+    assert hits >= 0.9 * 10 * len(queries)
+
+
+def test_chunk_store_round_trip():
+    chunks = ["plain", "", "ünïcödé 🫖", "line\nbreak"]
+    store = ChunkStore(chunks[:2])
+    store.extend(chunks[2:3])
+    store.append(chunks[3])
+    assert len(store) == 4
+    assert list(store) == chunks
+    assert store[1:] == chunks[1:]
+    assert store[np.int64(2)] == chunks[2] and store[-1] == chunks[3]
+    with pytest.raises(IndexError):
+        store[4]
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_document_index_compressed_storage(tmp_path, storage):
+    index = DocumentIndex([], np.empty((0, 16), dtype=np.float32), [], [], storage=storage, compaction_threshold=0.1)
+    index.add([_entry("a", 3), _entry("b", 2)])
+    assert isinstance(index.embeddings, CompressedEmbeddings) and index.embeddings.storage == storage
+    index.remove(["a"])
+    np.testing.assert_allclose(np.asarray(index.embeddings), _entry("b", 2)[4], atol=2e-2)
+
+    chunks, embeddings, records, chunk_hashes, _ = index.export()
+    save_index(str(tmp_path), chunks, embeddings, {})
+    loaded_chunks, loaded_embeddings, manifest = load_index(str(tmp_path))
+    assert manifest["dtype"] == storage and loaded_chunks == ["b-0", "b-1"]
+    np.testing.assert_array_equal(loaded_embeddings.codes, embeddings.codes)
+
+    # A memory-mapped compressed index is copied on the first append
+    loaded = DocumentIndex(loaded_chunks, loaded_embeddings, records, chunk_hashes, storage=storage)
+    loaded.add([_entry("c", 1)])
+    assert loaded.documents == ["b-0", "b-1", "c-0"]
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from teapotai import TeapotAI, TeapotAISettings, iter_documents
+
+WORDS = "the capital city of country is paris rome italy france tower water dog cat sky blue".split()
+
+
+def make_documents(num_documents):
+    rng = np.random.default_rng(0)
+    # Some documents are long enough to be split into several chunks
+    return [" ".join(rng.choice(WORDS, size=int(rng.integers(5, 120)))) for _ in range(num_documents)]
+
+
+def make_teapot_ai(tiny_generator, tiny_embedding_model, index_path=None, **settings):
+    model, tokenizer = tiny_generator
+    settings = TeapotAISettings(verbose=False, ingest_batch_size=8, ingest_queue_size=2, **settings)
+    return TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings, index_path=index_path)
+
+
+def test_iter_documents_sources(tmp_path):
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "a.txt").write_text("first")
+    (tmp_path / "nested" / "b.txt").write_text("second")
+    (tmp_path / "c.md").write_text("third")
+
+    assert [text for _, text in iter_documents(tmp_path)] == ["first", "third", "second"]
+    assert list(iter_documents(str(tmp_path / "*.txt"))) == [(str(tmp_path / "a.txt"), "first")]
+    assert [text for _, text in iter_documents(tmp_path, pattern="**/*.txt")] == ["first", "second"]
+    assert list(iter_documents(["plain", ("id", "text"), tmp_path / "c.md"])) == [(None, "plain"), ("id", "text"), (str(tmp_path / "c.md"), "third")]
+    with pytest.raises(ValueError):
+        list(iter_documents(str(tmp_path / "missing.txt")))
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_ingest_matches_indexing_documents_in_memory(tiny_generator, tiny_embedding_model, num_workers):
+    documents = make_documents(40)
+    expected = make_teapot_ai(tiny_generator, tiny_embedding_model)
+    expected.add_documents(documents)
+
+    teapot_ai = make_teapot_ai(tiny_generator, tiny_embedding_model, ingest_num_workers=num_workers)
+    progress = []
+    stats = teapot_ai.ingest(iter(documents), callback=lambda stats: progress.append(stats.chunks))
+
+    assert teapot_ai.documents == expected.documents
+    np.testing.assert_allclose(teapot_ai.document_embeddings, expected.document_embeddings, atol=1e-5)
+    assert stats.documents == stats.indexed == 40 and stats.chunks == len(expected.documents)
+    # Batches were added to the index as they were embedded
+    assert len(progress) > 1 and progress == sorted(progress)
+    assert teapot_ai.rag("the capital of france") == expected.rag("the capital of france")
+
+
+def test_ingest_checkpoints_and_resumes(tiny_generator, tiny_embedding_model, tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    for i, document in enumerate(make_documents(30)):
+        (corpus / f"{i:02d}.txt").write_text(document)
+    index_path = str(tmp_path / "index")
+
+    first = make_teapot_ai(tiny_generator, tiny_embedding_model, ingest_num_workers=0, ingest_checkpoint_interval=10)
+    stats = first.ingest(corpus, pattern="0*.txt", index_path=index_path)
+    assert stats.indexed == 10 and stats.checkpoints >= 2
+    assert sorted(first.index.records) == [str(corpus / f"{i:02d}.txt") for i in range(10)]
+
+    # A new instance picks up the saved index and only processes the remaining files
+    resumed = make_teapot_ai(tiny_generator, tiny_embedding_model, index_path=index_path, ingest_num_workers=0)
+    stats = resumed.ingest(corpus)
+    assert stats.documents == 30 and stats.skipped == 10 and stats.indexed == 20
+    assert len(resumed.index.records) == 30
+
+    (corpus / "05.txt").write_text("the sky is blue")
+    stats = resumed.ingest(corpus)
+    assert stats.skipped == 29 and stats.indexed == 1 and stats.embedded == 1
+    assert "the sky is blue" in resumed.documents
+
+
+def test_ingest_propagates_errors(tiny_generator, tiny_embedding_model):
+    teapot_ai = make_teapot_ai(tiny_generator, tiny_embedding_model, ingest_num_workers=0)
+    teapot_ai._embed = lambda texts, **kwargs: 1 / 0
+    with pytest.raises(ZeroDivisionError):
+        teapot_ai.ingest(make_documents(100))
@@ -0,0 +1,37 @@
+from teapotai.metrics import TeapotMetrics
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = TeapotMetrics()
+    events = []
+    metrics.add_callback(events.append)
+    with metrics.stage("encoder"):
+        pass
+    metrics.record("decoder", 1.0, tokens_in=3, tokens_out=2)
+    assert metrics.stats() == {"stages": {}, "tokens_in": 0, "tokens_out": 0}
+    assert events == []
+
+
+def test_stage_timings_callbacks_and_prometheus_export():
+    metrics = TeapotMetrics(enabled=True)
+    events = []
+    metrics.add_callback(events.append)
+    with metrics.stage("encoder"):
+        pass
+    metrics.record("decoder", 0.5, tokens_in=3, tokens_out=2)
+    metrics.record("decoder", 1.5, tokens_in=4, tokens_out=1)
+
+    stats = metrics.stats()
+    assert stats["stages"]["encoder"]["count"] == 1
+    assert stats["stages"]["decoder"] == {"count": 2, "seconds": 2.0, "max_seconds": 1.5, "mean_seconds": 1.0}
+    assert (stats["tokens_in"], stats["tokens_out"]) == (7, 3)
+    assert [event["stage"] for event in events] == ["encoder", "decoder", "decoder"]
+    assert events[1] == {"stage": "decoder", "seconds": 0.5, "tokens_in": 3, "tokens_out": 2}
+
+    text = metrics.to_prometheus()
+    assert 'teapotai_stage_seconds_total{stage="decoder"} 2.0' in text
+    assert 'teapotai_stage_calls_total{stage="decoder"} 2' in text
+    assert "teapotai_tokens_out_total 3" in text
+
+    metrics.reset()
+    assert metrics.stats()["stages"] == {}
@@ -0,0 +1,81 @@
+import math
+
+from teapotai import TeapotAI, TeapotAISettings
+from teapotai.packing import RetrievedChunk, pack_segments
+
+DOCUMENTS = [
+    "The Eiffel Tower is in Paris and it is made of iron.",
+    "Rome is the capital of Italy.",
+    "Water boils at 100 degrees at sea level, and it freezes at zero degrees.",
+]
+
+
+def make_teapot_ai(tiny_generator, tiny_embedding_model, **settings):
+    model, tokenizer = tiny_generator
+    settings = TeapotAISettings(verbose=False, generation_max_length=8, allow_tool_use=False, rag_similarity_threshold=-1.0, **settings)
+    return TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, documents=DOCUMENTS, settings=settings)
+
+
+def test_pack_segments_fills_budget_by_score():
+    segments = [RetrievedChunk("a", 0.9, 6), RetrievedChunk("b", 0.8, 5), RetrievedChunk("c", 0.1, 3), RetrievedChunk("context", math.inf, 4)]
+    assert pack_segments(segments, 20) == [True, True, True, True]
+    # The caller's context comes first; "b" no longer fits but the less relevant "c" does
+    assert pack_segments(segments, 13) == [True, False, True, True]
+    assert pack_segments(segments, 12, separator_tokens=1) == [True, False, False, True]
+    assert pack_segments(segments, 0) == [False] * 4
+
+
+def test_token_counts_are_cached_at_indexing(tiny_generator, tiny_embedding_model, tmp_path):
+    teapot_ai = make_teapot_ai(tiny_generator, tiny_embedding_model)
+    expected = [len(teapot_ai.tokenizer(chunk, add_special_tokens=False)["input_ids"]) for chunk in teapot_ai.documents]
+    assert teapot_ai.index.snapshot.token_counts.tolist() == expected
+
+    teapot_ai.add_documents(["The sky is blue."])
+    assert teapot_ai.index.snapshot.token_counts[-1] == len(teapot_ai.tokenizer("The sky is blue.", add_special_tokens=False)["input_ids"])
+
+    saved = teapot_ai.index.snapshot.token_counts.tolist()
+    teapot_ai.save_index(str(tmp_path))
+    teapot_ai.load_index(str(tmp_path))
+    assert teapot_ai.index.snapshot.token_counts.tolist() == saved
+
+    counted = []
+    count_tokens = teapot_ai._count_tokens
+    teapot_ai._count_tokens = lambda texts: counted.extend(texts) or count_tokens(texts)
+    teapot_ai.pack_context("where is the eiffel tower")
+    # Only the system prompt and query are tokenized when packing
+    assert not any(document in counted for document in DOCUMENTS)
+
+
+def test_prompt_is_unchanged_within_budget(tiny_generator, tiny_embedding_model):
+    teapot_ai = make_teapot_ai(tiny_generator, tiny_embedding_model)
+    pack = teapot_ai.pack_context("where is the eiffel tower", context="Some context.", system_prompt="Answer.")
+    rag_context = "\n\n".join(teapot_ai.rag("where is the eiffel tower"))
+    assert pack.prompt == f"{rag_context}\nSome context.\nAnswer.\nwhere is the eiffel tower"
+    assert pack.dropped == [] and len(pack.included) == 4
+    assert pack.prompt_tokens == len(teapot_ai.tokenizer(pack.prompt)["input_ids"])
+
+
+def test_context_is_packed_into_max_context_length(tiny_generator, tiny_embedding_model):
+    query, system_prompt = "where is the eiffel tower", "Answer the question."
+    context = "The tower was built in 1889 for the world fair."
+    unlimited = make_teapot_ai(tiny_generator, tiny_embedding_model).pack_context(query, context, system_prompt)
+
+    budget = unlimited.prompt_tokens - 8
+    teapot_ai = make_teapot_ai(tiny_generator, tiny_embedding_model, max_context_length=budget, metrics=True)
+    events = []
+    teapot_ai.metrics.add_callback(events.append)
+    pack = teapot_ai.pack_context(query, context, system_prompt)
+
+    assert pack.dropped and pack.prompt.endswith(f"\n{system_prompt}\n{query}")
+    # The caller's context is kept before retrieved documents
+    assert context in pack.prompt
+    assert all(document not in pack.prompt for document in pack.dropped)
+    assert pack.prompt_tokens <= budget
+    assert len(teapot_ai.tokenizer(pack.prompt)["input_ids"]) <= budget
+    assert events[-1]["stage"] == "context_packing" and events[-1]["dropped"] == len(pack.dropped)
+
+    # The system prompt and query are kept even when nothing else fits
+    teapot_ai.settings.max_context_length = 1
+    pack = teapot_ai.pack_context(query, context, system_prompt)
+    assert pack.included == [] and pack.prompt == f"\n\n{system_prompt}\n{query}"
+    assert isinstance(teapot_ai.query(query, context=context), str)
@@ -0,0 +1,86 @@
+import os
+import signal
+import time
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from teapotai import TeapotAI, TeapotAISettings, TeapotPool, WorkerCrashedError
+
+
+class Landmark(BaseModel):
+    city: Optional[str]
+    famous: Optional[bool]
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    return TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                    documents=["The Eiffel Tower is in Paris."], settings=TeapotAISettings(verbose=False))
+
+
+def test_pool_matches_in_process_results(tiny_model):
+    queries = ["where is the eiffel tower", "what is the capital of italy", "is the sky blue", "a"]
+    with TeapotPool(tiny_model, num_workers=2, threads_per_worker=1) as pool:
+        futures = [pool.submit("query", query) for query in queries]
+        assert [future.result(timeout=60) for future in futures] == [tiny_model.query(query) for query in queries]
+        assert pool.extract(Landmark, query="the eiffel tower") == tiny_model.extract(Landmark, query="the eiffel tower")
+        stats = pool.stats()
+    assert len(stats) == 2
+    assert sum(worker["completed"] for worker in stats) == len(queries) + 1
+    assert all(worker["alive"] and 0 <= worker["utilization"] <= 1 for worker in stats)
+
+
+def test_pool_restarts_crashed_workers(tiny_model):
+    with TeapotPool(tiny_model, num_workers=1, threads_per_worker=1, max_restarts=1) as pool:
+        pid = pool.stats()[0]["pid"]
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.time() + 30
+        while pool.stats()[0]["restarts"] == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        stats = pool.stats()[0]
+        assert stats["restarts"] == 1 and stats["pid"] != pid
+        assert pool.query("where is the tower") == tiny_model.query("where is the tower")
+
+        # Once restarts are exhausted the pool reports it instead of hanging
+        os.kill(stats["pid"], signal.SIGKILL)
+        while pool.stats()[0]["pid"] is not None and time.time() < deadline:
+            time.sleep(0.05)
+        with pytest.raises(WorkerCrashedError):
+            pool.query("where is the tower")
+
+
+def test_pool_rejects_private_methods(tiny_model):
+    with TeapotPool(tiny_model, num_workers=1, threads_per_worker=1) as pool:
+        with pytest.raises(ValueError):
+            pool.submit("_embed", ["a"])
+
+
+class _RestartBeforeSend:
+    # Stands in for a worker's send lock, restarting the worker between picking it and sending
+    def __init__(self, pool, worker):
+        self.pool, self.worker, self.lock = pool, worker, worker.send_lock
+
+    def __enter__(self):
+        self.pool._restart(self.worker, "was killed")
+        return self.lock.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.lock.__exit__(*exc_info)
+
+
+@pytest.mark.parametrize("max_restarts", [0, 1])
+def test_pool_submit_races_with_restart(tiny_model, max_restarts):
+    with TeapotPool(tiny_model, num_workers=1, threads_per_worker=1, max_restarts=max_restarts) as pool:
+        worker = pool._workers[0]
+        worker.send_lock = _RestartBeforeSend(pool, worker)
+        future = pool.submit("query", "where is the tower")
+        with pytest.raises(WorkerCrashedError):
+            future.result(timeout=10)
+        # The task was not sent to the replacement worker
+        assert worker.in_flight == {}
+        if max_restarts:
+            worker.send_lock = worker.send_lock.lock
+            assert pool.query("where is the tower") == tiny_model.query("where is the tower")
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+from teapotai import ModelRegistry, TeapotAI, TeapotAISettings
+
+
+def test_registry_loads_each_handle_once_across_threads():
+    registry = ModelRegistry()
+    calls = []
+
+    def loader():
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return object()
+
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(registry.get(("generator", "m", None, "fp32"), loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and all(handle is handles[0] for handle in handles)
+    assert registry.get(("generator", "m", None, "int8"), object) is not handles[0]
+    assert len(registry) == 2
+
+    def failing():
+        raise RuntimeError("download failed")
+
+    with pytest.raises(RuntimeError):
+        registry.get("flaky", failing)
+    assert "flaky" not in registry and registry.get("flaky", lambda: 1) == 1
+
+    registry.clear()
+    assert registry.keys() == []
+
+
+def test_instances_share_registered_models(tiny_generator, tiny_embedding_model, monkeypatch):
+    import teapotai.teapotai as teapotai_module
+    model, tokenizer = tiny_generator
+    loaded = []
+    monkeypatch.setattr(teapotai_module, "model_registry", ModelRegistry())
+    monkeypatch.setattr(teapotai_module, "_load_model", lambda: loaded.append("model") or model)
+    monkeypatch.setattr(teapotai_module, "_load_tokenizer", lambda: loaded.append("tokenizer") or tokenizer)
+    monkeypatch.setattr(teapotai_module, "_load_embedding_model", lambda: loaded.append("embedding") or tiny_embedding_model)
+
+    settings = TeapotAISettings(verbose=False, generation_max_length=8)
+    first = TeapotAI(documents=["The Eiffel Tower is in Paris."], settings=settings)
+    first.warm_up()
+    assert sorted(loaded) == ["embedding", "model", "tokenizer"]
+
+    # A second tenant with its own documents reuses the weights and keeps its own index
+    second = TeapotAI(documents=["Rome is the capital of Italy."], settings=settings)
+    second.warm_up()
+    assert sorted(loaded) == ["embedding", "model", "tokenizer"]
+    assert second.model is first.model and second.embedding_model is first.embedding_model
+    assert second.documents == ["Rome is the capital of Italy."] and first.documents == ["The Eiffel Tower is in Paris."]
+    assert second.generate("where is rome") == first.generate("where is rome")
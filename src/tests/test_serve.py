@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from teapotai import TeapotAI, TeapotAISettings, AsyncTeapotAI, QueueFullError
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    return TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                    documents=["The Eiffel Tower is in Paris."], settings=TeapotAISettings(verbose=False))
+
+
+def test_concurrent_requests_are_micro_batched(tiny_model):
+    queries = ["where is the eiffel tower", "what is the capital of italy", "is the sky blue"]
+
+    async def run():
+        async with AsyncTeapotAI(tiny_model, max_batch_size=8, max_wait_ms=200) as server:
+            results = await asyncio.gather(*[server.query(query) for query in queries])
+            return results, server.metrics()
+
+    results, metrics = asyncio.run(run())
+    assert results == [tiny_model.query(query) for query in queries]
+    assert metrics["completed"] == 3
+    assert metrics["mean_batch_size"] == 3
+    assert metrics["queue_depth"] == 0
+
+
+def test_chat_matches_sync_chat(tiny_model):
+    messages = [{"role": "system", "content": "be brief"}, {"role": "user", "content": "where is the tower"}]
+
+    async def run():
+        async with AsyncTeapotAI(tiny_model) as server:
+            return await server.chat(messages)
+
+    assert asyncio.run(run()) == tiny_model.chat(messages)
+
+
+def test_full_queue_rejects_requests(tiny_model):
+    async def run():
+        async with AsyncTeapotAI(tiny_model, max_batch_size=1, max_queue_size=1, reject_when_full=True) as server:
+            results = await asyncio.gather(*[server.query("a") for _ in range(4)], return_exceptions=True)
+            return results, server.metrics()
+
+    results, metrics = asyncio.run(run())
+    assert any(isinstance(result, QueueFullError) for result in results)
+    assert metrics["rejected"] == sum(isinstance(result, QueueFullError) for result in results)
+
+
+def test_http_app(tiny_model):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+    from teapotai.app import create_app
+
+    with TestClient(create_app(tiny_model)) as client:
+        response = client.post("/query", json={"query": "where is the eiffel tower"})
+        assert response.status_code == 200
+        assert response.json()["response"] == tiny_model.query("where is the eiffel tower")
+        assert client.get("/metrics").json()["completed"] == 1
+        assert client.get("/metrics/prometheus").text.startswith("# HELP teapotai_stage_seconds_total")
+
+
+def test_async_query_stream(tiny_model):
+    async def run():
+        async with AsyncTeapotAI(tiny_model) as server:
+            chunks = [text async for text in server.query_stream("where is the eiffel tower")]
+            return chunks, server.metrics()
+
+    chunks, metrics = asyncio.run(run())
+    assert "".join(chunks) == tiny_model.query("where is the eiffel tower")
+    assert metrics["time_to_first_token_max_ms"] > 0
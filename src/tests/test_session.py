@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from teapotai import ChatSession, TeapotAI, TeapotAISettings
+
+
+@pytest.fixture
+def teapot_ai(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    return TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                    settings=TeapotAISettings(verbose=False, generation_max_length=12, allow_tool_use=False, rag_similarity_threshold=-1.0))
+
+
+def test_history_packs_recent_and_relevant_messages_under_budget(teapot_ai):
+    session = ChatSession(teapot_ai, max_history_tokens=20, recent_messages=2, num_retrieved=1)
+    session.add_messages([
+        {"role": "user", "content": "where is the eiffel tower"},
+        {"role": "assistant", "content": "paris"},
+        {"role": "user", "content": "the sky is blue and the sun is yellow and the moon"},
+        {"role": "assistant", "content": "yes"},
+        {"role": "user", "content": "what is the capital of italy"},
+        {"role": "assistant", "content": "rome"},
+        {"role": "user", "content": "where is the eiffel tower"},
+    ])
+    history = session.history()
+    # The two most recent messages, then the most similar older one
+    assert history == "user: where is the eiffel tower\nuser: what is the capital of italy\nassistant: rome\n"
+    assert sum(len(teapot_ai.tokenizer(line + "\n", add_special_tokens=False)["input_ids"]) for line in history.splitlines()) <= 20
+
+
+def test_chat_embeds_each_message_once(teapot_ai):
+    session = ChatSession(teapot_ai)
+    embedded = []
+    embed = teapot_ai._embed
+    teapot_ai._embed = lambda texts, **kwargs: embedded.extend(texts) or embed(texts, **kwargs)
+    try:
+        for message in ["where is the tower", "what is the capital of italy", "is the sky blue"]:
+            assert isinstance(session.chat(message), str)
+    finally:
+        del teapot_ai._embed
+    assert len(session) == 6
+    assert embedded == [message["content"] for message in session.messages]
+
+
+def test_session_round_trips_without_reembedding(teapot_ai):
+    session = ChatSession(teapot_ai, recent_messages=1, num_retrieved=2)
+    session.add_messages([{"role": "user", "content": f"message about the {word}"} for word in ["tower", "sky", "dog", "water", "tower"]])
+    data = json.loads(json.dumps(session.to_dict()))
+
+    embed = teapot_ai._embed
+    teapot_ai._embed = lambda texts, **kwargs: pytest.fail("restoring a session should not embed")
+    try:
+        restored = ChatSession.from_dict(teapot_ai, data)
+    finally:
+        teapot_ai._embed = embed
+        del teapot_ai._embed
+    assert restored.messages == session.messages
+    assert restored.history() == session.history()
@@ -1,5 +1,10 @@
+import numpy as np
 import pytest
-from teapotai import TeapotAI
+from teapotai import TeapotAI, TeapotAISettings, DEFAULT_SYSTEM_PROMPT
+from teapotai.index import hash_text
+from teapotai.refusal import RefusalClassifier
+
+from .tiny_models import build_generator
 
 
 @pytest.fixture(scope="module")
@@ -89,3 +94,611 @@ def test_math_question(model):
     assert isinstance(response, str)
     # Don't assert correctness, just that it runs and is numeric-ish
     assert any(char.isdigit() for char in response)
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    return TeapotAI(
+        model=model,
+        tokenizer=tokenizer,
+        embedding_model=tiny_embedding_model,
+        documents=[
+            "The Eiffel Tower is in Paris.",
+            "Rome is the capital of Italy.",
+            "Water boils at a temperature of 100 degrees.",
+        ],
+        settings=TeapotAISettings(verbose=False, embedding_batch_size=2),
+    )
+
+
+def test_batched_embeddings_match_pipeline(tiny_model):
+    texts = ["a", "the capital of france is paris", "", "dog " * 200, "what is the weather"]
+    batched = tiny_model._generate_document_embeddings(texts)
+    assert batched.dtype == np.float32
+    assert batched.shape == (len(texts), 32)
+    for text, embedding in zip(texts, batched):
+        expected = np.array(tiny_model.embedding_model(text)[0][0])
+        np.testing.assert_allclose(embedding, expected, atol=1e-5)
+
+
+def test_index_round_trip_reembeds_only_changed_documents(tiny_generator, tiny_embedding_model, tmp_path):
+    model, tokenizer = tiny_generator
+    settings = TeapotAISettings(verbose=False)
+    documents = ["The Eiffel Tower is in Paris.", "Rome is the capital of Italy."]
+    first = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                     documents=documents, settings=settings, index_path=str(tmp_path))
+    assert isinstance(first.document_embeddings, np.memmap)
+
+    embedded = []
+    second = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                      settings=settings, index_path=str(tmp_path))
+    second._generate_document_embeddings = lambda docs: embedded.append(list(docs)) or first._embed(docs)
+    assert second.documents == first.documents
+    np.testing.assert_array_equal(second.document_embeddings, first.document_embeddings)
+
+    second._index_documents(documents + ["Water boils at 100 degrees."], str(tmp_path))
+    assert embedded == [["Water boils at 100 degrees."]]
+    assert second.documents[-1] == "Water boils at 100 degrees."
+    np.testing.assert_allclose(second.document_embeddings[:2], first.document_embeddings, atol=1e-6)
+
+
+def test_rag_uses_configured_search_backend(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    words = "the capital city of country is paris rome italy france tower water dog cat sky blue".split()
+    rng = np.random.default_rng(0)
+    documents = [" ".join(rng.choice(words, size=8)) for _ in range(50)]
+    kwargs = dict(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, documents=documents)
+    exact = TeapotAI(settings=TeapotAISettings(verbose=False, rag_similarity_threshold=-1.0), **kwargs)
+    ivf = TeapotAI(settings=TeapotAISettings(verbose=False, rag_similarity_threshold=-1.0, rag_index="ivf",
+                                             rag_ivf_num_lists=4, rag_ivf_num_probes=4), **kwargs)
+    assert exact.rag("what is the capital of france") == ivf.rag("what is the capital of france")
+    assert len(exact.rag("what is the capital of france")) == exact.settings.rag_num_results
+
+
+def test_compressed_embedding_storage_with_rerank(tiny_generator, tiny_embedding_model, tmp_path):
+    model, tokenizer = tiny_generator
+    words = "the capital city of country is paris rome italy france tower water dog cat sky blue".split()
+    rng = np.random.default_rng(0)
+    documents = [" ".join(rng.choice(words, size=8)) for _ in range(50)]
+    queries = ["what is the capital of france", "the dog and the cat", "blue water"]
+    kwargs = dict(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, documents=documents)
+    exact = TeapotAI(settings=TeapotAISettings(verbose=False), **kwargs)
+    # The tiny model's embeddings are nearly identical, so only reranking every chunk is exact
+    int8 = TeapotAI(settings=TeapotAISettings(verbose=False, embedding_storage="int8", embedding_rerank=len(documents),
+                                              metrics=True), **kwargs)
+
+    assert int8.document_embeddings.storage == "int8"
+    assert int8.document_embeddings.nbytes < exact.document_embeddings.nbytes / 3
+    assert int8.rag_batch(queries) == exact.rag_batch(queries)
+    assert [int8.rag(query) for query in queries] == [exact.rag(query) for query in queries]
+    assert "rerank" in int8.metrics.stats()["stages"]
+
+    int8.save_index(str(tmp_path))
+    with pytest.raises(ValueError):
+        exact.load_index(str(tmp_path))
+    int8.load_index(str(tmp_path))
+    assert int8.rag_batch(queries) == exact.rag_batch(queries)
+    with pytest.raises(ValueError):
+        TeapotAI(settings=TeapotAISettings(verbose=False, embedding_storage="int4"), **kwargs)
+
+
+def test_add_remove_update_documents(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                         documents=["The Eiffel Tower is in Paris."],
+                         settings=TeapotAISettings(verbose=False, rag_similarity_threshold=-1.0))
+    embedded = []
+    embed = teapot_ai._generate_document_embeddings
+    teapot_ai._generate_document_embeddings = lambda docs: embedded.append(list(docs)) or embed(docs)
+
+    ids = teapot_ai.add_documents(["Rome is the capital of Italy.", "The sky is blue."])
+    assert embedded == [["Rome is the capital of Italy.", "The sky is blue."]]
+    assert teapot_ai.documents == ["The Eiffel Tower is in Paris.", "Rome is the capital of Italy.", "The sky is blue."]
+
+    teapot_ai.update_document(ids[1], "The sky is blue at noon.")
+    assert "The sky is blue." not in teapot_ai.rag("what color is the sky")
+    assert teapot_ai.documents[-1] == "The sky is blue at noon."
+
+    assert teapot_ai.remove_documents([ids[0]]) == 1
+    assert teapot_ai.documents == ["The Eiffel Tower is in Paris.", "The sky is blue at noon."]
+    assert len(teapot_ai.document_embeddings) == 2
+    assert "Rome is the capital of Italy." not in teapot_ai.rag("what is the capital of italy")
+
+    with pytest.raises(ValueError):
+        teapot_ai.update_document("missing", "text")
+
+
+def test_rebuilt_index_keeps_saved_document_ids(tiny_generator, tiny_embedding_model, tmp_path):
+    model, tokenizer = tiny_generator
+    settings = TeapotAISettings(verbose=False)
+    first = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings, index_path=str(tmp_path))
+    first.add_documents(["The Eiffel Tower is in Paris.", "Rome is the capital of Italy."], ids=["eiffel", "rome"])
+    first.save_index(str(tmp_path))
+
+    # A new document forces a rebuild; the saved documents keep their ids
+    documents = ["The Eiffel Tower is in Paris.", "Rome is the capital of Italy.", "The sky is blue."]
+    second = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, documents=documents,
+                      settings=settings, index_path=str(tmp_path))
+    assert sorted(second.index.records) == sorted(["eiffel", "rome", hash_text("The sky is blue.")])
+    assert second.remove_documents(["rome"]) == 1
+    assert second.documents == ["The Eiffel Tower is in Paris.", "The sky is blue."]
+
+
+def test_batch_methods_match_single_calls(tiny_model):
+    from typing import Optional
+    from pydantic import BaseModel
+
+    class Landmark(BaseModel):
+        city: Optional[str]
+        height: Optional[float]
+        famous: Optional[bool]
+
+    queries = ["what is the capital of italy", "where is the eiffel tower", "a", "how tall is the tower in paris"]
+    contexts = ["", "The Eiffel Tower is in Paris.", "", "The tower is 330 meters tall."]
+    assert tiny_model.generate_batch(queries) == [tiny_model.generate(query) for query in queries]
+    assert tiny_model.rag_batch(queries) == [tiny_model.rag(query) for query in queries]
+    assert tiny_model.query_batch(queries, contexts) == [tiny_model.query(q, context=c) for q, c in zip(queries, contexts)]
+    assert tiny_model.extract_batch(Landmark, queries, contexts) == [
+        tiny_model.extract(Landmark, query=q, context=c) for q, c in zip(queries, contexts)
+    ]
+
+
+def test_generate_stream_matches_generate(tiny_model):
+    stream = tiny_model.generate_stream("where is the eiffel tower in paris")
+    assert "".join(stream) == tiny_model.generate("where is the eiffel tower in paris")
+    assert stream.time_to_first_token is not None and stream.time_to_first_token <= stream.elapsed
+    assert stream.num_tokens > 0
+
+
+def test_stream_cancellation_stops_generation(tiny_model):
+    stream = tiny_model.query_stream("where is the tower")
+    stream.cancel()
+    list(stream)
+    assert stream.cancelled
+    assert stream.num_tokens < 50
+
+
+def test_chunking_cuts_windows_from_original_text(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    paragraph = " ".join(["The Eiffel Tower is in Paris."] * 30)
+    context = f"Rome is in Italy.\n\n{paragraph}\n\nThe sky is blue."
+    for overlap in (0, 8):
+        teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                             settings=TeapotAISettings(verbose=False, chunk_overlap=overlap))
+        chunks = teapot_ai._chunk_document(context)
+        assert chunks[0] == "Rome is in Italy." and chunks[-1] == "The sky is blue."
+        windows = chunks[1:-1]
+        assert len(windows) > 1
+        assert all(window in paragraph for window in windows)
+        assert all(len(tokenizer(window)["input_ids"]) <= tokenizer.model_max_length for window in windows)
+        total_tokens = sum(len(tokenizer(window, add_special_tokens=False)["input_ids"]) for window in windows)
+        paragraph_tokens = len(tokenizer(paragraph, add_special_tokens=False)["input_ids"])
+        assert total_tokens == paragraph_tokens + overlap * (len(windows) - 1)
+
+
+def test_repeated_query_context_is_chunked_and_embedded_once(tiny_model):
+    context = "\n\n".join(f"Paragraph about the tower number {'one ' * i}" for i in range(10)) + " dog" * 80
+    tiny_model._context_cache.clear()
+    calls = []
+    chunk, embed = tiny_model._chunk_document, tiny_model._generate_document_embeddings
+    tiny_model._chunk_document = lambda text: calls.append("chunk") or chunk(text)
+    tiny_model._generate_document_embeddings = lambda docs: calls.append("embed") or embed(docs)
+    try:
+        first = tiny_model._query_prompt("where is the tower", context, "system", [])
+        second = tiny_model._query_prompt("where is the tower", context, "system", [])
+    finally:
+        del tiny_model._chunk_document, tiny_model._generate_document_embeddings
+    assert first == second
+    assert calls == ["chunk", "embed"]
+    assert tiny_model._context_cache.stats()["hits"] >= 1
+
+
+def test_generation_cache_skips_repeated_decodes(tiny_generator, tiny_embedding_model, tmp_path):
+    from transformers import AutoModelForSeq2SeqLM
+    # A local checkpoint, so generations can be shared on disk
+    tiny_generator[0].save_pretrained(tmp_path / "model")
+    model, tokenizer = AutoModelForSeq2SeqLM.from_pretrained(tmp_path / "model"), tiny_generator[1]
+    settings = TeapotAISettings(verbose=False, generation_cache_size=8, generation_cache_path=str(tmp_path / "cache.sqlite"))
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+    prompts = ["where is the tower", "what is the capital of italy", "where is the tower"]
+    expected = teapot_ai.generate_batch(prompts)
+    assert teapot_ai.generation_cache.stats()["misses"] == 3
+    assert teapot_ai.generation_cache.stats()["disk_size"] == 2
+
+    calls = []
+    model_generate = model.generate
+    model.generate = lambda *args, **kwargs: calls.append(1) or model_generate(*args, **kwargs)
+    try:
+        assert [teapot_ai.generate(prompt) for prompt in prompts] == expected
+        assert calls == []
+
+        # A second instance sharing the SQLite file is served from disk
+        other = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+        assert other.generate_batch(prompts) == expected
+        assert calls == [] and other.generation_cache.stats()["disk_hits"] == 2
+
+        teapot_ai.clear_cache()
+        assert teapot_ai.generate(prompts[0]) == expected[0]
+        assert calls == [1]
+    finally:
+        del model.generate
+
+
+def test_generation_cache_keys_identify_the_weights(tiny_generator, tiny_embedding_model, tmp_path):
+    import os
+    from transformers import AutoModelForSeq2SeqLM
+    tokenizer = tiny_generator[1]
+    settings = TeapotAISettings(verbose=False, generation_cache_size=8, generation_cache_path=str(tmp_path / "cache.sqlite"))
+
+    # Models built in memory have no revision: they never share entries or use the disk
+    first = TeapotAI(model=build_generator(seed=0)[0], tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+    second = TeapotAI(model=build_generator(seed=1)[0], tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+    assert first._generation_cache_keys(["dog"]) != second._generation_cache_keys(["dog"])
+    first.generate("dog")
+    assert first.generation_cache.stats()["disk_size"] == 0 and first.generation_cache.stats()["memory_size"] == 1
+
+    # A checkpoint saved again under the same path gets new keys
+    path = tmp_path / "model"
+    tiny_generator[0].save_pretrained(path)
+    before = TeapotAI(model=AutoModelForSeq2SeqLM.from_pretrained(path), tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+    key = before._generation_cache_keys(["dog"])[0]
+    build_generator(seed=1)[0].save_pretrained(path)
+    for name in os.listdir(path):
+        os.utime(path / name, (os.path.getmtime(path / name) + 10,) * 2)
+    after = TeapotAI(model=AutoModelForSeq2SeqLM.from_pretrained(path), tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+    assert after._generation_cache_keys(["dog"])[0] != key
+    # The loaded weights keep the key they were loaded with
+    assert before._generation_cache_keys(["dog"])[0] == key
+
+
+def test_extract_generates_all_fields_in_one_batch(tiny_generator, tiny_embedding_model):
+    from typing import Optional
+    from pydantic import BaseModel
+
+    class Landmark(BaseModel):
+        city: Optional[str]
+        height: Optional[float]
+        floors: Optional[int]
+        famous: Optional[bool]
+
+    model, tokenizer = tiny_generator
+    calls = []
+    model_generate = model.generate
+    model.generate = lambda *args, **kwargs: calls.append(kwargs) or model_generate(*args, **kwargs)
+    try:
+        for encoder_reuse in (False, True):
+            teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                                 settings=TeapotAISettings(verbose=False, extract_encoder_reuse=encoder_reuse))
+            calls.clear()
+            result = teapot_ai.extract(Landmark, query="the eiffel tower", context="The tower in Paris is 330 meters tall.")
+            assert isinstance(result, Landmark)
+            assert len(calls) == 1
+            assert ("encoder_outputs" in calls[0]) == encoder_reuse
+    finally:
+        del model.generate
+
+
+def test_parse_fields_by_type(tiny_model):
+    from typing import Optional
+    annotations = [int, Optional[int], float, bool, Optional[bool], str, float, int]
+    results = ["about 12 floors", "-3", "330.5 meters", "Yes", "nothing", "  Paris ", "1.2.3", "99999999999999999999"]
+    assert tiny_model._parse_fields(annotations, results) == [12, -3, 330.5, True, None, "Paris", None, 99999999999999999999]
+    with pytest.raises(ValueError):
+        tiny_model._parse_fields([list], ["a"])
+
+
+def test_import_does_not_load_heavy_dependencies():
+    import os
+    import subprocess
+    import sys
+    import teapotai
+    code = "import sys, teapotai; print(sorted(m for m in ('torch', 'transformers', 'sklearn', 'langsmith', 'pkg_resources') if m in sys.modules))"
+    # The child process must find the package the tests run against, installed or not
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(teapotai.__file__)))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([src_dir, os.environ.get("PYTHONPATH", "")])}
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env).stdout
+    assert output.strip() == "[]"
+
+
+def test_models_load_on_first_use(tiny_generator, tiny_embedding_model, monkeypatch):
+    import teapotai.teapotai as teapotai_module
+    from teapotai import ModelRegistry
+    model, tokenizer = tiny_generator
+    loaded = []
+    monkeypatch.setattr(teapotai_module, "model_registry", ModelRegistry())
+    monkeypatch.setattr(teapotai_module, "_load_model", lambda: loaded.append("model") or model)
+    monkeypatch.setattr(teapotai_module, "_load_tokenizer", lambda: loaded.append("tokenizer") or tokenizer)
+    monkeypatch.setattr(teapotai_module, "_load_embedding_model", lambda: loaded.append("embedding") or tiny_embedding_model)
+
+    teapot_ai = TeapotAI(settings=TeapotAISettings(verbose=False))
+    assert loaded == [] and teapot_ai.rag("where is the tower") == []
+    teapot_ai.generate("where is the tower")
+    assert sorted(loaded) == ["model", "tokenizer"]
+    teapot_ai.add_documents(["The Eiffel Tower is in Paris."])
+    assert sorted(loaded) == ["embedding", "model", "tokenizer"]
+    assert teapot_ai.documents == ["The Eiffel Tower is in Paris."]
+
+    loaded.clear()
+    warm = TeapotAI(settings=TeapotAISettings(verbose=False, background_warm_up=True, shared_models=False))
+    warm.warm_up(background=True).join()
+    assert sorted(loaded) == ["embedding", "model", "tokenizer"]
+
+
+def test_refusal_detector_loads_from_package_resources(tiny_model):
+    assert tiny_model._refusal_detector is None
+    assert isinstance(tiny_model.refusal_detector, RefusalClassifier)
+
+
+def test_refusal_classifier_matches_sklearn(tmp_path):
+    joblib = pytest.importorskip("joblib")
+    pytest.importorskip("sklearn")
+    from importlib import resources
+    with resources.files("teapotai").joinpath("teapot_refusal_classifier.joblib").open("rb") as f:
+        classifier = joblib.load(f)
+    exported = RefusalClassifier.from_sklearn(classifier)
+    exported.save(tmp_path / "classifier.npz")
+    loaded = RefusalClassifier.load(tmp_path / "classifier.npz")
+    X = np.random.RandomState(0).randn(20, classifier.coefs_[0].shape[0]) * 0.5
+    np.testing.assert_allclose(loaded.predict_proba(X), classifier.predict_proba(X), atol=1e-5)
+
+
+def test_detect_refusals_batches_and_reuses_embeddings(tiny_model):
+    rng = np.random.RandomState(0)
+    tiny_model.refusal_detector = RefusalClassifier([rng.randn(32, 16), rng.randn(16, 1)], [rng.randn(16), rng.randn(1)])
+    texts = ["I'm sorry, I can't help", "the tower is in paris", "rome", "the tower is in paris", "dog " * 100]
+    expected = [True] + [
+        bool(tiny_model.refusal_detector.predict_proba([np.mean(tiny_model.embedding_model(text, truncation=True)[0], axis=0)])[0, 1] > 0.5)
+        for text in texts[1:]
+    ]
+    calls = []
+    embed = tiny_model._embed
+    tiny_model._embed = lambda texts, **kwargs: calls.append(list(texts)) or embed(texts, **kwargs)
+    try:
+        tiny_model._embedding_cache.clear()
+        assert tiny_model.detect_refusals(texts) == expected
+        assert tiny_model.detect_refusals(texts[1:3]) == expected[1:3]
+    finally:
+        del tiny_model._embed
+        tiny_model._refusal_detector = None
+    # One pass over the distinct texts the heuristic could not resolve, then cache hits
+    assert calls == [["the tower is in paris", "rome", "dog " * 100]]
+
+
+def test_speculative_decoding_matches_greedy(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    draft_model, _ = build_generator(seed=1)
+    prompts = ["where is the eiffel tower in paris", "rome is the capital of italy"]
+    greedy = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                      settings=TeapotAISettings(verbose=False, generation_max_length=40))
+    expected = [greedy.generate(prompt) for prompt in prompts]
+
+    for mode, draft in (("prompt_lookup", None), ("draft_model", draft_model), ("draft_model", model)):
+        settings = TeapotAISettings(verbose=False, generation_max_length=40, speculative_decoding=mode, speculative_num_tokens=4)
+        teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings, draft_model=draft)
+        assert [teapot_ai.generate(prompt) for prompt in prompts] == expected
+        assert "".join(teapot_ai.generate_stream(prompts[0])) == expected[0]
+        stats = teapot_ai.speculative_stats.stats()
+        assert stats["generations"] == 3 and stats["proposed"] > 0
+        if draft is model:
+            # A draft model identical to the main model is always right
+            assert stats["acceptance_rate"] == 1.0 and stats["tokens_per_step"] > 1
+
+
+def test_speculative_decoding_follows_the_generation_config(tiny_embedding_model):
+    # A separate model, so the beam-search config does not leak into other tests
+    model, tokenizer = build_generator()
+    model.generation_config.num_beams = 4
+    prompts = ["where is the eiffel tower in paris", "dog field"]
+    outputs = {}
+    for mode in ("off", "prompt_lookup"):
+        settings = TeapotAISettings(verbose=False, generation_max_length=20, speculative_decoding=mode)
+        teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+        outputs[mode] = [teapot_ai.generate(prompt) for prompt in prompts]
+    assert outputs["prompt_lookup"] == outputs["off"]
+
+    from teapotai.speculative import supports_speculative_decoding
+    assert not supports_speculative_decoding(model)
+    # The settings always pass the decoding strategy, which overrides the checkpoint's beam search
+    assert supports_speculative_decoding(model, teapot_ai._generation_kwargs())
+    assert not supports_speculative_decoding(model, {"num_beams": 2})
+
+
+def test_generation_settings_override_the_checkpoint_config(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    beam_model, _ = build_generator()
+    beam_model.generation_config.num_beams = 4
+    beam_model.generation_config.do_sample = True
+    settings = TeapotAISettings(verbose=False, generation_max_length=20, generation_cache_size=8)
+    greedy = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+    teapot_ai = TeapotAI(model=beam_model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, settings=settings)
+    assert teapot_ai._generation_kwargs()["num_beams"] == 1 and teapot_ai._generation_kwargs()["do_sample"] is False
+    assert teapot_ai.generate("dog field") == greedy.generate("dog field")
+
+    # Cache keys follow the checkpoint's generation config where the settings do not override it
+    key = teapot_ai._generation_cache_keys(["dog field"])[0]
+    beam_model.generation_config.no_repeat_ngram_size = 2
+    assert teapot_ai._generation_cache_keys(["dog field"])[0] != key
+
+
+def test_generation_settings(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                         settings=TeapotAISettings(verbose=False, generation_max_length=10))
+    outputs = teapot_ai._generate_ids(tokenizer("where is the tower", return_tensors="pt"))
+    assert outputs.shape[1] <= 10
+
+    with pytest.raises(ValueError):
+        TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                 settings=TeapotAISettings(speculative_decoding="medusa"))
+    with pytest.raises(ValueError):
+        TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                 settings=TeapotAISettings(speculative_decoding="draft_model"))
+
+
+def _tools():
+    from pydantic import BaseModel
+    from teapotai import TeapotTool
+
+    class Location(BaseModel):
+        city: str
+
+    def weather(location):
+        return "sunny"
+
+    async def population(location):
+        return "3 million"
+
+    return [
+        TeapotTool(name="weather", description="look up the weather in a city", schema=Location, fn=weather),
+        TeapotTool(name="population", description="count the people living in a city", schema=Location, fn=population, directly_return_result=True),
+    ]
+
+
+def test_tools_are_routed_by_description_embeddings(tiny_generator, tiny_embedding_model, monkeypatch):
+    model, tokenizer = tiny_generator
+    tools = _tools()
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, tools=tools,
+                         settings=TeapotAISettings(verbose=False, tool_routing_margin=0.0))
+    llm_calls = []
+    monkeypatch.setattr(teapot_ai, "_select_tool_with_llm", lambda query: llm_calls.append(query) or tools[0])
+    queries = ["look up the weather in a city", "count the people living in a city"]
+    assert teapot_ai._select_tools(queries) == tools
+    assert llm_calls == []
+
+    # Ambiguous scores fall back to the model
+    teapot_ai.settings = TeapotAISettings(verbose=False, tool_routing_margin=2.0)
+    assert teapot_ai._select_tools(queries) == [tools[0], tools[0]]
+    assert llm_calls == queries
+
+
+def test_tool_routing_needs_a_minimum_similarity(tiny_generator, tiny_embedding_model, monkeypatch):
+    model, tokenizer = tiny_generator
+    tools = _tools()[:1]
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, tools=tools,
+                         settings=TeapotAISettings(verbose=False, tool_routing_min_score=0.5))
+    llm_calls = []
+    monkeypatch.setattr(teapot_ai, "_select_tool_with_llm", lambda query: llm_calls.append(query) or None)
+    monkeypatch.setattr(teapot_ai, "_tool_description_embeddings", lambda: np.array([[1.0, 0.0]], dtype=np.float32))
+    # The first query is close to the only tool's description, the second unrelated to it
+    query_embeddings = {"weather in paris": [0.9, 0.1], "who wrote hamlet": [0.1, 0.9]}
+    monkeypatch.setattr(teapot_ai, "_embed_cached", lambda texts: np.array([query_embeddings[text] for text in texts], dtype=np.float32))
+
+    assert teapot_ai._select_tools(["weather in paris", "who wrote hamlet"]) == [tools[0], None]
+    assert llm_calls == ["who wrote hamlet"]
+
+    # With several tools, a clear winner below the floor is not picked either
+    teapot_ai.tools = _tools()
+    monkeypatch.setattr(teapot_ai, "_tool_description_embeddings", lambda: np.array([[1.0, 0.0], [-1.0, 0.0]], dtype=np.float32))
+    assert teapot_ai._select_tools(["who wrote hamlet"]) == [None]
+
+
+def test_tool_functions_run_concurrently_with_timeouts(tiny_model):
+    import time
+    from teapotai import TeapotTool
+
+    def slow(arguments):
+        time.sleep(0.5)
+        return arguments
+
+    async def fast(arguments):
+        return arguments * 2
+
+    slow_tool = TeapotTool(name="slow", description="", schema=TeapotAISettings, fn=slow)
+    fast_tool = TeapotTool(name="fast", description="", schema=TeapotAISettings, fn=fast)
+    hurried_tool = TeapotTool(name="hurried", description="", schema=TeapotAISettings, fn=slow, timeout=0.05)
+    started_at = time.perf_counter()
+    results = tiny_model._run_tools([(slow_tool, 1), (slow_tool, 2), (fast_tool, 3), (hurried_tool, 4)])
+    assert results == [1, 2, 6, "Error: hurried timed out"]
+    assert time.perf_counter() - started_at < 0.9
+
+
+def test_tool_answers_reuse_retrieval(tiny_generator, tiny_embedding_model, monkeypatch):
+    model, tokenizer = tiny_generator
+    tools = _tools()
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, tools=tools,
+                         documents=["The Eiffel Tower is in Paris."],
+                         settings=TeapotAISettings(verbose=False, generation_max_length=12))
+    monkeypatch.setattr(teapot_ai, "detect_refusals", lambda texts: [True] * len(texts))
+    rag_calls = []
+    rag_chunks = teapot_ai._rag_chunks
+    monkeypatch.setattr(teapot_ai, "_rag_chunks", lambda queries: rag_calls.extend(queries) or rag_chunks(queries))
+
+    monkeypatch.setattr(teapot_ai, "_select_tools", lambda queries: [tools[1]] * len(queries))
+    assert teapot_ai.query("how many people live in paris") == "3 million"
+
+    monkeypatch.setattr(teapot_ai, "_select_tools", lambda queries: [tools[0]] * len(queries))
+    prompts = []
+    generate_batch = teapot_ai.generate_batch
+    monkeypatch.setattr(teapot_ai, "generate_batch", lambda texts: prompts.extend(texts) or generate_batch(texts))
+    teapot_ai.query("what is the weather in paris")
+    # Tool argument extraction retrieves for its own prompt; answering does not retrieve again
+    assert [query for query in rag_calls if not query.startswith("Query:")] == ["how many people live in paris", "what is the weather in paris"]
+    followups = [prompt for prompt in prompts if "=> sunny" in prompt]
+    assert len(followups) == 1 and "The Eiffel Tower is in Paris." in followups[0]
+
+
+def test_tool_results_survive_context_packing(tiny_generator, tiny_embedding_model, monkeypatch):
+    model, tokenizer = tiny_generator
+    tools = _tools()
+    documents = [" ".join(["The Eiffel Tower is in Paris and it is made of iron."] * 4), "Paris is the capital of France."]
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, tools=tools, documents=documents,
+                         settings=TeapotAISettings(verbose=False, generation_max_length=8, max_context_length=100, rag_similarity_threshold=-1.0))
+    query = "what is the weather in paris"
+    # The first prompt leaves no room for the tool result
+    first = teapot_ai.pack_context(query)
+    assert first.dropped == [] and first.prompt_tokens > 95
+    monkeypatch.setattr(teapot_ai, "detect_refusals", lambda texts: [True] * len(texts))
+    monkeypatch.setattr(teapot_ai, "_select_tools", lambda queries: [tools[0]] * len(queries))
+    prompts = []
+    generate_batch = teapot_ai.generate_batch
+    monkeypatch.setattr(teapot_ai, "generate_batch", lambda texts: prompts.extend(texts) or generate_batch(texts))
+    teapot_ai.query(query)
+
+    followups = [prompt for prompt in prompts if "=> sunny" in prompt]
+    assert len(followups) == 1 and followups[0].endswith(f"\n{DEFAULT_SYSTEM_PROMPT}\n{query}")
+    # The least relevant document made room for the tool result
+    assert len(tokenizer(followups[0])["input_ids"]) <= 100 and documents[1] in followups[0]
+
+
+def test_metrics_time_each_stage(tiny_generator, tiny_embedding_model):
+    model, tokenizer = tiny_generator
+    documents = ["The Eiffel Tower is in Paris.", "Rome is the capital of Italy."]
+    plain = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, documents=documents,
+                     settings=TeapotAISettings(verbose=False, generation_max_length=20, langsmith_tracing=False))
+    instrumented = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model, documents=documents,
+                            settings=TeapotAISettings(verbose=False, generation_max_length=20, metrics=True))
+    events = []
+    instrumented.metrics.add_callback(events.append)
+    context = " ".join(["The tower is tall."] * 200)
+    assert instrumented.query("where is the tower", context=context) == plain.query("where is the tower", context=context)
+    assert plain.metrics.stats()["stages"] == {}
+
+    stats = instrumented.metrics.stats()
+    assert {"chunking", "tokenization", "query_embedding", "similarity", "encoder", "decoder", "decoding"} <= set(stats["stages"])
+    assert stats["tokens_in"] > 0 and 0 < stats["tokens_out"] < 20
+    assert [event for event in events if event["stage"] == "decoder"][0]["tokens_out"] == stats["tokens_out"]
+
+
+def test_options_are_scored_without_generating(tiny_generator, tiny_embedding_model, monkeypatch):
+    import torch
+    model, tokenizer = tiny_generator
+    teapot_ai = TeapotAI(model=model, tokenizer=tokenizer, embedding_model=tiny_embedding_model,
+                         documents=["Water boils at a temperature of 100 degrees."],
+                         settings=TeapotAISettings(verbose=False, generation_batch_size=2, allow_tool_use=False))
+    options = ["50°C", "100 degrees Celsius", "150°C", "it does not boil"]
+    monkeypatch.setattr(teapot_ai.model, "generate", lambda *args, **kwargs: pytest.fail("options must not be generated"))
+
+    best, scores = teapot_ai("At what temperature does water boil?", options=options, return_scores=True)
+    assert best == options[int(np.argmax(scores))] and len(scores) == len(options)
+    assert teapot_ai("At what temperature does water boil?", options=options) == best
+
+    # Each score is the mean token log-likelihood of a full teacher-forced forward pass
+    inputs = tokenizer(teapot_ai.pack_context("At what temperature does water boil?").prompt, return_tensors="pt")
+    for option, score in zip(options, scores):
+        with torch.no_grad():
+            loss = model(**inputs, labels=tokenizer(option, return_tensors="pt")["input_ids"]).loss
+        assert score == pytest.approx(-loss.item(), abs=1e-4)
+
+    with pytest.raises(ValueError):
+        teapot_ai("question", options=[])
@@ -0,0 +1,83 @@
+"""
+Tiny, randomly initialized stand-ins for the TeapotLLM and teapotembedding models.
+
+These let the test suite exercise TeapotAI end to end without network access. The
+models produce meaningless text, so tests built on them check behaviour (shapes,
+ordering, caching, equivalence between code paths) rather than answer quality.
+"""
+from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, processors, decoders
+from transformers import (
+    PreTrainedTokenizerFast,
+    T5Config,
+    T5ForConditionalGeneration,
+    BertConfig,
+    BertModel,
+    pipeline,
+)
+import torch
+
+WORDS = """
+the a an is are was of and to in on for with what where who when how why which
+capital city country paris france rome italy europe tower eiffel built tall meters
+height designed completed dog cat water boils temperature sky blue sun moon
+yes no true false none i'm sorry don't know information about this that it
+user assistant system query context extract field name age number weather
+""".split()
+
+MAX_LENGTH = 64
+
+
+def build_vocab():
+    vocab = {"<pad>": 0, "</s>": 1, "<unk>": 2, "[CLS]": 3, "[SEP]": 4}
+    for word in WORDS:
+        vocab.setdefault(word, len(vocab))
+    return vocab
+
+
+def build_tokenizer(cls_format: bool = False, model_max_length: int = MAX_LENGTH) -> PreTrainedTokenizerFast:
+    """
+    Build a word-level fast tokenizer. T5-style (``... </s>``) by default, or BERT-style
+    (``[CLS] ... [SEP]``) when ``cls_format`` is set.
+    """
+    vocab = build_vocab()
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.Lowercase()
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.decoder = decoders.WordPiece(prefix="##")
+    if cls_format:
+        tokenizer.post_processor = processors.TemplateProcessing(
+            single="[CLS] $A [SEP]", special_tokens=[("[CLS]", 3), ("[SEP]", 4)]
+        )
+        return PreTrainedTokenizerFast(
+            tokenizer_object=tokenizer, pad_token="<pad>", unk_token="<unk>",
+            cls_token="[CLS]", sep_token="[SEP]", model_max_length=model_max_length,
+        )
+    tokenizer.post_processor = processors.TemplateProcessing(single="$A </s>", special_tokens=[("</s>", 1)])
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>", unk_token="<unk>",
+        model_max_length=model_max_length,
+    )
+
+
+def build_generator(seed: int = 0):
+    """Return a (model, tokenizer) pair for a tiny T5 seq2seq model."""
+    torch.manual_seed(seed)
+    config = T5Config(
+        vocab_size=len(build_vocab()), d_model=32, d_kv=8, d_ff=64, num_layers=2, num_heads=4,
+        decoder_start_token_id=0, pad_token_id=0, eos_token_id=1, initializer_factor=3.0,
+    )
+    model = T5ForConditionalGeneration(config).eval()
+    # Untrained models tend to emit only padding, which decodes to empty strings
+    model.generation_config.suppress_tokens = [0]
+    return model, build_tokenizer()
+
+
+def build_embedding_pipeline(seed: int = 0):
+    """Return a feature-extraction pipeline around a tiny BERT encoder."""
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=len(build_vocab()), hidden_size=32, num_hidden_layers=2, num_attention_heads=4,
+        intermediate_size=64, max_position_embeddings=MAX_LENGTH,
+    )
+    model = BertModel(config).eval()
+    return pipeline("feature-extraction", model=model, tokenizer=build_tokenizer(cls_format=True), truncation=True)